@@ -1,89 +1,368 @@
-from datetime import timedelta
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
+import json
+import uuid
+from datetime import datetime
+from typing import List, Optional
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey, RSAPublicKey
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import Select, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.session import get_db
+from app.db.session import SessionLocal, get_db
 from app.db import models
 from app.schemas import user as user_schema
 from app.schemas.audit import AuditLogOut
 from app.core import security
+from app.core.config import settings
+from app.core.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+from app.services.audit_writer import client_ip
 from app.services.crypto_engine import crypto_engine
+from app.services.identity_cache import CachedUser, identity_cache
+from app.services.key_pool import rsa_key_pool
+from app.services.metrics import timed
+from app.services.public_key_cache import public_key_cache
+from app.services.session_keys import UnlockedKeys, unlocked_key_cache
+from app.services.throttle import ACTION_KDF, ACTION_LOGIN, throttle
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 
 @router.post("/register", response_model=user_schema.UserPublic)
-def register(user_in: user_schema.UserCreate, db: Session = Depends(get_db)):
+async def register(user_in: user_schema.UserCreate, db: AsyncSession = Depends(get_db)):
     # 1. Verificar si el usuario ya existe
-    user = db.query(models.User).filter(models.User.username == user_in.username).first()
-    if user:
+    result = await db.execute(select(models.User).where(models.User.username == user_in.username))
+    if result.scalars().first():
         raise HTTPException(status_code=400, detail="El nombre de usuario ya está registrado.")
     
-    # 2. Generar par de llaves RSA para el usuario
-    priv_pem, pub_pem = crypto_engine.generate_rsa_key_pair()
+    # 2. Tomar un par de llaves RSA de la reserva pre-generada (o generarlo si está vacía)
+    priv_pem, pub_pem = await rsa_key_pool.acquire()
     
     # 3. Cifrar la llave privada con la contraseña del usuario (Zero-Knowledge approach)
-    enc_priv_key = crypto_engine.encrypt_rsa_private_key(priv_pem, user_in.password.get_secret_value())
+    password = user_in.password.get_secret_value()
+    enc_priv_key = await crypto_engine.aencrypt_rsa_private_key(priv_pem, password)
     
-    # 4. Crear el registro en la BD
+    # 4. KEK simétrica para los accesos propios, envuelta con la llave pública (operación RSA barata)
+    public_key_pem = pub_pem.decode('utf-8')
+    encrypted_kek = None
+    if settings.USER_KEK_ENABLED:
+        encrypted_kek = await crypto_engine.awrap_aes_key(crypto_engine.generate_kek(), public_key_pem)
+
+    # 5. Crear el registro en la BD
     db_user = models.User(
+        id=uuid.uuid4(),
         username=user_in.username,
-        password_hash=security.get_password_hash(user_in.password.get_secret_value()),
-        public_key=pub_pem.decode('utf-8'),
-        encrypted_private_key=enc_priv_key
+        password_hash=await crypto_engine.aget_password_hash(password),
+        public_key=public_key_pem,
+        encrypted_private_key=enc_priv_key,
+        encrypted_kek=encrypted_kek
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    # Contador del feed de cambios (/api/changes)
+    db.add(models.UserChangeSequence(user_id=db_user.id, last_seq=0))
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 @router.post("/login")
-def login(db: Session = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()):
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
-    if not user or not security.verify_password(form_data.password, user.password_hash):
+async def login(request: Request, db: AsyncSession = Depends(get_db), form_data: OAuth2PasswordRequestForm = Depends()):
+    # Antes de gastar CPU en el hash: cuota por usuario e IP y backoff tras fallos (429)
+    ip_address = client_ip(request)
+    throttle_user = form_data.username[:50]
+    await throttle.check(ACTION_LOGIN, throttle_user, ip_address)
+
+    result = await db.execute(select(models.User).where(models.User.username == form_data.username))
+    user = result.scalars().first()
+    if not user:
+        # Mismo coste que una verificación real: no revelamos qué usuarios existen
+        await crypto_engine.adummy_verify_password(form_data.password)
+        await throttle.failure(ACTION_LOGIN, throttle_user, ip_address)
+        raise HTTPException(status_code=400, detail="Usuario o contraseña incorrectos.")
+
+    valid, new_hash = await crypto_engine.averify_and_update_password(form_data.password, user.password_hash)
+    if not valid:
+        await throttle.failure(ACTION_LOGIN, throttle_user, ip_address)
         raise HTTPException(status_code=400, detail="Usuario o contraseña incorrectos.")
+    await throttle.success(ACTION_LOGIN, throttle_user)
+    if new_hash:
+        # Rehash transparente: esquema obsoleto (p.ej. bcrypt -> argon2id) o parámetros cambiados
+        user.password_hash = new_hash
+        await db.commit()
     
-    access_token = security.create_access_token(data={"sub": user.username})
+    claims = {"sub": user.username}
+    if settings.TOKEN_INCLUDE_USER_ID:
+        claims["uid"] = str(user.id)
     return {
-        "access_token": security.create_access_token({"sub": user.username}),
+        "access_token": security.create_access_token(claims),
         "token_type": "bearer",
         "user_id": str(user.id), 
         "username": user.username 
     }
 
-def get_current_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)) -> models.User:
-    username = security.decode_token(token)
+async def get_current_user(db: AsyncSession = Depends(get_db), token: str = Depends(oauth2_scheme)) -> CachedUser:
+    """
+    Resuelve el usuario del token. Primero consulta la caché de identidades;
+    si falla, busca por clave primaria (claim "uid") o, en tokens antiguos, por username.
+    """
+    with timed("jwt"):
+        claims = security.decode_token_claims(token)
+    username = claims.get("sub") if claims else None
     if username is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if user is None:
+
+    user_id = None
+    if claims.get("uid"):
+        try:
+            user_id = uuid.UUID(claims["uid"])
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
+    cache_key = f"id:{user_id}" if user_id else f"sub:{username}"
+
+    user = identity_cache.get(cache_key)
+    if user is not None:
+        return user
+
+    # Solo las columnas que necesitan las rutas, sin materializar la entidad ORM
+    query = select(
+        models.User.id, models.User.username, models.User.public_key,
+        models.User.encrypted_private_key, models.User.encrypted_kek
+    )
+    if user_id:
+        query = query.where(models.User.id == user_id)
+    else:
+        query = query.where(models.User.username == username)
+    row = (await db.execute(query)).first()
+    if row is None or row.username != username:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Usuario no encontrado")
+
+    user = CachedUser(row.id, row.username, row.public_key, row.encrypted_private_key, row.encrypted_kek)
+    identity_cache.put(cache_key, user)
     return user
 
 
+async def current_public_key(db: AsyncSession, user: CachedUser, exclusive: bool = False) -> RSAPublicKey:
+    """
+    Llave pública vigente de `user`, leída de la base de datos y bloqueando su
+    fila hasta el commit (FOR SHARE, o FOR UPDATE con `exclusive` si la
+    transacción va a modificarla).
+
+    La identidad cacheada puede ser anterior a una rotación del par hecha en otro
+    worker: la invalidación de cachés es local a cada proceso. Con el bloqueo, la
+    finalización de la rotación espera a que esta transacción confirme y re-envuelve
+    después lo que se haya envuelto con la llave anterior.
+    """
+    result = await db.execute(
+        select(models.User.public_key).where(models.User.id == user.id).with_for_update(read=not exclusive)
+    )
+    public_key_pem = result.scalar_one()
+    if public_key_pem != user.public_key:
+        # Este worker aún tenía la identidad de antes de la rotación
+        identity_cache.invalidate_user(user.id)
+    return public_key_cache.get(user.id, public_key_pem)
+
+
+async def _unwrap_kek(user: CachedUser, private_key: RSAPrivateKey) -> Optional[bytes]:
+    if not settings.USER_KEK_ENABLED or user.encrypted_kek is None:
+        return None
+    try:
+        return await crypto_engine.aunwrap_aes_key(user.encrypted_kek, private_key)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Contraseña incorrecta o error de llave")
+
+
+async def resolve_user_keys(
+    user: CachedUser,
+    x_user_password: Optional[str],
+    x_unlock_token: Optional[str],
+    ip_address: Optional[str] = None,
+) -> UnlockedKeys:
+    """
+    Obtiene la llave privada RSA del usuario ya cargada y su KEK.
+    Si llega un token de desbloqueo vigente se usa el material cacheado (sin KDF);
+    en caso contrario se deriva con la contraseña como antes, sujeto a la
+    limitación por usuario e IP (`ip_address`) y al backoff tras fallos.
+    """
+    if x_unlock_token:
+        keys = await unlocked_key_cache.get(x_unlock_token, user.id)
+        if keys is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token de desbloqueo inválido o expirado")
+        return keys
+    if not x_user_password:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Se requiere contraseña o token de desbloqueo")
+    await throttle.check(ACTION_KDF, str(user.id), ip_address)
+    try:
+        private_key = await crypto_engine.aload_rsa_private_key(user.encrypted_private_key, x_user_password)
+    except ValueError:
+        await throttle.failure(ACTION_KDF, str(user.id), ip_address)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Contraseña incorrecta o error de llave")
+    await throttle.success(ACTION_KDF, str(user.id))
+    return UnlockedKeys(private_key, await _unwrap_kek(user, private_key))
+
+
+@router.post("/unlock", response_model=user_schema.UnlockResponse)
+async def unlock(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user),
+    x_user_password: str = Header(..., description="Tu contraseña para desbloquear la llave privada")
+):
+    """
+    Deriva la llave privada una sola vez y la mantiene en memoria durante
+    UNLOCK_TTL_SECONDS, junto a la KEK del usuario. Las lecturas y comparticiones
+    posteriores pueden enviar el header `X-Unlock-Token` en lugar de la contraseña.
+    Si el bundle usa un KDF o parámetros obsoletos, se re-envuelve con los actuales;
+    si el usuario aún no tiene KEK, se le crea.
+    """
+    ip_address = client_ip(request)
+    await throttle.check(ACTION_KDF, str(current_user.id), ip_address)
+    try:
+        private_key, new_bundle = await crypto_engine.aunlock_rsa_private_key(current_user.encrypted_private_key, x_user_password)
+    except ValueError:
+        await throttle.failure(ACTION_KDF, str(current_user.id), ip_address)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Contraseña incorrecta o error de llave")
+    await throttle.success(ACTION_KDF, str(current_user.id))
+
+    changed = False
+    if new_bundle:
+        # Condicionado al bundle leído: si otra petición ya lo migró, no lo pisamos
+        await db.execute(update(models.User).where(
+            models.User.id == current_user.id,
+            models.User.encrypted_private_key == current_user.encrypted_private_key
+        ).values(encrypted_private_key=new_bundle))
+        changed = True
+
+    kek = await _unwrap_kek(current_user, private_key)
+    if settings.USER_KEK_ENABLED and kek is None:
+        # Usuario anterior a las KEK: se crea ahora (solo si nadie la creó en paralelo)
+        kek = crypto_engine.generate_kek()
+        # FOR UPDATE: la fila se modifica a continuación en esta misma transacción
+        encrypted_kek = await crypto_engine.awrap_aes_key(kek, await current_public_key(db, current_user, exclusive=True))
+        result = await db.execute(update(models.User).where(
+            models.User.id == current_user.id,
+            models.User.encrypted_kek.is_(None)
+        ).values(encrypted_kek=encrypted_kek))
+        if result.rowcount == 0:
+            stored = (await db.execute(select(models.User.encrypted_kek).where(models.User.id == current_user.id))).scalar_one()
+            kek = await crypto_engine.aunwrap_aes_key(stored, private_key)
+        changed = True
+
+    if changed:
+        await db.commit()
+        identity_cache.invalidate_user(current_user.id)
+
+    token = await unlocked_key_cache.put(current_user.id, UnlockedKeys(private_key, kek))
+    return {"unlock_token": token, "expires_in": settings.UNLOCK_TTL_SECONDS}
+
+
+@router.post("/lock", status_code=status.HTTP_204_NO_CONTENT)
+async def lock(
+    current_user: CachedUser = Depends(get_current_user),
+    x_unlock_token: str = Header(..., description="Token de desbloqueo a invalidar")
+):
+    """Invalida un token de desbloqueo concreto (en todos los workers)."""
+    await unlocked_key_cache.revoke(x_unlock_token, current_user.id)
+    return None
+
+
+@router.post("/logout", status_code=status.HTTP_204_NO_CONTENT)
+async def logout(current_user: CachedUser = Depends(get_current_user)):
+    """Elimina todas las llaves desbloqueadas del usuario (en todos los workers)."""
+    await unlocked_key_cache.revoke_user(current_user.id)
+    return None
+
+
+def _audit_query(
+    user_id: uuid.UUID,
+    since: Optional[datetime],
+    until: Optional[datetime],
+    action: Optional[str],
+) -> Select:
+    """Consulta base (solo columnas) de los logs de un usuario con los filtros comunes."""
+    query = select(
+        models.AuditLog.id, models.AuditLog.action, models.AuditLog.resource_id,
+        models.AuditLog.ip_address, models.AuditLog.timestamp
+    ).where(models.AuditLog.user_id == user_id)
+    if since:
+        query = query.where(models.AuditLog.timestamp >= since)
+    if until:
+        query = query.where(models.AuditLog.timestamp < until)
+    if action:
+        query = query.where(models.AuditLog.action == action)
+    return query.order_by(models.AuditLog.timestamp.desc(), models.AuditLog.id.desc())
+
+
 @router.get("/audit", response_model=List[AuditLogOut]) 
-def get_my_audit_logs(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def get_my_audit_logs(
+    response: Response,
+    limit: int = Query(settings.PAGE_SIZE_DEFAULT, ge=1, le=settings.PAGE_SIZE_MAX),
+    cursor: Optional[str] = Query(None, description=f"Valor de la cabecera {NEXT_CURSOR_HEADER} de la página anterior"),
+    since: Optional[datetime] = Query(None, description="Desde (inclusive)"),
+    until: Optional[datetime] = Query(None, description="Hasta (exclusivo)"),
+    action: Optional[str] = Query(None, max_length=50),
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
     """
     Retorna los logs de actividad del usuario actual de forma validada.
+    Paginado por cursor sobre (timestamp, id), del más reciente al más antiguo.
     """
-    logs = db.query(models.AuditLog).filter(
-        models.AuditLog.user_id == current_user.id
-    ).order_by(models.AuditLog.timestamp.desc()).all()
-    
-    return logs
+    query = _audit_query(current_user.id, since, until, action)
+    if cursor:
+        try:
+            last_timestamp, last_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        query = query.where(tuple_(models.AuditLog.timestamp, models.AuditLog.id) < tuple_(last_timestamp, last_id))
+
+    result = await db.execute(query.limit(limit + 1))
+    rows = result.all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return [row._asdict() for row in rows]
+
+
+@router.get("/audit/export")
+async def export_my_audit_logs(
+    since: Optional[datetime] = Query(None, description="Desde (inclusive)"),
+    until: Optional[datetime] = Query(None, description="Hasta (exclusivo)"),
+    action: Optional[str] = Query(None, max_length=50),
+    current_user: CachedUser = Depends(get_current_user)
+):
+    """
+    Exporta los logs como NDJSON (un objeto JSON por línea).
+    Las filas se leen de un cursor del lado del servidor y se envían según llegan,
+    sin cargar el histórico completo en memoria.
+    """
+    query = _audit_query(current_user.id, since, until, action).execution_options(
+        yield_per=settings.AUDIT_EXPORT_BATCH_SIZE
+    )
+
+    async def rows_as_ndjson():
+        # Sesión propia: la de la dependencia se cierra antes de que termine el streaming
+        async with SessionLocal() as session:
+            result = await session.stream(query)
+            async for row in result:
+                yield json.dumps({
+                    "id": str(row.id),
+                    "action": row.action,
+                    "resource_id": str(row.resource_id) if row.resource_id else None,
+                    "ip_address": str(row.ip_address) if row.ip_address else None,
+                    "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+                }) + "\n"
+
+    return StreamingResponse(rows_as_ndjson(), media_type="application/x-ndjson")
 
 @router.get("/users", response_model=List[user_schema.UserPublic])
-def get_all_users(
-    db: Session = Depends(get_db), 
-    current_user: models.User = Depends(get_current_user)
+async def get_all_users(
+    db: AsyncSession = Depends(get_db), 
+    current_user: CachedUser = Depends(get_current_user)
 ):
     """
     Retorna la lista de todos los usuarios registrados, 
     excluyendo al usuario actual.
     """
     # Filtramos para no aparecer nosotros mismos en la lista
-    users = db.query(models.User).filter(models.User.id != current_user.id).all()
-    return users
\ No newline at end of file
+    result = await db.execute(select(models.User).where(models.User.id != current_user.id))
+    return result.scalars().all()
\ No newline at end of file
@@ -0,0 +1,134 @@
+import json
+import time
+import uuid
+from typing import AsyncIterator, List, Optional, Tuple
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.session import SessionLocal, get_db
+from app.db import models
+from app.schemas.change import ChangePage, SecretChangeOut
+from app.services.change_feed import change_feed
+from app.services.identity_cache import CachedUser
+from app.api.auth import get_current_user
+
+router = APIRouter()
+
+_RESYNC_DETAIL = "El cursor ya no está disponible (cambios purgados o de otra base de datos): vuelve a listar los secretos y usa el cursor actual."
+
+
+async def _head(db: AsyncSession, user_id: uuid.UUID) -> int:
+    """Último seq asignado al usuario (0 si aún no tiene cambios)."""
+    result = await db.execute(
+        select(models.UserChangeSequence.last_seq).where(models.UserChangeSequence.user_id == user_id)
+    )
+    return result.scalar() or 0
+
+
+async def _changes_since(db: AsyncSession, user_id: uuid.UUID, since: int, limit: int) -> Tuple[List[models.SecretChange], bool]:
+    """
+    Cambios con seq > `since` en orden. La secuencia de cada usuario no tiene
+    huecos: si el primero no es `since + 1` (o no hay filas pero el contador va
+    por delante) esos cambios se purgaron y el cliente debe resincronizar (410).
+    """
+    result = await db.execute(
+        select(models.SecretChange)
+        .where(models.SecretChange.user_id == user_id, models.SecretChange.seq > since)
+        .order_by(models.SecretChange.seq)
+        .limit(limit + 1)
+    )
+    rows = list(result.scalars().all())
+    if rows:
+        if rows[0].seq != since + 1:
+            raise HTTPException(status_code=410, detail=_RESYNC_DETAIL)
+    elif await _head(db, user_id) != since:
+        raise HTTPException(status_code=410, detail=_RESYNC_DETAIL)
+    return rows[:limit], len(rows) > limit
+
+
+@router.get("/", response_model=ChangePage)
+async def list_changes(
+    since: Optional[int] = Query(None, ge=0, description="Último seq procesado; sin él se devuelve solo el cursor actual"),
+    limit: int = Query(100, ge=1, le=1000),
+    wait: int = Query(0, ge=0, le=settings.CHANGE_FEED_MAX_WAIT_SECONDS, description="Long-poll: segundos a esperar si no hay cambios"),
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
+    """
+    Cambios de los secretos a los que tiene acceso el usuario (alta, metadatos,
+    nueva versión, acceso concedido, borrado) posteriores a `since`. El cliente
+    solo vuelve a leer los secretos afectados.
+    """
+    if since is None:
+        return {"changes": [], "cursor": await _head(db, current_user.id), "has_more": False}
+
+    deadline = time.monotonic() + wait
+    while True:
+        rows, has_more = await _changes_since(db, current_user.id, since, limit)
+        remaining = deadline - time.monotonic()
+        if rows or remaining <= 0:
+            break
+        # Devolver la conexión al pool durante la espera; la sesión reconecta al consultar
+        await db.close()
+        if not await change_feed.wait(current_user.id, remaining):
+            # Vencido el plazo sin aviso: una última lectura cubre un NOTIFY perdido
+            rows, has_more = await _changes_since(db, current_user.id, since, limit)
+            break
+
+    cursor = rows[-1].seq if rows else since
+    return {"changes": rows, "cursor": cursor, "has_more": has_more}
+
+
+def _sse_event(row: models.SecretChange) -> str:
+    data = SecretChangeOut.model_validate(row).model_dump_json()
+    return f"id: {row.seq}\nevent: change\ndata: {data}\n\n"
+
+
+@router.get("/stream")
+async def stream_changes(
+    since: Optional[int] = Query(None, ge=0),
+    last_event_id: Optional[str] = Header(None, description="Reconexión de EventSource: último seq recibido"),
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
+    """
+    Server-Sent Events con los cambios posteriores a `since` (o a Last-Event-ID al
+    reconectar; sin ninguno, desde el cursor actual). Cada evento lleva su seq como
+    `id`. Si el cursor deja de estar disponible se emite `event: resync` y se cierra.
+    """
+    if since is None and last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    # Validar el cursor antes de responder: un 410 todavía puede ir como código de estado
+    if since is None:
+        since = await _head(db, current_user.id)
+    else:
+        await _changes_since(db, current_user.id, since, 1)
+    user_id = current_user.id
+
+    async def events() -> AsyncIterator[str]:
+        cursor = since
+        yield f"retry: {settings.CHANGE_FEED_POLL_INTERVAL * 1000:.0f}\n\n"
+        while True:
+            # Sesión corta por lectura: la conexión no queda retenida entre eventos
+            async with SessionLocal() as session:
+                try:
+                    rows, has_more = await _changes_since(session, user_id, cursor, 100)
+                except HTTPException as e:
+                    yield f"event: resync\ndata: {json.dumps({'detail': e.detail})}\n\n"
+                    return
+            for row in rows:
+                yield _sse_event(row)
+                cursor = row.seq
+            if has_more:
+                continue
+            if not await change_feed.wait(user_id, settings.CHANGE_FEED_HEARTBEAT_SECONDS):
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,32 +1,173 @@
-from fastapi import APIRouter
-from pydantic import BaseModel
+from typing import Any, AsyncIterator, Dict, Optional
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from app.core.config import settings
+from app.schemas import lab as lab_schema
+from app.services import lab_engine
+from app.services.crypto_executor import crypto_executor
+from app.services.lab_engine import CipherError, CorpusAnalyzer
 
 router = APIRouter()
 
-class VigenereRequest(BaseModel):
-    text: str
-    key: str
+# El trabajo de CPU va al pool criptográfico: misma admisión (503 si está saturado)
+# que el resto de operaciones, así el laboratorio no puede acaparar los workers.
+
+
+def _transform_text(text: str, cipher: str, decrypt: bool, params: Dict[str, Any]) -> str:
+    # str.upper() también pasa a mayúsculas las letras no ASCII, como la versión original
+    return lab_engine.transform(text.upper().encode("utf-8"), cipher, decrypt, **params).decode("utf-8")
+
+
+def _analyzer_for(text: str) -> CorpusAnalyzer:
+    analyzer = CorpusAnalyzer(settings.LAB_ANALYSIS_SAMPLE_LETTERS)
+    analyzer.feed(text.upper().encode("utf-8"))
+    return analyzer
+
+
+def _analyze_text(text: str, max_key_length: int, language: str) -> Dict[str, Any]:
+    return _analyzer_for(text).analyze(max_key_length, language)
+
+
+def _crack_text(text: str, cipher: str, language: str, max_key_length: int, key_length: Optional[int]) -> Dict[str, Any]:
+    result = _analyzer_for(text).crack(cipher, language, max_key_length, key_length)
+    params = {name: result[name] for name in ("key", "shift", "a", "b") if name in result}
+    result["plaintext"] = _transform_text(text, cipher, True, params)
+    return result
+
+
+class _DuplexStreamingResponse(StreamingResponse):
+    """
+    Respuesta en streaming que se genera mientras aún se lee el cuerpo de la petición.
+    La de Starlette escucha la desconexión con receive() en paralelo y se quedaría con
+    los trozos del cuerpo; aquí la desconexión llega al leerlo (ClientDisconnect).
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def _upload(request: Request) -> AsyncIterator[bytes]:
+    """Cuerpo de la petición por trozos, sin cargarlo entero en memoria, hasta LAB_MAX_UPLOAD_BYTES."""
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > settings.LAB_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Máximo {settings.LAB_MAX_UPLOAD_BYTES} bytes")
+    size = 0
+    async for piece in request.stream():
+        size += len(piece)
+        if size > settings.LAB_MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Máximo {settings.LAB_MAX_UPLOAD_BYTES} bytes")
+        if piece:
+            yield piece
+
+
+async def _analyze_upload(request: Request) -> CorpusAnalyzer:
+    analyzer = CorpusAnalyzer(settings.LAB_ANALYSIS_SAMPLE_LETTERS)
+    async for piece in _upload(request):
+        # Contar letras de un trozo cuesta menos de un milisegundo: no merece el salto al pool
+        analyzer.feed(piece)
+    return analyzer
+
 
 @router.post("/vigenere")
-def vigenere_lab(data: VigenereRequest):
-    text = data.text.upper()
-    key = data.key.upper()
-    result = ""
-    key_indexed = 0
-    
-    for char in text:
-        if char.isalpha():
-            # (P + K) mod 26
-            shift = ord(key[key_indexed % len(key)]) - ord('A')
-            encrypted_char = chr((ord(char) - ord('A') + shift) % 26 + ord('A'))
-            result += encrypted_char
-            key_indexed += 1
-        else:
-            result += char
-            
+async def vigenere_lab(data: lab_schema.VigenereRequest):
+    try:
+        ciphered = await crypto_executor.run_callable("lab.vigenere", _transform_text, data.text, "vigenere", False, {"key": data.key})
+    except CipherError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {
         "original": data.text,
-        "ciphered": result,
+        "ciphered": ciphered,
         "method": "Vigenère Classic",
         "security_note": "Inseguro: Vulnerable al análisis de frecuencias y ataques de Kasiski. No usar en producción."
-    }
\ No newline at end of file
+    }
+
+
+@router.post("/cipher", response_model=lab_schema.CipherResult)
+async def cipher_lab(data: lab_schema.CipherRequest):
+    """Cifra o descifra con Vigenère, César o afín. Solo se transforman las letras A-Z."""
+    params = {"key": data.key, "shift": data.shift, "a": data.a, "b": data.b}
+    decrypt = data.mode == lab_schema.CipherMode.decrypt
+    try:
+        result = await crypto_executor.run_callable("lab.cipher", _transform_text, data.text, data.cipher.value, decrypt, params)
+    except CipherError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"cipher": data.cipher, "mode": data.mode, "result": result}
+
+
+@router.post("/cipher/stream")
+async def cipher_stream_lab(
+    request: Request,
+    cipher: lab_schema.CipherName = Query(...),
+    mode: lab_schema.CipherMode = Query(lab_schema.CipherMode.encrypt),
+    key: Optional[str] = Query(None, max_length=256),
+    shift: Optional[int] = Query(None),
+    a: Optional[int] = Query(None),
+    b: Optional[int] = Query(None),
+):
+    """
+    Cifra o descifra el cuerpo de la petición (texto UTF-8) y devuelve el
+    resultado en streaming, trozo a trozo. Solo las letras ASCII pasan a mayúsculas.
+    """
+    try:
+        step = lab_engine.build_transform(cipher.value, mode == lab_schema.CipherMode.decrypt, key=key, shift=shift, a=a, b=b)
+    except CipherError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Comprobar el tamaño declarado antes de enviar la cabecera 200
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > settings.LAB_MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Máximo {settings.LAB_MAX_UPLOAD_BYTES} bytes")
+
+    async def output() -> AsyncIterator[bytes]:
+        # Los trozos se procesan en orden: Vigenère continúa la clave entre ellos
+        async for piece in _upload(request):
+            yield await crypto_executor.run_callable("lab.cipher", step, piece)
+
+    return _DuplexStreamingResponse(output(), media_type="text/plain; charset=utf-8")
+
+
+@router.post("/analyze", response_model=lab_schema.AnalysisReport)
+async def analyze_lab(data: lab_schema.AnalysisRequest):
+    """Frecuencias, índice de coincidencia, IoC por longitud de clave y Kasiski."""
+    return await crypto_executor.run_callable("lab.analyze", _analyze_text, data.text, data.max_key_length, data.language.value)
+
+
+@router.post("/analyze/stream", response_model=lab_schema.AnalysisReport)
+async def analyze_stream_lab(
+    request: Request,
+    max_key_length: int = Query(20, ge=1, le=settings.LAB_MAX_KEY_LENGTH),
+    language: lab_schema.Language = Query(lab_schema.Language.en),
+):
+    """Como /analyze, con el corpus subido como cuerpo de la petición (hasta LAB_MAX_UPLOAD_BYTES)."""
+    analyzer = await _analyze_upload(request)
+    return await crypto_executor.run_callable("lab.analyze", analyzer.analyze, max_key_length, language.value)
+
+
+@router.post("/crack", response_model=lab_schema.CrackResult)
+async def crack_lab(data: lab_schema.CrackRequest):
+    """Recupera la clave más probable (chi-cuadrado frente al idioma) y descifra el texto."""
+    return await crypto_executor.run_callable(
+        "lab.crack", _crack_text, data.text, data.cipher.value, data.language.value, data.max_key_length, data.key_length
+    )
+
+
+@router.post("/crack/stream", response_model=lab_schema.CrackResult)
+async def crack_stream_lab(
+    request: Request,
+    cipher: lab_schema.CipherName = Query(lab_schema.CipherName.vigenere),
+    max_key_length: int = Query(20, ge=1, le=settings.LAB_MAX_KEY_LENGTH),
+    key_length: Optional[int] = Query(None, ge=1, le=settings.LAB_MAX_KEY_LENGTH),
+    language: lab_schema.Language = Query(lab_schema.Language.en),
+):
+    """
+    Como /crack con el corpus subido en streaming. Devuelve la clave y una vista
+    previa; el texto completo se descifra después con /cipher/stream.
+    """
+    analyzer = await _analyze_upload(request)
+    return await crypto_executor.run_callable(
+        "lab.crack", analyzer.crack, cipher.value, language.value, max_key_length, key_length
+    )
@@ -0,0 +1,86 @@
+import hmac
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+
+from app.core.config import settings
+from app.services.audit_writer import audit_writer
+from app.services.blob_store import blob_store
+from app.services.crypto_executor import crypto_executor
+from app.services.identity_cache import identity_cache
+from app.services.key_pool import rsa_key_pool
+from app.services.public_key_cache import public_key_cache
+from app.services.rotation import rotation_runner
+from app.services.session_keys import unlocked_key_cache
+
+
+def require_ops_token(
+    x_ops_token: Optional[str] = Header(None, description="Token de operación (OPS_TOKEN)"),
+    authorization: Optional[str] = Header(None),
+) -> None:
+    """
+    Protege los endpoints internos (tamaños de pools y cachés, tiempos) con
+    OPS_TOKEN. Acepta también `Authorization: Bearer <token>` para scrapers
+    como Prometheus. Sin OPS_TOKEN configurado los endpoints no existen.
+    """
+    if not settings.OPS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = x_ops_token
+    if not token and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    if not token or not hmac.compare_digest(token.encode(), settings.OPS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Token de operación inválido")
+
+
+router = APIRouter(dependencies=[Depends(require_ops_token)])
+
+
+@router.get("/crypto-pool")
+async def crypto_pool_stats():
+    """
+    Estado del pool criptográfico: tareas en vuelo y, por operación,
+    tiempo de espera en cola, tiempo de ejecución y rechazos por saturación.
+    """
+    return crypto_executor.stats()
+
+
+@router.get("/key-pool")
+async def key_pool_stats():
+    """Profundidad de la reserva de llaves RSA, tasa de recarga y aciertos/fallos."""
+    return rsa_key_pool.stats()
+
+
+@router.get("/identity-cache")
+async def identity_cache_stats():
+    """Tamaño y tasa de aciertos de la caché de identidades autenticadas."""
+    return identity_cache.stats()
+
+
+@router.get("/public-key-cache")
+async def public_key_cache_stats():
+    """Tamaño y tasa de aciertos de la caché de llaves públicas parseadas."""
+    return public_key_cache.stats()
+
+
+@router.get("/audit-writer")
+async def audit_writer_stats():
+    """Modo de la auditoría, eventos en cola, escritos y descartados."""
+    return audit_writer.stats()
+
+
+@router.get("/blob-store")
+async def blob_store_stats():
+    """Backend del almacén de payloads y volumen escrito/leído."""
+    return blob_store.stats()
+
+
+@router.get("/rotations")
+async def rotation_stats():
+    """Trabajos de rotación activos, filas procesadas, lotes y esperas por saturación del pool."""
+    return rotation_runner.stats()
+
+
+@router.get("/unlock-sessions")
+async def unlock_session_stats():
+    """Sesiones de desbloqueo en la caché local del worker, cargadas desde la base de datos y revocadas por aviso."""
+    return unlocked_key_cache.stats()
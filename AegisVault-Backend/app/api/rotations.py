@@ -0,0 +1,212 @@
+import uuid
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Header, Request, status
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.session import get_db
+from app.db import models
+from app.schemas.rotation import RotationJobOut
+from app.services.audit_writer import audit_writer, client_ip
+from app.services.crypto_engine import WRAP_AES_KW, WRAP_RSA_OAEP, crypto_engine
+from app.services.crypto_executor import CryptoPoolSaturated, crypto_executor
+from app.services.identity_cache import CachedUser
+from app.services.key_pool import rsa_key_pool
+from app.services.rotation import (
+    KIND_SECRET_KEY, KIND_USER_KEYPAIR, STATUS_FAILED, STATUS_PENDING, STATUS_WAITING_CREDENTIALS,
+    KeypairMaterial, SecretKeyMaterial, active_rotation_targets, rotation_runner,
+)
+from app.api.auth import current_public_key, get_current_user, resolve_user_keys
+
+router = APIRouter()
+
+
+def _job_out(job: models.RotationJob) -> RotationJobOut:
+    out = RotationJobOut.model_validate(job)
+    if job.started_at and job.updated_at and job.processed:
+        elapsed = (job.updated_at - job.started_at).total_seconds()
+        out.rows_per_second = round(job.processed / elapsed, 1) if elapsed > 0 else None
+    return out
+
+
+async def _unwrap_own_key(db: AsyncSession, keys, secret_id: uuid.UUID, user_id: uuid.UUID, generation: int) -> bytes:
+    """Llave AES de la generación indicada según el acceso del propio usuario."""
+    result = await db.execute(select(models.SecretKey.encrypted_aes_key, models.SecretKey.wrap_alg).where(
+        models.SecretKey.secret_id == secret_id,
+        models.SecretKey.user_id == user_id,
+        models.SecretKey.key_generation == generation
+    ))
+    own_key = result.first()
+    if own_key is None:
+        raise HTTPException(status_code=403, detail="No tienes una llave para este secreto")
+    try:
+        return await keys.aunwrap(own_key.encrypted_aes_key, own_key.wrap_alg)
+    except CryptoPoolSaturated:
+        raise
+    except Exception:
+        raise HTTPException(status_code=401, detail="Contraseña incorrecta o error de llave")
+
+
+# --- INICIAR ---
+@router.post("/secrets/{secret_id}", response_model=RotationJobOut, status_code=status.HTTP_202_ACCEPTED)
+async def rotate_secret_key(
+    request: Request,
+    secret_id: uuid.UUID,
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user),
+    x_user_password: Optional[str] = Header(None, description="Tu contraseña de usuario"),
+    x_unlock_token: Optional[str] = Header(None, description="Token de /api/auth/unlock (evita repetir el KDF)")
+):
+    """
+    Genera una llave AES nueva para el secreto y re-cifra en segundo plano todas
+    sus versiones y accesos. Mientras dura, las lecturas usan la llave con la que
+    está cifrada cada versión; compartir y rotar el contenido devuelven 409.
+    """
+    # FOR UPDATE: dos rotaciones simultáneas del mismo secreto se serializan aquí
+    result = await db.execute(select(models.Secret).where(
+        models.Secret.id == secret_id, models.Secret.owner_id == current_user.id, models.Secret.is_deleted == False
+    ).with_for_update())
+    secret = result.scalars().first()
+    if not secret:
+        raise HTTPException(status_code=404, detail="Secreto no encontrado")
+    if await active_rotation_targets(db, [secret.id]):
+        raise HTTPException(status_code=409, detail="Ya hay una rotación en curso para este secreto")
+
+    keys = await resolve_user_keys(current_user, x_user_password, x_unlock_token, client_ip(request))
+    old_key = await _unwrap_own_key(db, keys, secret.id, current_user.id, secret.key_generation)
+    new_key = crypto_engine.generate_aes_key()
+
+    # El acceso del dueño a la generación nueva se crea ya: podrá leer cada versión en cuanto se re-cifre
+    if keys.kek is not None and settings.USER_KEK_ENABLED:
+        wrapped_key, wrap_alg = crypto_engine.wrap_key_kw(keys.kek, new_key), WRAP_AES_KW
+    else:
+        wrapped_key, wrap_alg = await crypto_engine.awrap_aes_key(new_key, await current_public_key(db, current_user)), WRAP_RSA_OAEP
+
+    grants = (await db.execute(select(func.count()).select_from(models.SecretKey).where(
+        models.SecretKey.secret_id == secret.id,
+        models.SecretKey.key_generation == secret.key_generation,
+        models.SecretKey.user_id != current_user.id
+    ))).scalar_one()
+    versions = (await db.execute(select(func.count()).select_from(models.SecretVersion).where(
+        models.SecretVersion.secret_id == secret.id
+    ))).scalar_one()
+
+    job = models.RotationJob(
+        id=uuid.uuid4(), kind=KIND_SECRET_KEY, target_id=secret.id, user_id=current_user.id,
+        status=STATUS_PENDING, stage="grants", processed=0, total=grants + versions,
+        from_generation=secret.key_generation, to_generation=secret.key_generation + 1
+    )
+    db.add_all([job, models.SecretKey(
+        id=uuid.uuid4(), secret_id=secret.id, user_id=current_user.id, encrypted_aes_key=wrapped_key,
+        wrap_alg=wrap_alg, key_generation=job.to_generation
+    )])
+    await audit_writer.record(db, request, current_user.id, "ROTATE_SECRET_KEY", secret.id)
+    await db.commit()
+
+    rotation_runner.submit(job.id, SecretKeyMaterial(old_key, new_key))
+    return _job_out(job)
+
+
+@router.post("/me/keypair", response_model=RotationJobOut, status_code=status.HTTP_202_ACCEPTED)
+async def rotate_keypair(
+    request: Request,
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user),
+    x_user_password: str = Header(..., description="Tu contraseña: cifra la llave privada nueva")
+):
+    """
+    Sustituye el par RSA del usuario. Sus accesos RSA se re-envuelven en segundo
+    plano con la llave pública nueva y el cambio se activa en un único commit;
+    hasta entonces todo sigue funcionando con el par anterior.
+    """
+    result = await db.execute(select(models.User.id).where(models.User.id == current_user.id).with_for_update())
+    result.first()
+    if await active_rotation_targets(db, [current_user.id]):
+        raise HTTPException(status_code=409, detail="Ya hay una rotación de tu par de llaves en curso")
+
+    # Valida la contraseña y desbloquea el par actual
+    old_keys = await resolve_user_keys(current_user, x_user_password, None, client_ip(request))
+    priv_pem, pub_pem = await rsa_key_pool.acquire()
+    encrypted_private_key = await crypto_engine.aencrypt_rsa_private_key(priv_pem, x_user_password)
+    new_private_key = await crypto_executor.run_callable("load_private_key", crypto_engine.load_private_key_pem, priv_pem)
+
+    total = (await db.execute(select(func.count()).select_from(models.SecretKey).where(
+        models.SecretKey.user_id == current_user.id,
+        models.SecretKey.wrap_alg == WRAP_RSA_OAEP
+    ))).scalar_one()
+    job = models.RotationJob(
+        id=uuid.uuid4(), kind=KIND_USER_KEYPAIR, target_id=current_user.id, user_id=current_user.id,
+        status=STATUS_PENDING, stage="grants", processed=0, total=total,
+        new_public_key=pub_pem.decode("utf-8"), new_encrypted_private_key=encrypted_private_key
+    )
+    db.add(job)
+    await audit_writer.record(db, request, current_user.id, "ROTATE_KEYPAIR", current_user.id)
+    await db.commit()
+
+    rotation_runner.submit(job.id, KeypairMaterial(old_keys, new_private_key))
+    return _job_out(job)
+
+
+# --- CONSULTAR ---
+@router.get("/", response_model=List[RotationJobOut])
+async def list_rotation_jobs(db: AsyncSession = Depends(get_db), current_user: CachedUser = Depends(get_current_user)):
+    """Trabajos de rotación del usuario, del más reciente al más antiguo."""
+    result = await db.execute(select(models.RotationJob).where(
+        models.RotationJob.user_id == current_user.id
+    ).order_by(models.RotationJob.created_at.desc()).limit(settings.PAGE_SIZE_DEFAULT))
+    return [_job_out(job) for job in result.scalars().all()]
+
+
+@router.get("/{job_id}", response_model=RotationJobOut)
+async def get_rotation_job(job_id: uuid.UUID, db: AsyncSession = Depends(get_db), current_user: CachedUser = Depends(get_current_user)):
+    """Progreso (procesadas/total), etapa y filas por segundo de un trabajo."""
+    job = await db.get(models.RotationJob, job_id)
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return _job_out(job)
+
+
+# --- REANUDAR ---
+@router.post("/{job_id}/resume", response_model=RotationJobOut, status_code=status.HTTP_202_ACCEPTED)
+async def resume_rotation_job(
+    request: Request,
+    job_id: uuid.UUID,
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user),
+    x_user_password: Optional[str] = Header(None, description="Tu contraseña (obligatoria para el par de llaves)"),
+    x_unlock_token: Optional[str] = Header(None, description="Token de /api/auth/unlock (solo rotación de secretos)")
+):
+    """
+    Reanuda un trabajo interrumpido (reinicio del servidor o fallo) desde el
+    último lote confirmado. El servidor no guarda llaves en claro, así que hay
+    que volver a aportar credenciales.
+    """
+    result = await db.execute(select(models.RotationJob).where(
+        models.RotationJob.id == job_id, models.RotationJob.user_id == current_user.id
+    ).with_for_update())
+    job = result.scalars().first()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    if job.status not in (STATUS_WAITING_CREDENTIALS, STATUS_FAILED) or rotation_runner.is_running(job.id):
+        raise HTTPException(status_code=409, detail=f"El trabajo no se puede reanudar (estado: {job.status})")
+
+    if job.kind == KIND_SECRET_KEY:
+        keys = await resolve_user_keys(current_user, x_user_password, x_unlock_token, client_ip(request))
+        material = SecretKeyMaterial(
+            await _unwrap_own_key(db, keys, job.target_id, current_user.id, job.from_generation),
+            await _unwrap_own_key(db, keys, job.target_id, current_user.id, job.to_generation),
+        )
+    else:
+        if not x_user_password:
+            raise HTTPException(status_code=401, detail="Se requiere contraseña para reanudar la rotación del par de llaves")
+        old_keys = await resolve_user_keys(current_user, x_user_password, None, client_ip(request))
+        try:
+            new_private_key = await crypto_engine.aload_rsa_private_key(job.new_encrypted_private_key, x_user_password)
+        except ValueError:
+            raise HTTPException(status_code=401, detail="Contraseña incorrecta o error de llave")
+        material = KeypairMaterial(old_keys, new_private_key)
+
+    job.status, job.error = STATUS_PENDING, None
+    await db.commit()
+    rotation_runner.submit(job.id, material)
+    return _job_out(job)
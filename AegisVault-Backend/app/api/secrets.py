@@ -1,136 +1,770 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, Header,status
-from sqlalchemy.orm import Session
-from app.db.session import get_db
+import asyncio
+import uuid
+from typing import List, Optional
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, insert, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+from app.db.session import SessionLocal, get_db
 from app.db import models
 from app.schemas import secret as secret_schema
-from app.services.crypto_engine import crypto_engine
-from app.api.auth import get_current_user # Asumiendo que implementas la lógica de JWT
+from app.services.audit_writer import audit_writer, client_ip
+from app.services.blob_store import load_payload, offload_payload
+from app.services.change_feed import (
+    CHANGE_CREATED, CHANGE_DELETED, CHANGE_SHARED, CHANGE_UPDATED, CHANGE_VERSION,
+    change, record_changes, record_for_audience,
+)
+from app.services.chunked_payload import PayloadTooLarge, SpooledChunks, read_chunks, spool_chunks, write_chunks
+from app.services.crypto_engine import WRAP_AES_KW, crypto_engine
+from app.services.crypto_executor import CryptoPoolSaturated, crypto_executor
+from app.services.identity_cache import CachedUser
+from app.services.public_key_cache import public_key_cache
+from app.services.rotation import active_rotation_targets
+from app.api.auth import current_public_key, get_current_user, resolve_user_keys
 
 router = APIRouter()
 
 # --- CREATE ---
+def _encrypt_new_secret(secret_in: secret_schema.SecretCreate, owner: CachedUser, public_key: RSAPublicKey) -> list:
+    """
+    Cifra un secreto nuevo y devuelve sus filas Secret, SecretVersion y SecretKey.
+    Los UUID se asignan en el cliente, así que las tres filas se insertan en un
+    solo flush sin esperar al id generado por la base de datos.
+    `public_key` es la llave vigente del dueño (ver `current_public_key`).
+    """
+    aes_key = crypto_engine.generate_aes_key()
+    enc = crypto_engine.encrypt_aes_gcm(secret_in.content.encode(), aes_key)
+    wrapped_key = crypto_engine.wrap_aes_key(aes_key, public_key)
+
+    secret = models.Secret(id=uuid.uuid4(), name=secret_in.name, description=secret_in.description, owner_id=owner.id, kind="text", current_version=1)
+    return [
+        secret,
+        models.SecretVersion(id=uuid.uuid4(), secret_id=secret.id, version_number=1, encrypted_data=enc["ciphertext"], nonce_iv=enc["nonce"], auth_tag=enc["tag"]),
+        models.SecretKey(id=uuid.uuid4(), secret_id=secret.id, user_id=owner.id, encrypted_aes_key=wrapped_key),
+    ]
+
+
 @router.post("/", response_model=secret_schema.SecretPublic)
-def create_secret(
+async def create_secret(
+    request: Request,
     secret_in: secret_schema.SecretCreate, 
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user)
 ):
-    aes_key = crypto_engine.generate_aes_key()
-    enc = crypto_engine.encrypt_aes_gcm(secret_in.content.encode(), aes_key)
-    wrapped_key = crypto_engine.wrap_aes_key(aes_key, current_user.public_key)
-    
-    new_secret = models.Secret(name=secret_in.name, description=secret_in.description, owner_id=current_user.id)
-    db.add(new_secret)
-    db.commit()
-    db.refresh(new_secret)
-    
-    db.add(models.SecretVersion(secret_id=new_secret.id, version_number=1, encrypted_data=enc["ciphertext"], nonce_iv=enc["nonce"], auth_tag=enc["tag"]))
-    db.add(models.SecretKey(secret_id=new_secret.id, user_id=current_user.id, encrypted_aes_key=wrapped_key))
+    public_key = await current_public_key(db, current_user)
+    rows = await crypto_executor.run_callable("encrypt_secret", _encrypt_new_secret, secret_in, current_user, public_key)
+    new_secret = rows[0]
+    # Payloads grandes al almacén de blobs (antes del commit: un fallo deja como mucho un blob huérfano)
+    await offload_payload(rows[1])
+    db.add_all(rows)
     
     # Auditoría
-    db.add(models.AuditLog(user_id=current_user.id, action="CREATE_SECRET", resource_id=new_secret.id))
-    db.commit()
+    await audit_writer.record(db, request, current_user.id, "CREATE_SECRET", new_secret.id)
+    await record_changes(db, [change(current_user.id, new_secret.id, CHANGE_CREATED, 1)])
+    # Un solo flush + commit para Secret, SecretVersion, SecretKey, AuditLog y el feed de cambios
+    await db.commit()
     return new_secret
 
+# --- IMPORT (BULK CREATE) ---
+@router.post("/import", response_model=List[secret_schema.SecretPublic], status_code=status.HTTP_201_CREATED)
+async def import_secrets(
+    request: Request,
+    import_in: secret_schema.SecretImport,
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
+    """
+    Crea todos los secretos recibidos en una única transacción (todo o nada),
+    cada uno con su propia llave AES envuelta para el dueño. El ORM agrupa las
+    filas de cada tabla en INSERT multi-fila (insertmanyvalues).
+    """
+    if len(import_in.secrets) > settings.SECRET_IMPORT_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Máximo {settings.SECRET_IMPORT_MAX_ITEMS} secretos por importación")
+
+    public_key = await current_public_key(db, current_user)
+
+    def encrypt_all():
+        return [_encrypt_new_secret(secret_in, current_user, public_key) for secret_in in import_in.secrets]
+
+    encrypted = await crypto_executor.run_callable("import_encrypt", encrypt_all)
+    secrets = [rows[0] for rows in encrypted]
+    await asyncio.gather(*(offload_payload(rows[1]) for rows in encrypted))
+    db.add_all([row for rows in encrypted for row in rows])
+
+    ip_address = client_ip(request)
+    await audit_writer.record_many(db, [
+        audit_writer.event(current_user.id, "CREATE_SECRET", secret.id, ip_address) for secret in secrets
+    ])
+    await record_changes(db, [change(current_user.id, secret.id, CHANGE_CREATED, 1) for secret in secrets])
+    await db.commit()
+    return secrets
+
+# --- CREATE (BINARIO, STREAMING) ---
+async def _receive_binary(db: AsyncSession, request: Request, version_id: uuid.UUID, aes_key: bytes, base_nonce: bytes) -> SpooledChunks:
+    """
+    Recibe y cifra el cuerpo de la petición antes de abrir la transacción que lo
+    guarda. Cierra la transacción de solo lectura de `db` (si la hay) para que la
+    conexión vuelva al pool mientras el cliente sube el contenido.
+    """
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > settings.SECRET_BINARY_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Máximo {settings.SECRET_BINARY_MAX_BYTES} bytes")
+
+    await db.rollback()
+    try:
+        return await spool_chunks(version_id, aes_key, base_nonce, request.stream())
+    except PayloadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
+async def _write_binary_version(
+    db: AsyncSession, secret: models.Secret, version_number: int, version_id: uuid.UUID, base_nonce: bytes, spool: SpooledChunks
+) -> models.SecretVersion:
+    """Crea la SecretVersion `version_number` con los bloques ya cifrados de `spool`."""
+    version = models.SecretVersion(
+        id=version_id, secret_id=secret.id, version_number=version_number, nonce_iv=base_nonce,
+        key_generation=secret.key_generation, chunk_count=spool.chunk_count, size_bytes=spool.size
+    )
+    db.add(version)
+    # Los bloques referencian la versión: la insertamos antes de volcarlos
+    await db.flush()
+    await write_chunks(db, version.id, spool)
+    return version
+
+
+@router.post("/binary", response_model=secret_schema.SecretPublic, status_code=status.HTTP_201_CREATED)
+async def create_binary_secret(
+    request: Request,
+    name: str = Query(..., min_length=1, max_length=100),
+    description: Optional[str] = Query(None),
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
+    """
+    Crea un secreto binario (certificados, keystores, configuraciones grandes).
+    El cuerpo de la petición es el contenido en bruto; su Content-Type se guarda
+    para la descarga. Se cifra en bloques AES-GCM de SECRET_CHUNK_SIZE.
+    """
+    aes_key = crypto_engine.generate_aes_key()
+    media_type = request.headers.get("content-type") or "application/octet-stream"
+    version_id, base_nonce = uuid.uuid4(), crypto_engine.generate_base_nonce()
+    spool = await _receive_binary(db, request, version_id, aes_key, base_nonce)
+
+    # La transacción empieza con el cuerpo ya recibido: ni la conexión ni el
+    # bloqueo de la fila del dueño esperan al cliente
+    try:
+        secret = models.Secret(
+            id=uuid.uuid4(), name=name, description=description, owner_id=current_user.id,
+            kind="binary", media_type=media_type[:100], current_version=1, key_generation=1
+        )
+        db.add(secret)
+        await _write_binary_version(db, secret, 1, version_id, base_nonce, spool)
+        wrapped_key = await crypto_engine.awrap_aes_key(aes_key, await current_public_key(db, current_user))
+        db.add(models.SecretKey(id=uuid.uuid4(), secret_id=secret.id, user_id=current_user.id, encrypted_aes_key=wrapped_key))
+
+        await audit_writer.record(db, request, current_user.id, "CREATE_SECRET", secret.id)
+        await record_changes(db, [change(current_user.id, secret.id, CHANGE_CREATED, 1)])
+        await db.commit()
+    finally:
+        spool.close()
+    return secret
+
 # --- READ (LIST) - ACTUALIZADO PARA MOSTRAR COMPARTIDOS ---
 @router.get("/", response_model=List[secret_schema.SecretPublic])
-def list_my_secrets(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def list_my_secrets(
+    response: Response,
+    limit: int = Query(settings.PAGE_SIZE_DEFAULT, ge=1, le=settings.PAGE_SIZE_MAX),
+    cursor: Optional[str] = Query(None, description=f"Valor de la cabecera {NEXT_CURSOR_HEADER} de la página anterior"),
+    name_prefix: Optional[str] = Query(None, max_length=100),
+    owner_id: Optional[uuid.UUID] = None,
+    scope: secret_schema.SecretScope = secret_schema.SecretScope.all,
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
     """
     Retorna los secretos donde el usuario es dueño O tiene una llave compartida.
+    Paginado por cursor sobre (created_at, id), del más reciente al más antiguo;
+    si hay más resultados, el cursor siguiente viene en la cabecera X-Next-Cursor.
     """
-    return db.query(models.Secret).join(models.SecretKey).filter(
+    # Solo columnas: evitamos materializar entidades ORM para listados grandes
+    query = select(
+        models.Secret.id, models.Secret.name, models.Secret.description,
+        models.Secret.owner_id, models.Secret.created_at, models.Secret.kind
+    ).join(models.SecretKey, and_(
+        models.SecretKey.secret_id == models.Secret.id,
+        # Durante una rotación el dueño tiene dos accesos: solo cuenta el de la generación vigente
+        models.SecretKey.key_generation == models.Secret.key_generation
+    )).where(
         models.SecretKey.user_id == current_user.id, 
         models.Secret.is_deleted == False
-    ).all()
+    )
+    if scope == secret_schema.SecretScope.owned:
+        query = query.where(models.Secret.owner_id == current_user.id)
+    elif scope == secret_schema.SecretScope.shared:
+        query = query.where(models.Secret.owner_id != current_user.id)
+    if owner_id:
+        query = query.where(models.Secret.owner_id == owner_id)
+    if name_prefix:
+        query = query.where(models.Secret.name.startswith(name_prefix, autoescape=True))
+    if cursor:
+        try:
+            last_created_at, last_id = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        query = query.where(tuple_(models.Secret.created_at, models.Secret.id) < tuple_(last_created_at, last_id))
+
+    result = await db.execute(
+        query.order_by(models.Secret.created_at.desc(), models.Secret.id.desc()).limit(limit + 1)
+    )
+    rows = result.all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return [row._asdict() for row in rows]
+
+# --- READ (BATCH) ---
+@router.post("/batch-read", response_model=secret_schema.SecretBatchResult)
+async def batch_read_secrets(
+    request: Request,
+    batch_in: secret_schema.SecretBatchRead,
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user),
+    x_user_password: Optional[str] = Header(None, description="Tu contraseña de usuario para descifrar"),
+    x_unlock_token: Optional[str] = Header(None, description="Token de /api/auth/unlock (evita repetir el KDF)")
+):
+    """
+    Descifra varios secretos en una sola petición.
+    La llave privada se desbloquea una vez, las filas Secret/SecretKey/última
+    SecretVersion se cargan en una única consulta y la auditoría se escribe en
+    un solo INSERT. Los errores se informan por elemento sin abortar el lote.
+    """
+    # Eliminamos duplicados conservando el orden de la petición
+    secret_ids = list(dict.fromkeys(batch_in.secret_ids))
+
+    keys = await resolve_user_keys(current_user, x_user_password, x_unlock_token, client_ip(request))
+
+    # Secreto + versión vigente + llave del usuario de la generación de esa versión, en una sola consulta
+    result = await db.execute(select(models.Secret, models.SecretKey, models.SecretVersion).join(
+        models.SecretVersion, and_(
+            models.SecretVersion.secret_id == models.Secret.id,
+            models.SecretVersion.version_number == models.Secret.current_version
+        )
+    ).join(
+        models.SecretKey, and_(
+            models.SecretKey.secret_id == models.Secret.id,
+            models.SecretKey.user_id == current_user.id,
+            models.SecretKey.key_generation == models.SecretVersion.key_generation
+        )
+    ).where(
+        models.Secret.id.in_(secret_ids),
+        models.Secret.is_deleted == False
+    ))
+    found = {secret.id: (secret, sec_key, version) for secret, sec_key, version in result.all()}
+
+    # Los payloads externos se descargan en paralelo antes de descifrar
+    text_ids = [secret_id for secret_id, (secret, _, _) in found.items() if secret.kind != "binary"]
+    payloads = dict(zip(text_ids, await asyncio.gather(*(
+        load_payload(found[secret_id][2].encrypted_data, found[secret_id][2].blob_ref) for secret_id in text_ids
+    ), return_exceptions=True)))
+
+    converted = []  # Accesos propios que pasan de RSA-OAEP a AES-KW en esta lectura
+
+    def decrypt_all():
+        # Unwrap + AES-GCM de todo el lote en una sola pasada fuera del event loop
+        items = []
+        for secret_id in secret_ids:
+            if secret_id not in found:
+                items.append({"id": secret_id, "status": "not_found", "detail": "No encontrado o sin permiso"})
+                continue
+            secret, sec_key, version = found[secret_id]
+            if secret.kind == "binary":
+                items.append({"id": secret_id, "status": "error", "name": secret.name, "detail": "Secreto binario: usa GET /{id}/content"})
+                continue
+            try:
+                ciphertext = payloads[secret_id]
+                if isinstance(ciphertext, Exception):
+                    raise ciphertext
+                aes_key = keys.unwrap(sec_key.encrypted_aes_key, sec_key.wrap_alg)
+                rewrapped = keys.rewrap_for_self(aes_key, sec_key.wrap_alg)
+                if rewrapped:
+                    converted.append({"id": sec_key.id, "encrypted_aes_key": rewrapped, "wrap_alg": WRAP_AES_KW})
+                decrypted = crypto_engine.decrypt_aes_gcm({
+                    "ciphertext": ciphertext,
+                    "nonce": version.nonce_iv,
+                    "tag": version.auth_tag
+                }, aes_key)
+            except Exception:
+                items.append({"id": secret_id, "status": "error", "name": secret.name, "detail": "Error de llave o datos corruptos"})
+                continue
+            items.append({"id": secret_id, "status": "ok", "name": secret.name, "content": decrypted.decode()})
+        return items
+
+    items = await crypto_executor.run_callable("batch_decrypt", decrypt_all)
+    # Auditoría en un único INSERT multi-fila (o encolada en modo "buffered")
+    ip_address = client_ip(request)
+    await audit_writer.record_many(db, [
+        audit_writer.event(current_user.id, "READ_SECRET", item["id"], ip_address)
+        for item in items if item["status"] == "ok"
+    ], commit=not converted)
+    if converted:
+        # UPDATE por clave primaria en bloque con commit propio: en modo "buffered"
+        # la auditoría no confirma la sesión
+        await db.execute(update(models.SecretKey), converted)
+        await db.commit()
+
+    return {"items": items}
+
+# --- COMPARTIR EN LOTE ---
+@router.post("/share-bulk", response_model=secret_schema.SecretBulkShareResult, status_code=status.HTTP_201_CREATED)
+async def share_secrets_bulk(
+    request: Request,
+    share_in: secret_schema.SecretBulkShare,
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user),
+    x_user_password: Optional[str] = Header(None, description="Tu contraseña para autorizar el re-cifrado"),
+    x_unlock_token: Optional[str] = Header(None, description="Token de /api/auth/unlock (evita repetir el KDF)")
+):
+    """
+    Comparte cada secreto de `secret_ids` con cada usuario de `usernames`.
+    La llave privada del emisor se desbloquea una sola vez, secretos, receptores
+    y accesos ya existentes se resuelven con tres consultas por conjuntos, cada
+    llave pública se parsea una vez y las nuevas SecretKey se escriben en un
+    único INSERT. Devuelve un informe por concesión sin abortar el lote.
+    """
+    secret_ids = list(dict.fromkeys(share_in.secret_ids))
+    usernames = list(dict.fromkeys(share_in.usernames))
+
+    # 1. Llaves AES del emisor para los secretos pedidos (solo puede compartir lo que puede leer).
+    #    FOR SHARE sobre los Secret hasta el commit: una rotación de su llave (FOR UPDATE)
+    #    no puede empezar con estos accesos a medio escribir ni retirarlos sin re-cifrarlos
+    result = await db.execute(select(
+        models.SecretKey.secret_id, models.SecretKey.encrypted_aes_key, models.SecretKey.wrap_alg, models.SecretKey.key_generation
+    ).join(
+        models.Secret, and_(
+            models.Secret.id == models.SecretKey.secret_id,
+            models.Secret.key_generation == models.SecretKey.key_generation
+        )
+    ).where(
+        models.SecretKey.secret_id.in_(secret_ids),
+        models.SecretKey.user_id == current_user.id,
+        models.Secret.is_deleted == False
+    ).order_by(models.Secret.id).with_for_update(read=True, of=models.Secret))
+    sender_keys = {row.secret_id: row for row in result.all()}
+
+    # 2. Receptores. FOR SHARE hasta el commit: una rotación de su par que finalice
+    #    en paralelo espera y re-envuelve también estos accesos
+    result = await db.execute(select(models.User.id, models.User.username, models.User.public_key).where(
+        models.User.username.in_(usernames)
+    ).order_by(models.User.id).with_for_update(read=True))
+    recipients = {row.username: row for row in result.all()}
+
+    # 3. Accesos ya existentes entre ambos conjuntos
+    existing = set()
+    if sender_keys and recipients:
+        result = await db.execute(select(models.SecretKey.secret_id, models.SecretKey.user_id).where(
+            models.SecretKey.secret_id.in_(list(sender_keys)),
+            models.SecretKey.user_id.in_([r.id for r in recipients.values()])
+        ))
+        existing = set(result.all())
+    # Secretos o receptores con una rotación de llaves en curso
+    rotating = await active_rotation_targets(db, list(sender_keys) + [r.id for r in recipients.values()])
+
+    items = []
+    pending = []  # (índice en items, secret_id, receptor)
+    for secret_id in secret_ids:
+        for username in usernames:
+            item = {"secret_id": secret_id, "username": username}
+            recipient = recipients.get(username)
+            if secret_id not in sender_keys:
+                item.update(status="secret_not_found", detail="No encontrado o sin permiso")
+            elif recipient is None:
+                item.update(status="user_not_found", detail="El usuario destinatario no existe")
+            elif (secret_id, recipient.id) in existing:
+                item.update(status="exists", detail="Este usuario ya tiene acceso al secreto")
+            elif secret_id in rotating or recipient.id in rotating:
+                item.update(status="rotating", detail="Rotación de llaves en curso; reintenta al terminar")
+            else:
+                pending.append((len(items), secret_id, recipient))
+            items.append(item)
+
+    rows = []
+    if pending:
+        keys = await resolve_user_keys(current_user, x_user_password, x_unlock_token, client_ip(request))
+
+        def rewrap_all():
+            # Un unwrap por secreto y una llave pública (cacheada) por receptor, fuera del event loop
+            aes_keys, public_keys, wrapped = {}, {}, []
+            for index, secret_id, recipient in pending:
+                try:
+                    if secret_id not in aes_keys:
+                        sender_key = sender_keys[secret_id]
+                        aes_keys[secret_id] = keys.unwrap(sender_key.encrypted_aes_key, sender_key.wrap_alg)
+                    if recipient.id not in public_keys:
+                        public_keys[recipient.id] = public_key_cache.get(recipient.id, recipient.public_key)
+                    wrapped.append((index, secret_id, recipient.id, crypto_engine.wrap_aes_key(aes_keys[secret_id], public_keys[recipient.id])))
+                except Exception:
+                    wrapped.append((index, secret_id, recipient.id, None))
+            return wrapped
+
+        for index, secret_id, user_id, wrapped_key in await crypto_executor.run_callable("bulk_rewrap", rewrap_all):
+            if wrapped_key is None:
+                items[index].update(status="error", detail="Error en el intercambio de llaves")
+                continue
+            items[index]["status"] = "created"
+            rows.append({
+                "id": uuid.uuid4(), "secret_id": secret_id, "user_id": user_id, "encrypted_aes_key": wrapped_key,
+                "key_generation": sender_keys[secret_id].key_generation
+            })
+
+    if rows:
+        await db.execute(insert(models.SecretKey), rows)
+        ip_address = client_ip(request)
+        await audit_writer.record_many(db, [
+            audit_writer.event(current_user.id, "SHARE_SECRET", row["secret_id"], ip_address) for row in rows
+        ])
+        # Solo los receptores ven un cambio: para el resto el secreto no cambia
+        await record_changes(db, [change(row["user_id"], row["secret_id"], CHANGE_SHARED) for row in rows])
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Otro reparto concurrente concedió alguno de estos accesos
+            await db.rollback()
+            raise HTTPException(status_code=409, detail="Conflicto con otro reparto concurrente; reintenta")
+
+    return {"created": len(rows), "items": items}
 
 # --- READ (DETAIL) - ACTUALIZADO PARA PERMITIR ACCESO A RECEPTORES ---
 @router.get("/{secret_id}", response_model=secret_schema.SecretDetailPublic)
-def get_secret(
-    secret_id: str, 
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
-    x_user_password: str = Header(..., description="Tu contraseña de usuario para descifrar")
+async def get_secret(
+    request: Request,
+    secret_id: uuid.UUID, 
+    version: Optional[int] = Query(None, ge=1, description="Versión histórica a leer (por defecto, la vigente)"),
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user),
+    x_user_password: Optional[str] = Header(None, description="Tu contraseña de usuario para descifrar"),
+    x_unlock_token: Optional[str] = Header(None, description="Token de /api/auth/unlock (evita repetir el KDF)")
 ):
     # 1. Buscar el secreto
-    secret = db.query(models.Secret).filter(models.Secret.id == secret_id, models.Secret.is_deleted == False).first()
+    result = await db.execute(select(models.Secret).where(models.Secret.id == secret_id, models.Secret.is_deleted == False))
+    secret = result.scalars().first()
     if not secret:
         raise HTTPException(status_code=404, detail="No encontrado")
+    if secret.kind == "binary":
+        raise HTTPException(status_code=400, detail="Secreto binario: descárgalo con GET /api/secrets/{id}/content")
 
-    # 2. Verificar si el usuario tiene una llave para este secreto (sea dueño o receptor)
-    sec_key = db.query(models.SecretKey).filter(
+    # 2. Verificar si el usuario tiene una llave para este secreto (sea dueño o receptor).
+    #    Durante una rotación puede tener una por generación.
+    result = await db.execute(select(models.SecretKey).where(
         models.SecretKey.secret_id == secret.id, 
         models.SecretKey.user_id == current_user.id
-    ).first()
+    ))
+    sec_keys = {sec_key.key_generation: sec_key for sec_key in result.scalars().all()}
     
-    if not sec_key:
+    if not sec_keys:
         raise HTTPException(status_code=403, detail="No tienes permiso para acceder a este secreto")
 
+    # 3. Una única versión por el índice único (secret_id, version_number): la vigente o la pedida
+    result = await db.execute(select(models.SecretVersion).where(
+        models.SecretVersion.secret_id == secret.id,
+        models.SecretVersion.version_number == (version or secret.current_version)
+    ))
+    secret_version = result.scalars().first()
+    if not secret_version:
+        raise HTTPException(status_code=404, detail="Versión no encontrada")
+    # La llave con la que está cifrada esa versión (anterior o nueva si hay una rotación en curso)
+    sec_key = sec_keys.get(secret_version.key_generation)
+    if sec_key is None:
+        raise HTTPException(status_code=403, detail="No tienes permiso para acceder a este secreto")
+
+    # 4. Llaves del usuario: desde la sesión de desbloqueo o derivadas con su contraseña
+    keys = await resolve_user_keys(current_user, x_user_password, x_unlock_token, client_ip(request))
+    ciphertext = await load_payload(secret_version.encrypted_data, secret_version.blob_ref)
+
+    # Solo el unwrap y el descifrado traducen sus errores a 401; los fallos de
+    # auditoría o de base de datos posteriores salen como 5xx
     try:
-        # 3. Proceso de descifrado con la llave propia del usuario (Juan usa SU clave para SU llave RSA)
-        priv_pem = crypto_engine.decrypt_rsa_private_key(current_user.encrypted_private_key, x_user_password)
-        aes_key = crypto_engine.unwrap_aes_key(sec_key.encrypted_aes_key, priv_pem)
-        
-        version = secret.versions[-1]
-        decrypted = crypto_engine.decrypt_aes_gcm({
-            "ciphertext": version.encrypted_data,
-            "nonce": version.nonce_iv,
-            "tag": version.auth_tag
-        }, aes_key)
-        
-        db.add(models.AuditLog(user_id=current_user.id, action="READ_SECRET", resource_id=secret.id))
-        db.commit()
-
-        return {
-            "id": secret.id,
-            "name": secret.name,
-            "description": secret.description,
-            "owner_id": secret.owner_id,
-            "created_at": secret.created_at,
-            "content": decrypted.decode()
-        }
+        aes_key = await keys.aunwrap(sec_key.encrypted_aes_key, sec_key.wrap_alg)
+        # Conversión perezosa del acceso a la KEK: las próximas lecturas no harán RSA
+        rewrapped = keys.rewrap_for_self(aes_key, sec_key.wrap_alg)
+        content = (await crypto_engine.adecrypt_aes_gcm({
+            "ciphertext": ciphertext,
+            "nonce": secret_version.nonce_iv,
+            "tag": secret_version.auth_tag
+        }, aes_key)).decode()
+    except CryptoPoolSaturated:
+        raise
     except Exception:
         raise HTTPException(status_code=401, detail="Contraseña incorrecta o error de llave")
+
+    await audit_writer.record(db, request, current_user.id, "READ_SECRET", secret.id, commit=not rewrapped)
+    if rewrapped:
+        # Commit propio: en modo "buffered" la auditoría no confirma la sesión
+        sec_key.encrypted_aes_key, sec_key.wrap_alg = rewrapped, WRAP_AES_KW
+        await db.commit()
+
+    return {
+        "id": secret.id,
+        "name": secret.name,
+        "description": secret.description,
+        "owner_id": secret.owner_id,
+        "created_at": secret.created_at,
+        "content": content,
+        "version": secret_version.version_number
+    }
+
+# --- READ (HISTORY) ---
+@router.get("/{secret_id}/versions", response_model=List[secret_schema.SecretVersionPublic])
+async def list_secret_versions(
+    secret_id: uuid.UUID,
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user)
+):
+    """
+    Histórico de versiones de un secreto (solo metadatos, nunca el contenido cifrado).
+    Para leer una versión concreta: GET /{secret_id}?version=N.
+    """
+    result = await db.execute(select(models.SecretKey.id).join(
+        models.Secret, models.Secret.id == models.SecretKey.secret_id
+    ).where(
+        models.SecretKey.secret_id == secret_id,
+        models.SecretKey.user_id == current_user.id,
+        models.Secret.is_deleted == False
+    ))
+    if result.first() is None:
+        raise HTTPException(status_code=404, detail="No encontrado")
+
+    result = await db.execute(
+        select(models.SecretVersion.version_number, models.SecretVersion.created_at, models.SecretVersion.size_bytes).where(
+            models.SecretVersion.secret_id == secret_id
+        ).order_by(models.SecretVersion.version_number.desc())
+    )
+    return [row._asdict() for row in result.all()]
     
+# --- READ / UPDATE (CONTENIDO BINARIO) ---
+@router.get("/{secret_id}/content")
+async def download_secret_content(
+    request: Request,
+    secret_id: uuid.UUID,
+    version: Optional[int] = Query(None, ge=1, description="Versión histórica a leer (por defecto, la vigente)"),
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user),
+    x_user_password: Optional[str] = Header(None, description="Tu contraseña de usuario para descifrar"),
+    x_unlock_token: Optional[str] = Header(None, description="Token de /api/auth/unlock (evita repetir el KDF)")
+):
+    """
+    Descarga un secreto binario descifrándolo bloque a bloque (memoria constante).
+    Si un bloque no se autentica, la conexión se corta antes de completar la respuesta.
+    """
+    result = await db.execute(select(
+        models.Secret.name, models.Secret.kind, models.Secret.media_type, models.Secret.current_version,
+        models.SecretKey.encrypted_aes_key, models.SecretKey.wrap_alg, models.SecretKey.key_generation
+    ).join(models.SecretKey, and_(
+        models.SecretKey.secret_id == models.Secret.id,
+        models.SecretKey.user_id == current_user.id
+    )).where(models.Secret.id == secret_id, models.Secret.is_deleted == False))
+    # Una fila por generación de llave (dos durante una rotación)
+    grants = {row.key_generation: row for row in result.all()}
+    if not grants:
+        raise HTTPException(status_code=404, detail="No encontrado")
+    secret = next(iter(grants.values()))
+    if secret.kind != "binary":
+        raise HTTPException(status_code=400, detail="Secreto de texto: léelo con GET /api/secrets/{id}")
+
+    # Solo metadatos de la versión: los bloques se leen durante el streaming
+    result = await db.execute(select(
+        models.SecretVersion.id, models.SecretVersion.version_number, models.SecretVersion.nonce_iv,
+        models.SecretVersion.chunk_count, models.SecretVersion.size_bytes
+    ).where(
+        models.SecretVersion.secret_id == secret_id,
+        models.SecretVersion.version_number == (version or secret.current_version)
+    ))
+    secret_version = result.first()
+    if secret_version is None:
+        raise HTTPException(status_code=404, detail="Versión no encontrada")
+
+    keys = await resolve_user_keys(current_user, x_user_password, x_unlock_token, client_ip(request))
+    try:
+        aes_keys = {
+            generation: await keys.aunwrap(grant.encrypted_aes_key, grant.wrap_alg)
+            for generation, grant in grants.items()
+        }
+    except CryptoPoolSaturated:
+        raise
+    except Exception:
+        raise HTTPException(status_code=401, detail="Contraseña incorrecta o error de llave")
+
+    await audit_writer.record(db, request, current_user.id, "READ_SECRET", secret_id, commit=True)
+
+    async def plaintext():
+        # Sesión propia: la de la dependencia se cierra antes de que termine el streaming
+        async with SessionLocal() as session:
+            # Base de nonce y generación actuales: una rotación puede haber re-cifrado la versión desde la consulta anterior
+            current = (await session.execute(select(models.SecretVersion.nonce_iv, models.SecretVersion.key_generation).where(
+                models.SecretVersion.id == secret_version.id
+            ))).one()
+            async for chunk in read_chunks(session, secret_version.id, aes_keys[current.key_generation], current.nonce_iv, secret_version.chunk_count):
+                yield chunk
+
+    filename = secret.name.replace('"', "")
+    return StreamingResponse(plaintext(), media_type=secret.media_type or "application/octet-stream", headers={
+        "Content-Length": str(secret_version.size_bytes),
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "X-Secret-Version": str(secret_version.version_number),
+    })
+
+
+@router.put("/{secret_id}/content", response_model=secret_schema.SecretVersionPublic)
+async def rotate_secret_content(
+    request: Request,
+    secret_id: uuid.UUID,
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user),
+    x_user_password: Optional[str] = Header(None, description="Tu contraseña de usuario"),
+    x_unlock_token: Optional[str] = Header(None, description="Token de /api/auth/unlock (evita repetir el KDF)")
+):
+    """Sube una nueva versión de un secreto binario (misma llave AES, los receptores conservan el acceso)."""
+    secret_query = select(models.Secret).where(
+        models.Secret.id == secret_id, models.Secret.owner_id == current_user.id, models.Secret.is_deleted == False
+    )
+    secret = (await db.execute(secret_query)).scalars().first()
+    if not secret:
+        raise HTTPException(status_code=404, detail="Secreto no encontrado")
+    if secret.kind != "binary":
+        raise HTTPException(status_code=400, detail="Secreto de texto: rota el contenido con PUT /api/secrets/{id}")
+    if await active_rotation_targets(db, [secret.id]):
+        raise HTTPException(status_code=409, detail="Rotación de llaves en curso; reintenta al terminar")
+    key_generation = secret.key_generation
+
+    result = await db.execute(select(models.SecretKey.encrypted_aes_key, models.SecretKey.wrap_alg).where(
+        models.SecretKey.secret_id == secret.id,
+        models.SecretKey.user_id == current_user.id,
+        models.SecretKey.key_generation == secret.key_generation
+    ))
+    own_key = result.first()
+    if own_key is None:
+        raise HTTPException(status_code=403, detail="No tienes una llave para este secreto")
+
+    keys = await resolve_user_keys(current_user, x_user_password, x_unlock_token, client_ip(request))
+    try:
+        aes_key = await keys.aunwrap(own_key.encrypted_aes_key, own_key.wrap_alg)
+    except CryptoPoolSaturated:
+        raise
+    except Exception:
+        raise HTTPException(status_code=401, detail="Contraseña incorrecta o error de llave")
+
+    version_id, base_nonce = uuid.uuid4(), crypto_engine.generate_base_nonce()
+    spool = await _receive_binary(db, request, version_id, aes_key, base_nonce)
+
+    # Con el cuerpo ya cifrado se bloquea la fila y se comprueba que la llave
+    # usada sigue siendo la vigente (una rotación pudo terminar durante la subida)
+    try:
+        secret = (await db.execute(secret_query.with_for_update())).scalars().first()
+        if not secret:
+            raise HTTPException(status_code=404, detail="Secreto no encontrado")
+        if secret.key_generation != key_generation or await active_rotation_targets(db, [secret.id]):
+            raise HTTPException(status_code=409, detail="La llave del secreto cambió durante la subida; reintenta")
+
+        secret.current_version += 1
+        version = await _write_binary_version(db, secret, secret.current_version, version_id, base_nonce, spool)
+        await audit_writer.record(db, request, current_user.id, "ROTATE_SECRET", secret.id)
+        await record_for_audience(db, secret.id, CHANGE_VERSION, secret.current_version)
+        await db.commit()
+    finally:
+        spool.close()
+    return {"version_number": version.version_number, "created_at": version.created_at, "size_bytes": version.size_bytes}
+
 # --- UPDATE ---
 @router.put("/{secret_id}", response_model=secret_schema.SecretPublic)
-def update_secret(
-    secret_id: str,
-    secret_in: secret_schema.SecretCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+async def update_secret(
+    request: Request,
+    secret_id: uuid.UUID,
+    secret_in: secret_schema.SecretUpdate,
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user),
+    x_user_password: Optional[str] = Header(None, description="Solo si se rota el contenido"),
+    x_unlock_token: Optional[str] = Header(None, description="Solo si se rota el contenido")
 ):
-    secret = db.query(models.Secret).filter(models.Secret.id == secret_id, models.Secret.owner_id == current_user.id).first()
+    """
+    Actualiza los metadatos del secreto. Si además se envía `content`, rota el
+    contenido: se cifra con la misma llave AES (los receptores conservan el acceso)
+    y se añade una nueva SecretVersion que pasa a ser la vigente.
+    """
+    # FOR UPDATE: serializa rotaciones concurrentes sobre current_version
+    result = await db.execute(
+        select(models.Secret).where(models.Secret.id == secret_id, models.Secret.owner_id == current_user.id).with_for_update()
+    )
+    secret = result.scalars().first()
     if not secret: raise HTTPException(status_code=404, detail="Secreto no encontrado")
     
     secret.name = secret_in.name
     secret.description = secret_in.description
-    
-    # Aquí podrías agregar una nueva versión (SecretVersion) si el contenido cambió.
-    db.add(models.AuditLog(user_id=current_user.id, action="UPDATE_SECRET", resource_id=secret.id))
-    db.commit()
+
+    if secret_in.content is not None:
+        if secret.kind == "binary":
+            raise HTTPException(status_code=400, detail="Secreto binario: rota el contenido con PUT /api/secrets/{id}/content")
+        if await active_rotation_targets(db, [secret.id]):
+            raise HTTPException(status_code=409, detail="Rotación de llaves en curso; reintenta al terminar")
+        result = await db.execute(select(models.SecretKey.encrypted_aes_key, models.SecretKey.wrap_alg).where(
+            models.SecretKey.secret_id == secret.id,
+            models.SecretKey.user_id == current_user.id,
+            models.SecretKey.key_generation == secret.key_generation
+        ))
+        own_key = result.first()
+        if own_key is None:
+            raise HTTPException(status_code=403, detail="No tienes una llave para este secreto")
+
+        keys = await resolve_user_keys(current_user, x_user_password, x_unlock_token, client_ip(request))
+        try:
+            aes_key = await keys.aunwrap(own_key.encrypted_aes_key, own_key.wrap_alg)
+        except CryptoPoolSaturated:
+            raise
+        except Exception:
+            raise HTTPException(status_code=401, detail="Contraseña incorrecta o error de llave")
+
+        enc = await crypto_engine.aencrypt_aes_gcm(secret_in.content.encode(), aes_key)
+        secret.current_version += 1
+        new_version = models.SecretVersion(
+            secret_id=secret.id, version_number=secret.current_version, key_generation=secret.key_generation,
+            encrypted_data=enc["ciphertext"], nonce_iv=enc["nonce"], auth_tag=enc["tag"]
+        )
+        await offload_payload(new_version)
+        db.add(new_version)
+        await audit_writer.record(db, request, current_user.id, "ROTATE_SECRET", secret.id)
+
+    await audit_writer.record(db, request, current_user.id, "UPDATE_SECRET", secret.id)
+    kind = CHANGE_UPDATED if secret_in.content is None else CHANGE_VERSION
+    await record_for_audience(db, secret.id, kind, secret.current_version)
+    await db.commit()
     return secret
 
 # --- DELETE (SOFT DELETE) ---
 @router.delete("/{secret_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_secret(secret_id: str, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    secret = db.query(models.Secret).filter(models.Secret.id == secret_id, models.Secret.owner_id == current_user.id).first()
+async def delete_secret(request: Request, secret_id: uuid.UUID, db: AsyncSession = Depends(get_db), current_user: CachedUser = Depends(get_current_user)):
+    result = await db.execute(select(models.Secret).where(models.Secret.id == secret_id, models.Secret.owner_id == current_user.id))
+    secret = result.scalars().first()
     if not secret: raise HTTPException(status_code=404, detail="No encontrado")
     
     secret.is_deleted = True # Borrado lógico por seguridad
-    db.add(models.AuditLog(user_id=current_user.id, action="DELETE_SECRET", resource_id=secret.id))
-    db.commit()
+    await audit_writer.record(db, request, current_user.id, "DELETE_SECRET", secret.id)
+    await record_for_audience(db, secret.id, CHANGE_DELETED)
+    await db.commit()
     return None
 
 
 # -- compartir
 @router.post("/{secret_id}/share", status_code=status.HTTP_201_CREATED)
-def share_secret(
-    secret_id: str,
+async def share_secret(
+    request: Request,
+    secret_id: uuid.UUID,
     share_in: secret_schema.SecretShare,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user),
-    x_user_password: str = Header(..., description="Tu contraseña para autorizar el re-cifrado")
+    db: AsyncSession = Depends(get_db),
+    current_user: CachedUser = Depends(get_current_user),
+    x_user_password: Optional[str] = Header(None, description="Tu contraseña para autorizar el re-cifrado"),
+    x_unlock_token: Optional[str] = Header(None, description="Token de /api/auth/unlock (evita repetir el KDF)")
 ):
     """
     IMPLEMENTACIÓN DE CIFRADO HÍBRIDO:
@@ -139,62 +773,78 @@ def share_secret(
     2. Re-cifra la llave AES usando la llave pública del receptor.
     """
     
-    # 1. Verificar que el secreto existe y el emisor tiene acceso
-    secret = db.query(models.Secret).filter(models.Secret.id == secret_id, models.Secret.is_deleted == False).first()
+    # 1. Verificar que el secreto existe y el emisor tiene acceso.
+    #    FOR SHARE hasta el commit: ver share-bulk (rotación de la llave del secreto)
+    result = await db.execute(select(models.Secret).where(
+        models.Secret.id == secret_id, models.Secret.is_deleted == False
+    ).with_for_update(read=True))
+    secret = result.scalars().first()
     if not secret:
         raise HTTPException(status_code=404, detail="Secreto no encontrado")
         
-    # 2. Buscar al usuario destinatario
-    recipient = db.query(models.User).filter(models.User.username == share_in.username_to_share_with).first()
+    # 2. Buscar al usuario destinatario (FOR SHARE: ver share-bulk)
+    result = await db.execute(select(models.User).where(
+        models.User.username == share_in.username_to_share_with
+    ).with_for_update(read=True))
+    recipient = result.scalars().first()
     if not recipient:
         raise HTTPException(status_code=404, detail="El usuario destinatario no existe")
 
     # 3. Evitar duplicados (si ya tiene acceso)
-    existing_key = db.query(models.SecretKey).filter(
+    result = await db.execute(select(models.SecretKey).where(
         models.SecretKey.secret_id == secret.id, 
         models.SecretKey.user_id == recipient.id
-    ).first()
-    if existing_key:
+    ))
+    if result.scalars().first():
         raise HTTPException(status_code=400, detail="Este usuario ya tiene acceso al secreto")
+    if await active_rotation_targets(db, [secret.id, recipient.id]):
+        raise HTTPException(status_code=409, detail="Rotación de llaves en curso; reintenta al terminar")
+
+    # A. Llaves del emisor (Alex): cacheadas por /unlock o derivadas con su contraseña
+    keys = await resolve_user_keys(current_user, x_user_password, x_unlock_token, client_ip(request))
 
     try:
         # --- PROCESO CRIPTOGRÁFICO HÍBRIDO ---
         
-        # A. Descifrar la llave privada del emisor (Alex) para poder leer la llave AES
-        priv_pem = crypto_engine.decrypt_rsa_private_key(current_user.encrypted_private_key, x_user_password)
-        
         # B. Obtener la llave AES que Alex tiene para este secreto
-        owner_sec_key = db.query(models.SecretKey).filter(
+        result = await db.execute(select(models.SecretKey).where(
             models.SecretKey.secret_id == secret.id, 
-            models.SecretKey.user_id == current_user.id
-        ).first()
+            models.SecretKey.user_id == current_user.id,
+            models.SecretKey.key_generation == secret.key_generation
+        ))
+        owner_sec_key = result.scalars().first()
+        if owner_sec_key is None:
+            raise HTTPException(status_code=403, detail="No tienes una llave para este secreto")
         
-        # C. Descomponer (Unwrap) la llave AES con la privada de Alex
-        aes_key = crypto_engine.unwrap_aes_key(owner_sec_key.encrypted_aes_key, priv_pem)
+        # C. Descomponer (Unwrap) la llave AES con la privada (o la KEK) de Alex
+        aes_key = await keys.aunwrap(owner_sec_key.encrypted_aes_key, owner_sec_key.wrap_alg)
         
         # D. Envolver (Wrap) la MISMA llave AES con la pública de Juan (el receptor)
-        wrapped_key_for_recipient = crypto_engine.wrap_aes_key(aes_key, recipient.public_key)
+        wrapped_key_for_recipient = await crypto_engine.awrap_aes_key(aes_key, public_key_cache.get(recipient.id, recipient.public_key))
         
         # --- FIN DEL PROCESO CRIPTOGRÁFICO ---
+    except (CryptoPoolSaturated, HTTPException):
+        raise
+    except Exception:
+        raise HTTPException(status_code=401, detail="Error en el intercambio de llaves. Verifica tu contraseña.")
 
-        # 4. Guardar el nuevo acceso en la base de datos
-        new_access = models.SecretKey(
-            secret_id=secret.id,
-            user_id=recipient.id,
-            encrypted_aes_key=wrapped_key_for_recipient
-        )
-        db.add(new_access)
-        
-        # 5. Registrar en Auditoría
-        db.add(models.AuditLog(
-            user_id=current_user.id, 
-            action="SHARE_SECRET", 
-            resource_id=secret.id
-        ))
-        
-        db.commit()
-        return {"message": f"Secreto compartido exitosamente con {recipient.username}"}
-
-    except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=401, detail="Error en el intercambio de llaves. Verifica tu contraseña.")
\ No newline at end of file
+    # 4. Guardar el nuevo acceso en la base de datos (los errores de BD salen como 5xx)
+    new_access = models.SecretKey(
+        secret_id=secret.id,
+        user_id=recipient.id,
+        encrypted_aes_key=wrapped_key_for_recipient,
+        key_generation=secret.key_generation
+    )
+    db.add(new_access)
+    
+    # 5. Registrar en Auditoría
+    await audit_writer.record(db, request, current_user.id, "SHARE_SECRET", secret.id)
+    await record_changes(db, [change(recipient.id, secret.id, CHANGE_SHARED, secret.current_version)])
+    
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Otro reparto concurrente concedió este acceso
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Conflicto con otro reparto concurrente; reintenta")
+    return {"message": f"Secreto compartido exitosamente con {recipient.username}"}
\ No newline at end of file
@@ -7,11 +7,146 @@ class Settings(BaseSettings):
     """
     # Base de Datos
     DATABASE_URL: str
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: int = 30
+    # Caché de sentencias preparadas de asyncpg (0 la desactiva, p.ej. detrás de PgBouncer)
+    DB_STATEMENT_CACHE_SIZE: int = 100
+    # Filas por sentencia en los INSERT multi-fila del ORM (insertmanyvalues)
+    DB_INSERTMANYVALUES_PAGE_SIZE: int = 1000
+    # Solo desarrollo: create_all al arrancar. En despliegues el esquema lo aplica `alembic upgrade head`
+    DB_CREATE_ALL_ON_STARTUP: bool = False
 
     # JWT
     SECRET_KEY: str
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    # Incluir el id del usuario en el token (claim "uid") para resolverlo por clave primaria
+    TOKEN_INCLUDE_USER_ID: bool = True
+
+    # Caché de identidades (evita consultar `users` en cada petición)
+    IDENTITY_CACHE_TTL_SECONDS: int = 60
+    IDENTITY_CACHE_MAX_ENTRIES: int = 10000
+
+    # Caché de llaves públicas RSA ya parseadas (wrap de llaves AES)
+    PUBLIC_KEY_CACHE_MAX_ENTRIES: int = 4096
+
+    # Paginación por cursor de los listados
+    PAGE_SIZE_DEFAULT: int = 100
+    PAGE_SIZE_MAX: int = 500
+    # Filas por lote al exportar auditoría desde el cursor del servidor
+    AUDIT_EXPORT_BATCH_SIZE: int = 1000
+
+    # Máximo de secretos por petición de importación masiva
+    SECRET_IMPORT_MAX_ITEMS: int = 500
+
+    # Secretos binarios: tamaño de bloque AES-GCM, límite de subida y bloques por INSERT
+    SECRET_CHUNK_SIZE: int = 64 * 1024
+    SECRET_BINARY_MAX_BYTES: int = 64 * 1024 * 1024
+    SECRET_CHUNK_INSERT_BATCH: int = 16
+    # Bloques cifrados de una subida en curso: en memoria hasta este tamaño, después en un fichero temporal
+    SECRET_UPLOAD_SPOOL_MEMORY: int = 1024 * 1024
+
+    # Almacén de payloads cifrados: "inline" (columna en Postgres), "fs" (disco local) o "s3"
+    BLOB_STORE: str = "inline"
+    # Los payloads por debajo de este tamaño se quedan inline aunque haya almacén externo
+    BLOB_INLINE_THRESHOLD: int = 4096
+    BLOB_FS_ROOT: str = "/var/lib/aegisvault/blobs"
+    BLOB_S3_BUCKET: str = "aegisvault-blobs"
+    BLOB_S3_PREFIX: str = "versions/"
+    # URL del endpoint S3 (MinIO, etc.); "memory" usa el sustituto en memoria para pruebas
+    BLOB_S3_ENDPOINT_URL: str = ""
+
+    # Escritura de auditoría: "sync" (fail-closed, misma transacción) o "buffered" (cola + lotes)
+    AUDIT_MODE: str = "sync"
+    AUDIT_QUEUE_SIZE: int = 10000
+    AUDIT_BATCH_SIZE: int = 500
+    AUDIT_FLUSH_INTERVAL: float = 0.5
+    # Confiar en X-Forwarded-For para la IP auditada (solo detrás de un proxy propio)
+    AUDIT_TRUST_FORWARDED_FOR: bool = False
+
+    # Hashing de contraseñas: el primer esquema se usa para hashes nuevos, el resto se migra al hacer login.
+    # Ajustar con: python -m app.services.password_hasher --target-ms 250
+    PASSWORD_SCHEMES: str = "argon2,bcrypt"
+    PASSWORD_ARGON2_TIME_COST: int = 3
+    PASSWORD_ARGON2_MEMORY_COST: int = 65536  # KiB
+    PASSWORD_ARGON2_PARALLELISM: int = 4
+    PASSWORD_BCRYPT_ROUNDS: int = 12
+
+    # KDF con el que se envuelve la llave privada RSA ("scrypt" o "argon2id").
+    # Los bundles con parámetros distintos se re-envuelven al hacer /unlock.
+    # Comparar costes con: python -m app.services.kdf
+    KDF_ALGORITHM: str = "scrypt"
+    KDF_SCRYPT_N: int = 2**14
+    KDF_SCRYPT_R: int = 8
+    KDF_SCRYPT_P: int = 1
+    KDF_ARGON2_TIME_COST: int = 3
+    KDF_ARGON2_MEMORY_COST: int = 65536  # KiB
+    KDF_ARGON2_PARALLELISM: int = 1
+
+    # Sesiones de desbloqueo: selladas en la tabla unlock_sessions (válidas en cualquier
+    # worker) y abiertas en una caché local de UNLOCK_CACHE_MAX_ENTRIES por worker
+    UNLOCK_TTL_SECONDS: int = 900
+    UNLOCK_CACHE_MAX_ENTRIES: int = 1024
+    # KEK simétrica por usuario: los accesos propios pasan de RSA-OAEP a AES-KW al leerlos
+    USER_KEK_ENABLED: bool = True
+
+    # Limitación de login, /unlock y operaciones que derivan la llave con X-User-Password:
+    # token buckets por usuario y por IP (peticiones/segundo y ráfaga) y backoff
+    # exponencial tras THROTTLE_FREE_FAILURES fallos seguidos (se olvidan tras la ventana)
+    THROTTLE_ENABLED: bool = True
+    # "memory" (estado del proceso) o "redis" (compartido entre workers y réplicas)
+    THROTTLE_BACKEND: str = "memory"
+    THROTTLE_REDIS_URL: str = "redis://localhost:6379/0"
+    THROTTLE_USER_RATE: float = 1.0
+    THROTTLE_USER_BURST: int = 10
+    THROTTLE_IP_RATE: float = 5.0
+    THROTTLE_IP_BURST: int = 50
+    THROTTLE_FREE_FAILURES: int = 3
+    THROTTLE_BACKOFF_BASE_SECONDS: float = 1.0
+    THROTTLE_BACKOFF_MAX_SECONDS: float = 300.0
+    THROTTLE_FAILURE_WINDOW_SECONDS: int = 900
+    THROTTLE_MAX_ENTRIES: int = 100000
+    THROTTLE_SWEEP_INTERVAL: float = 60.0
+
+    # Trabajos de rotación de llaves: filas por lote, pausa entre lotes y trabajos simultáneos
+    ROTATION_BATCH_SIZE: int = 100
+    ROTATION_BATCH_PAUSE_SECONDS: float = 0.05
+    ROTATION_MAX_ACTIVE_JOBS: int = 2
+    # Segundos sin progreso tras los que un trabajo a medias se da por abandonado (su worker murió)
+    ROTATION_STALE_SECONDS: int = 300
+
+    # Feed de cambios (/api/changes): espera máxima del long-poll, latido de SSE,
+    # sondeo cuando no hay LISTEN/NOTIFY (p.ej. sin Postgres) y días de retención
+    CHANGE_FEED_MAX_WAIT_SECONDS: int = 60
+    CHANGE_FEED_HEARTBEAT_SECONDS: int = 15
+    CHANGE_FEED_POLL_INTERVAL: float = 2.0
+    CHANGE_FEED_RETENTION_DAYS: int = 30
+
+    # Laboratorio de cifrados clásicos: texto máximo en JSON, subidas en streaming,
+    # letras muestreadas para estimar la clave y longitud de clave máxima a probar
+    LAB_MAX_TEXT_CHARS: int = 4 * 1024 * 1024
+    LAB_MAX_UPLOAD_BYTES: int = 64 * 1024 * 1024
+    LAB_ANALYSIS_SAMPLE_LETTERS: int = 200_000
+    LAB_MAX_KEY_LENGTH: int = 40
+
+    # Métricas (/metrics) y cabecera Server-Timing con el desglose por etapa de cada respuesta
+    # Token de /metrics y /api/ops/* (cabecera X-Ops-Token o Authorization: Bearer);
+    # vacío = endpoints de operación deshabilitados (404)
+    OPS_TOKEN: str = ""
+    METRICS_ENABLED: bool = True
+    METRICS_SERVER_TIMING: bool = False
+
+    # Pool criptográfico ("thread" o "process") con cola acotada
+    CRYPTO_EXECUTOR: str = "thread"
+    CRYPTO_WORKERS: int = os.cpu_count() or 2
+    CRYPTO_MAX_QUEUE: int = 64
+    CRYPTO_RETRY_AFTER_SECONDS: int = 1
+
+    # Reserva de pares RSA pre-generados para /register (0 la desactiva)
+    RSA_KEY_POOL_SIZE: int = 16
+    RSA_KEY_POOL_LOW_WATER: int = 4
+    RSA_KEY_POOL_REFILL_INTERVAL: float = 0.1
 
     class Config:
         # Pydantic-settings buscará un archivo .env para cargar las variables
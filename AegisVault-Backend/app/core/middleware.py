@@ -0,0 +1,63 @@
+import time
+from typing import Any, Callable, Dict
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.services.metrics import RequestTimings, current_timings, http_db_queries, http_duration, http_requests
+
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI puro (sin BaseHTTPMiddleware, que rompe el streaming y copia
+    el contexto). Abre un `RequestTimings` por petición y, al terminar, registra
+    latencia, estado y consultas SQL bajo la plantilla de la ruta (`/api/secrets/{secret_id}`),
+    no bajo la URL concreta, para que la cardinalidad de las etiquetas quede acotada.
+    Con `server_timing=True` añade la cabecera Server-Timing con el desglose por etapa.
+    """
+
+    def __init__(self, app: ASGIApp, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+        self._routes: Dict[Callable[..., Any], str] = {}
+
+    def _route_template(self, scope: Scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return UNMATCHED_ROUTE
+        if endpoint not in self._routes:
+            for route in scope["app"].routes:
+                if getattr(route, "endpoint", None) is not None:
+                    self._routes.setdefault(route.endpoint, route.path)
+        return self._routes.get(endpoint, UNMATCHED_ROUTE)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if self.server_timing:
+                    # En respuestas en streaming solo incluye lo ocurrido antes del primer byte
+                    MutableHeaders(scope=message).append("Server-Timing", timings.server_timing(time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - started
+            route = self._route_template(scope)
+            http_requests.inc(method=scope["method"], route=route, status=status_code)
+            http_duration.observe(elapsed, method=scope["method"], route=route)
+            http_db_queries.observe(timings.db_queries, route=route)
+            current_timings.reset(token)
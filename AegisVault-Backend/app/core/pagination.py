@@ -0,0 +1,28 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+from typing import Tuple
+
+# Cabecera en la que se devuelve el cursor de la siguiente página.
+# Los listados conservan su forma (un array JSON) para no romper a los clientes existentes.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(timestamp: datetime, row_id: uuid.UUID) -> str:
+    """Codifica la posición (timestamp, id) de la última fila devuelta como cursor opaco."""
+    raw = json.dumps([timestamp.isoformat(), str(row_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, uuid.UUID]:
+    """
+    Decodifica un cursor generado por `encode_cursor`.
+    Lanza ValueError si el cursor está mal formado.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(timestamp), uuid.UUID(row_id)
+    except Exception as e:
+        raise ValueError("Cursor inválido") from e
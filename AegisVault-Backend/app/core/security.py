@@ -2,14 +2,13 @@ from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel
 
 from .config import settings
+from app.services.password_hasher import password_hasher
 
-# Contexto de Passlib para hashing de contraseñas.
-# Especificamos bcrypt como el algoritmo.
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashing de contraseñas: mismo servicio que usa el CryptoEngine (ver app/services/password_hasher.py).
+pwd_context = password_hasher.context
 
 class TokenData(BaseModel):
     """Esquema para los datos contenidos dentro de un token JWT."""
@@ -18,12 +17,12 @@ class TokenData(BaseModel):
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verifica si una contraseña plana coincide con su hash."""
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_hasher.verify(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
     """Genera el hash de una contraseña."""
-    return pwd_context.hash(password)
+    return password_hasher.hash(password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
@@ -40,3 +39,11 @@ def decode_token(token: str) -> Optional[str]:
         return payload.get("sub")
     except JWTError:
         return None
+
+
+def decode_token_claims(token: str) -> Optional[dict]:
+    """Decodifica el token y devuelve todos sus claims (sub y, si existe, uid)."""
+    try:
+        return jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+    except JWTError:
+        return None
@@ -6,7 +6,7 @@
 
 import uuid
 from sqlalchemy import (
-    Column, String, Text, DateTime, Boolean, ForeignKey, Integer, LargeBinary
+    BigInteger, Column, String, Text, DateTime, Boolean, ForeignKey, Integer, LargeBinary, Index
 )
 from sqlalchemy.dialects.postgresql import UUID, INET
 from sqlalchemy.orm import relationship
@@ -24,6 +24,8 @@ class User(Base):
     # Llaves criptográficas del usuario
     public_key = Column(Text, nullable=False, comment="Clave pública RSA en formato PEM")
     encrypted_private_key = Column(Text, nullable=False, comment="Clave privada RSA cifrada con la contraseña del usuario")
+    # KEK simétrica del usuario envuelta con su llave pública (RSA-OAEP); se crea al primer /unlock
+    encrypted_kek = Column(LargeBinary, nullable=True, comment="KEK AES-256 envuelta con la llave pública RSA del usuario")
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
@@ -40,15 +42,33 @@ class Secret(Base):
     name = Column(String(100), index=True, nullable=False)
     description = Column(Text, nullable=True)
     is_deleted = Column(Boolean, default=False, nullable=False)
+    # "text" (contenido JSON) o "binary" (subida/descarga por streaming en bloques)
+    kind = Column(String(10), nullable=False, default="text", server_default="text")
+    media_type = Column(String(100), nullable=True, comment="Content-Type de los secretos binarios")
+    # Número de la versión vigente; las lecturas cargan solo esa SecretVersion
+    current_version = Column(Integer, nullable=False, default=1, server_default="1")
+    # Generación vigente de la llave AES; durante una rotación conviven la anterior y la nueva
+    key_generation = Column(Integer, nullable=False, default=1, server_default="1")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     owner_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
 
     # Relaciones
     owner = relationship("User", back_populates="secrets_owned")
-    versions = relationship("SecretVersion", back_populates="secret", cascade="all, delete-orphan")
+    # lazy="raise": el histórico (con sus blobs cifrados) solo se carga con una consulta explícita
+    versions = relationship("SecretVersion", back_populates="secret", cascade="all, delete-orphan", lazy="raise")
     keys = relationship("SecretKey", back_populates="secret", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Paginación por cursor sobre (created_at, id) y filtro por dueño
+        Index("ix_secrets_created_at_id", "created_at", "id"),
+        Index("ix_secrets_owner_created_at_id", "owner_id", "created_at", "id"),
+        # Búsqueda por prefijo de nombre (LIKE 'prefijo%') independiente de la collation
+        Index("ix_secrets_name_prefix", "name", postgresql_ops={"name": "text_pattern_ops"}),
+    )
+    # created_at (server_default) vuelve en el RETURNING del propio INSERT: sin refresh tras el commit
+    __mapper_args__ = {"eager_defaults": True}
+
 
 class SecretVersion(Base):
     __tablename__ = "secret_versions"
@@ -56,10 +76,17 @@ class SecretVersion(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     version_number = Column(Integer, nullable=False)
     
-    # Payload cifrado con AES-256-GCM
-    encrypted_data = Column(LargeBinary, nullable=False, comment="El contenido del secreto, cifrado")
-    nonce_iv = Column(LargeBinary, nullable=False, comment="Vector de inicialización para el cifrado AES-GCM")
-    auth_tag = Column(LargeBinary, nullable=False, comment="Tag de autenticación para el cifrado AES-GCM")
+    # Payload cifrado con AES-256-GCM (vacío en las versiones binarias, que viven en secret_chunks)
+    encrypted_data = Column(LargeBinary, nullable=True, comment="El contenido del secreto, cifrado")
+    nonce_iv = Column(LargeBinary, nullable=False, comment="Vector de inicialización (nonce base en las versiones binarias)")
+    auth_tag = Column(LargeBinary, nullable=True, comment="Tag de autenticación para el cifrado AES-GCM")
+    # Payloads grandes: el ciphertext vive en el almacén de blobs y aquí solo queda la referencia
+    blob_ref = Column(String(100), nullable=True, comment="Referencia '<backend>:<sha256>' en el almacén de blobs")
+    size_bytes = Column(BigInteger, nullable=True, comment="Tamaño del payload (en claro para binarios, cifrado para texto)")
+    # Solo versiones binarias
+    chunk_count = Column(Integer, nullable=True)
+    # Generación de la llave AES con la que está cifrada esta versión
+    key_generation = Column(Integer, nullable=False, default=1, server_default="1")
     
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
@@ -68,6 +95,21 @@ class SecretVersion(Base):
     # Relaciones
     secret = relationship("Secret", back_populates="versions")
 
+    __table_args__ = (
+        # Acceso directo a una versión concreta; impide números de versión duplicados
+        Index("uq_secret_versions_secret_id_version_number", "secret_id", "version_number", unique=True),
+    )
+    __mapper_args__ = {"eager_defaults": True}
+
+
+class SecretChunk(Base):
+    """Bloque cifrado (ciphertext || tag) de una versión binaria."""
+    __tablename__ = "secret_chunks"
+
+    version_id = Column(UUID(as_uuid=True), ForeignKey("secret_versions.id", ondelete="CASCADE"), primary_key=True)
+    chunk_index = Column(Integer, primary_key=True)
+    data = Column(LargeBinary, nullable=False)
+
 
 class SecretKey(Base):
     __tablename__ = "secret_keys"
@@ -75,7 +117,13 @@ class SecretKey(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     
     # La llave AES del secreto, cifrada con la llave pública RSA del usuario
-    encrypted_aes_key = Column(LargeBinary, nullable=False, comment="Llave AES envuelta con la llave pública RSA del usuario")
+    encrypted_aes_key = Column(LargeBinary, nullable=False, comment="Llave AES envuelta para el usuario (ver wrap_alg)")
+    # "rsa-oaep" (llave pública) o "aes-kw" (KEK del usuario); los accesos propios se convierten al leerlos
+    wrap_alg = Column(String(16), nullable=False, default="rsa-oaep", server_default="rsa-oaep")
+    # Generación de la llave AES envuelta (ver Secret.key_generation)
+    key_generation = Column(Integer, nullable=False, default=1, server_default="1")
+    # Rotación del par RSA del usuario: llave AES ya envuelta con la llave pública nueva, pendiente de activar
+    rewrapped_aes_key = Column(LargeBinary, nullable=True)
     
     granted_at = Column(DateTime(timezone=True), server_default=func.now())
     
@@ -86,6 +134,11 @@ class SecretKey(Base):
     secret = relationship("Secret", back_populates="keys")
     user = relationship("User", back_populates="secret_keys")
 
+    __table_args__ = (
+        # Un único acceso por (usuario, secreto, generación); también resuelve los listados por usuario
+        Index("ix_secret_keys_user_id_secret_id_generation", "user_id", "secret_id", "key_generation", unique=True),
+    )
+
 
 class AuditLog(Base):
     __tablename__ = "audit_logs"
@@ -99,4 +152,99 @@ class AuditLog(Base):
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
 
     # Relaciones
-    user = relationship("User", back_populates="audit_logs")
\ No newline at end of file
+    user = relationship("User", back_populates="audit_logs")
+
+    __table_args__ = (
+        # Consultas por usuario ordenadas/filtradas por fecha
+        Index("ix_audit_logs_user_id_timestamp", "user_id", "timestamp"),
+    )
+
+
+class RotationJob(Base):
+    """
+    Progreso persistente de un trabajo de rotación de llaves.
+    El servidor no guarda material en claro: tras un reinicio el trabajo queda en
+    "waiting_credentials" y su dueño lo reanuda desde el cursor guardado.
+    """
+    __tablename__ = "rotation_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    kind = Column(String(20), nullable=False, comment="'secret_key' o 'user_keypair'")
+    target_id = Column(UUID(as_uuid=True), nullable=False, comment="Secreto o usuario rotado")
+    status = Column(String(20), nullable=False, default="pending")
+    stage = Column(String(20), nullable=False, default="grants")
+    cursor = Column(String(64), nullable=True, comment="Último id procesado de la etapa en curso")
+    processed = Column(Integer, nullable=False, default=0)
+    total = Column(Integer, nullable=False, default=0)
+    from_generation = Column(Integer, nullable=True)
+    to_generation = Column(Integer, nullable=True)
+    # Rotación del par RSA: llave pública nueva y privada nueva cifrada con la contraseña del usuario
+    new_public_key = Column(Text, nullable=True)
+    new_encrypted_private_key = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+
+    __table_args__ = (
+        Index("ix_rotation_jobs_target_status", "target_id", "status"),
+        Index("ix_rotation_jobs_user_id_created_at", "user_id", "created_at"),
+    )
+    __mapper_args__ = {"eager_defaults": True}
+
+
+class UserChangeSequence(Base):
+    """
+    Último número de cambio asignado a cada usuario. Reservar números actualiza
+    esta fila, cuyo bloqueo dura hasta el commit: los cambios de un mismo usuario
+    se confirman en el orden de su secuencia y sin huecos.
+    """
+    __tablename__ = "user_change_sequences"
+
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
+    last_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+
+class SecretChange(Base):
+    """
+    Feed de cambios por usuario: una fila por usuario afectado y cambio
+    (alta, metadatos, nueva versión, acceso concedido, borrado).
+    Sin claves foráneas, como registro de solo inserción que no bloquea filas ajenas.
+    """
+    __tablename__ = "secret_changes"
+
+    user_id = Column(UUID(as_uuid=True), primary_key=True)
+    seq = Column(BigInteger, primary_key=True, autoincrement=False)
+    secret_id = Column(UUID(as_uuid=True), nullable=False)
+    kind = Column(String(16), nullable=False, comment="'created', 'updated', 'version', 'shared' o 'deleted'")
+    # Versión vigente tras el cambio (para saber si hace falta volver a leer el contenido)
+    version_number = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        # Purga por antigüedad
+        Index("ix_secret_changes_created_at", "created_at"),
+    )
+
+
+class UnlockSession(Base):
+    """
+    Sesión de desbloqueo (/api/auth/unlock) compartida por todos los workers.
+    Solo se guarda el hash del token; `sealed_keys` (llave privada y KEK) está
+    cifrado con una llave derivada del propio token, que la base de datos no tiene.
+    """
+    __tablename__ = "unlock_sessions"
+
+    token_hash = Column(String(64), primary_key=True, comment="SHA-256 del token de desbloqueo")
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    sealed_keys = Column(LargeBinary, nullable=False, comment="Llave privada y KEK selladas con el token (AES-GCM)")
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        # Revocación por usuario (logout, rotación del par) y limpieza de caducadas
+        Index("ix_unlock_sessions_user_id", "user_id"),
+        Index("ix_unlock_sessions_expires_at", "expires_at"),
+    )
@@ -1,32 +1,88 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.declarative import declarative_base
+from typing import Optional
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
 
 from app.core.config import settings
+from app.services.metrics import instrument_engine
+
+
+def _async_database_url(url: str) -> str:
+    """
+    Traduce la URL de conexión al driver asíncrono (asyncpg).
+    Permite seguir usando `postgresql://...` en el .env existente.
+    """
+    parsed = make_url(url)
+    if parsed.drivername in ("postgres", "postgresql", "postgresql+psycopg2"):
+        parsed = parsed.set(drivername="postgresql+asyncpg")
+    return parsed.render_as_string(hide_password=False)
+
+
+_engine: Optional[AsyncEngine] = None
+_session_factory: Optional[async_sessionmaker] = None
+
+
+def get_engine() -> AsyncEngine:
+    """
+    Motor asíncrono de SQLAlchemy, creado en el primer uso y no al importar: con
+    `preload_app` el proceso maestro importa la app sin abrir conexiones y cada
+    worker crea su propio pool tras el fork.
+    pool_pre_ping=True verifica las conexiones antes de usarlas, lo que previene errores
+    con conexiones que han sido cerradas por la base de datos.
+    El tamaño del pool y la caché de sentencias preparadas de asyncpg son configurables.
+    insertmanyvalues_page_size acota cuántas filas agrupa el ORM en cada INSERT ... VALUES (...), (...).
+    """
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine(
+            _async_database_url(settings.DATABASE_URL),
+            pool_pre_ping=True,
+            insertmanyvalues_page_size=settings.DB_INSERTMANYVALUES_PAGE_SIZE,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            connect_args={"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE},
+        )
+        # Número y duración de las consultas (global y por petición) para /metrics y Server-Timing
+        instrument_engine(_engine.sync_engine)
+    return _engine
+
 
-# Crea el motor de SQLAlchemy usando la URL de la base de datos desde la configuración.
-# pool_pre_ping=True verifica las conexiones antes de usarlas, lo que previene errores
-# con conexiones que han sido cerradas por la base de datos.
-engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True)
+def get_sessionmaker() -> async_sessionmaker:
+    """
+    Fábrica de sesiones asíncronas configurada.
+    expire_on_commit=False evita recargas implícitas (lazy loads) tras el commit,
+    que no están permitidas en el modo asíncrono.
+    """
+    global _session_factory
+    if _session_factory is None:
+        _session_factory = async_sessionmaker(bind=get_engine(), class_=AsyncSession, autoflush=False, expire_on_commit=False)
+    return _session_factory
 
-# Crea una fábrica de sesiones configurada.
-# autocommit=False y autoflush=False son las configuraciones estándar para
-# usar sesiones de base de datos dentro de un framework web como FastAPI.
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def SessionLocal() -> AsyncSession:
+    """Nueva sesión (`async with SessionLocal() as db:`), como la antigua fábrica a nivel de módulo."""
+    return get_sessionmaker()()
+
+
+async def dispose_engine() -> None:
+    """Cierra el pool de conexiones; la siguiente consulta crea un motor nuevo."""
+    global _engine, _session_factory
+    if _engine is not None:
+        await _engine.dispose()
+    _engine = None
+    _session_factory = None
 
 # Base declarativa. Nuestras clases de modelos ORM heredarán de esta clase.
 Base = declarative_base()
 
 # --- Dependencia para FastAPI ---
-def get_db():
+async def get_db():
     """
-    Generador de sesión de base de datos para ser usado como dependencia en los endpoints de FastAPI.
-    Asegura que la sesión de la base de datos se cierre siempre después de que la petición
+    Generador de sesión asíncrona de base de datos para ser usado como dependencia en los
+    endpoints de FastAPI. Asegura que la sesión se cierre siempre después de que la petición
     haya sido completada.
     """
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
-
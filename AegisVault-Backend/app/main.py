@@ -1,39 +1,159 @@
-from fastapi import FastAPI
+import time
+
+# Referencia para medir el coste de importación (ver app.state.startup_timings)
+_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict
+
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from app.db.session import engine, Base
-from app.api import auth, secrets, lab
+from fastapi.responses import JSONResponse, PlainTextResponse
+from app.core.config import settings
+from app.core.middleware import MetricsMiddleware
+from app.core.pagination import NEXT_CURSOR_HEADER
+from app.db.session import Base, dispose_engine, get_engine
+from app.api import auth, secrets, lab, ops, rotations, changes
+from app.services.audit_writer import audit_writer
+from app.services.blob_store import blob_store
+from app.services.change_feed import change_feed
+from app.services.crypto_executor import CryptoPoolSaturated, crypto_executor
+from app.services.identity_cache import identity_cache
+from app.services.key_pool import rsa_key_pool
+from app.services.metrics import CONTENT_TYPE, registry
+from app.services.password_hasher import password_hasher
+from app.services.public_key_cache import public_key_cache
+from app.services.rotation import rotation_runner
+from app.services.session_keys import unlocked_key_cache
+from app.services.throttle import Throttled, throttle
+
+# Tiempos de arranque en segundos (import, create_app, lifespan), también como gauges en /metrics
+startup_timings: Dict[str, float] = {}
+
+# Estado de cachés y pools expuesto como gauges en /metrics (singletons del proceso)
+registry.add_stats("crypto_pool", crypto_executor.stats)
+registry.add_stats("key_pool", rsa_key_pool.stats)
+registry.add_stats("identity_cache", identity_cache.stats)
+registry.add_stats("public_key_cache", public_key_cache.stats)
+registry.add_stats("audit_writer", audit_writer.stats)
+registry.add_stats("blob_store", blob_store.stats)
+registry.add_stats("rotation", rotation_runner.stats)
+registry.add_stats("change_feed", change_feed.stats)
+registry.add_stats("throttle", throttle.stats)
+registry.add_stats("unlock_sessions", unlocked_key_cache.stats)
+registry.add_stats("startup", lambda: dict(startup_timings))
+
+
+async def crypto_pool_saturated_handler(request: Request, exc: CryptoPoolSaturated):
+    # Back-pressure: preferimos rechazar rápido antes que encolar sin límite.
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Servidor ocupado procesando operaciones criptográficas. Reintenta en breve."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+async def throttled_handler(request: Request, exc: Throttled):
+    # Se rechaza antes del KDF: la CPU queda para el tráfico legítimo
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Demasiados intentos. Reintenta más tarde."},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+def metrics():
+    # Formato de exposición de Prometheus
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
 
-# Crear tablas (Desarrollo)
-Base.metadata.create_all(bind=engine)
 
-app = FastAPI(
-    title="🛡️ AegisVault - Professional Secure API",
-    description="""
-    AegisVault es una API de seguridad avanzada con Cifrado Híbrido.
-    
-    **Instrucciones de Swagger:**
-    1. Ve a **Authentication** -> `/api/auth/login`.
-    2. Usa el usuario y clave que registraste.
-    3. Copia el `access_token`.
-    4. Haz clic en el botón **Authorize** (arriba a la derecha) y pega el token.
-    """,
-    version="1.0.0",
-)
-
-# Configuración de CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"], 
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Incluir Rutas
-app.include_router(auth.router, prefix="/api/auth", tags=["🛡️ Authentication"])
-app.include_router(secrets.router, prefix="/api/secrets", tags=["🔑 Secrets Management"])
-app.include_router(lab.router, prefix="/api/lab", tags=["🧪 Educational Lab"])
-
-@app.get("/", include_in_schema=False)
 def root():
-    return {"message": "API is active. Go to /docs"}
\ No newline at end of file
+    return {"message": "API is active. Go to /docs"}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Arranque y parada de cada worker. No abre conexiones: el esquema lo gestionan
+    las migraciones (`alembic upgrade head`) y el pool se crea en la primera consulta.
+    """
+    started = time.perf_counter()
+    if settings.DB_CREATE_ALL_ON_STARTUP:
+        # Solo desarrollo: crea las tablas que falten sin pasar por las migraciones
+        async with get_engine().begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    rsa_key_pool.start()
+    audit_writer.start()
+    rotation_runner.start()
+    change_feed.start()
+    throttle.start()
+    # Hash señuelo de los logins de usuarios inexistentes: en segundo plano, sin retrasar el arranque
+    dummy_hash = asyncio.create_task(crypto_executor.run_callable("prepare_dummy_hash", password_hasher.prepare_dummy_hash))
+    startup_timings["lifespan_seconds"] = round(time.perf_counter() - started, 6)
+    yield
+    dummy_hash.cancel()
+    await asyncio.gather(dummy_hash, return_exceptions=True)
+    await throttle.stop()
+    await change_feed.stop()
+    await rotation_runner.stop()
+    await rsa_key_pool.stop()
+    await audit_writer.stop()
+    crypto_executor.shutdown()
+    await dispose_engine()
+
+
+def create_app() -> FastAPI:
+    """
+    Fábrica de la aplicación. Construirla no toca la base de datos ni lanza tareas,
+    así que el proceso maestro de gunicorn puede precargarla (`preload_app`) y los
+    workers comparten tras el fork la memoria de los módulos ya importados.
+    """
+    started = time.perf_counter()
+    app = FastAPI(
+        title="🛡️ AegisVault - Professional Secure API",
+        description="""
+        AegisVault es una API de seguridad avanzada con Cifrado Híbrido.
+    
+        **Instrucciones de Swagger:**
+        1. Ve a **Authentication** -> `/api/auth/login`.
+        2. Usa el usuario y clave que registraste.
+        3. Copia el `access_token`.
+        4. Haz clic en el botón **Authorize** (arriba a la derecha) y pega el token.
+        """,
+        version="1.0.0",
+        lifespan=lifespan,
+    )
+
+    # Configuración de CORS
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"], 
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER, "Server-Timing"],
+    )
+    # Métricas por ruta (y Server-Timing opcional); se añade después de CORS para envolverlo y medirlo también
+    if settings.METRICS_ENABLED:
+        app.add_middleware(MetricsMiddleware, server_timing=settings.METRICS_SERVER_TIMING)
+
+    # Incluir Rutas
+    app.include_router(auth.router, prefix="/api/auth", tags=["🛡️ Authentication"])
+    app.include_router(secrets.router, prefix="/api/secrets", tags=["🔑 Secrets Management"])
+    app.include_router(lab.router, prefix="/api/lab", tags=["🧪 Educational Lab"])
+    app.include_router(rotations.router, prefix="/api/rotations", tags=["🔄 Key Rotation"])
+    app.include_router(changes.router, prefix="/api/changes", tags=["📡 Change Feed"])
+    app.include_router(ops.router, prefix="/api/ops", tags=["⚙️ Operations"])
+
+    app.add_exception_handler(CryptoPoolSaturated, crypto_pool_saturated_handler)
+    app.add_exception_handler(Throttled, throttled_handler)
+    app.add_api_route("/metrics", metrics, include_in_schema=False, dependencies=[Depends(ops.require_ops_token)])
+    app.add_api_route("/", root, include_in_schema=False)
+
+    startup_timings["create_app_seconds"] = round(time.perf_counter() - started, 6)
+    return app
+
+
+startup_timings["import_seconds"] = round(time.perf_counter() - _IMPORT_STARTED, 6)
+app = create_app()
@@ -2,7 +2,7 @@
 import uuid
 from datetime import datetime
 from typing import Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, field_validator
 
 class AuditLogOut(BaseModel):
     id: uuid.UUID
@@ -11,6 +11,12 @@ class AuditLogOut(BaseModel):
     ip_address: Optional[str] = None
     timestamp: datetime
 
+    @field_validator("ip_address", mode="before")
+    @classmethod
+    def ip_as_text(cls, value):
+        # La columna INET llega como objeto ipaddress desde el driver
+        return str(value) if value is not None else None
+
     class Config:
         # Esto permite que Pydantic lea los datos de los modelos de SQLAlchemy
         from_attributes = True
\ No newline at end of file
@@ -0,0 +1,24 @@
+# AegisVault-Backend/app/schemas/change.py
+import uuid
+from datetime import datetime
+from typing import List, Optional
+from pydantic import BaseModel
+
+class SecretChangeOut(BaseModel):
+    seq: int
+    secret_id: uuid.UUID
+    # 'created', 'updated', 'version', 'shared' o 'deleted'
+    kind: str
+    version_number: Optional[int] = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class ChangePage(BaseModel):
+    changes: List[SecretChangeOut]
+    # Último seq entregado: se envía como `since` en la siguiente consulta
+    cursor: int
+    # Quedan más cambios tras esta página: consultar de nuevo sin esperar
+    has_more: bool
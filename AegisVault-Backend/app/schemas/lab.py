@@ -0,0 +1,93 @@
+# AegisVault-Backend/app/schemas/lab.py
+from enum import Enum
+from typing import Dict, Optional
+from pydantic import BaseModel, Field
+
+from app.core.config import settings
+
+# --- Esquemas del laboratorio de cifrados clásicos ---
+
+class CipherName(str, Enum):
+    vigenere = "vigenere"
+    caesar = "caesar"
+    affine = "affine"
+
+
+class CipherMode(str, Enum):
+    encrypt = "encrypt"
+    decrypt = "decrypt"
+
+
+class Language(str, Enum):
+    """Idioma de referencia para las frecuencias de letras."""
+    en = "en"
+    es = "es"
+
+
+class VigenereRequest(BaseModel):
+    text: str = Field(..., max_length=settings.LAB_MAX_TEXT_CHARS)
+    key: str = Field(..., min_length=1, max_length=256)
+
+
+class CipherRequest(BaseModel):
+    """
+    Cifra o descifra `text`. Parámetros según el cifrado:
+    Vigenère `key`; César `shift`; afín `a` (coprimo con 26) y `b`.
+    """
+    cipher: CipherName
+    mode: CipherMode = CipherMode.encrypt
+    text: str = Field(..., max_length=settings.LAB_MAX_TEXT_CHARS)
+    key: Optional[str] = Field(None, max_length=256)
+    shift: Optional[int] = None
+    a: Optional[int] = None
+    b: Optional[int] = None
+
+
+class CipherResult(BaseModel):
+    cipher: CipherName
+    mode: CipherMode
+    result: str
+
+
+class AnalysisRequest(BaseModel):
+    text: str = Field(..., max_length=settings.LAB_MAX_TEXT_CHARS)
+    max_key_length: int = Field(20, ge=1, le=settings.LAB_MAX_KEY_LENGTH)
+    language: Language = Language.en
+
+
+class AnalysisReport(BaseModel):
+    total_bytes: int
+    total_letters: int
+    # Letras (desde el inicio) usadas para longitud de clave y Kasiski
+    sample_letters: int
+    # Porcentaje de cada letra A-Z sobre todo el texto
+    frequencies: Dict[str, float]
+    index_of_coincidence: float
+    language_ioc: float
+    random_ioc: float
+    # IoC medio de las columnas para cada longitud de clave candidata
+    key_length_ioc: Dict[int, float]
+    # Distancias entre trigramas repetidos que son múltiplo de cada longitud
+    kasiski_factors: Dict[int, int]
+    estimated_key_length: int
+
+
+class CrackRequest(AnalysisRequest):
+    cipher: CipherName = CipherName.vigenere
+    # Solo Vigenère: fija la longitud de clave en lugar de estimarla
+    key_length: Optional[int] = Field(None, ge=1, le=settings.LAB_MAX_KEY_LENGTH)
+
+
+class CrackResult(BaseModel):
+    cipher: CipherName
+    key: Optional[str] = None
+    key_length: Optional[int] = None
+    shift: Optional[int] = None
+    a: Optional[int] = None
+    b: Optional[int] = None
+    # Menor es mejor: distancia de las frecuencias descifradas a las del idioma
+    chi_squared: float
+    # Inicio del texto descifrado con los parámetros recuperados
+    preview: str
+    # Texto completo descifrado (solo en la petición JSON, no en la subida en streaming)
+    plaintext: Optional[str] = None
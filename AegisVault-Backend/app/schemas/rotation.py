@@ -0,0 +1,26 @@
+# AegisVault-Backend/app/schemas/rotation.py
+import uuid
+from datetime import datetime
+from typing import Optional
+from pydantic import BaseModel
+
+class RotationJobOut(BaseModel):
+    id: uuid.UUID
+    kind: str
+    target_id: uuid.UUID
+    status: str
+    stage: str
+    processed: int
+    total: int
+    from_generation: Optional[int] = None
+    to_generation: Optional[int] = None
+    error: Optional[str] = None
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    # Filas por segundo desde que empezó el trabajo (según el último lote confirmado)
+    rows_per_second: Optional[float] = None
+
+    class Config:
+        from_attributes = True
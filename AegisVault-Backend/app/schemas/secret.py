@@ -1,5 +1,6 @@
 import uuid
 from datetime import datetime
+from enum import Enum
 from typing import List, Optional
 from pydantic import BaseModel, Field
 
@@ -25,11 +26,37 @@ class SecretCreate(BaseModel):
     content: str
 
 
+class SecretImport(BaseModel):
+    """
+    Importación masiva (p.ej. migrar un .env u otra bóveda).
+    Todos los secretos se crean en una única transacción.
+    """
+    secrets: List[SecretCreate] = Field(..., min_length=1)
+
+
+class SecretScope(str, Enum):
+    """Filtro de listado: todos, solo propios o solo compartidos conmigo."""
+    all = "all"
+    owned = "owned"
+    shared = "shared"
+
+
+class SecretUpdate(BaseModel):
+    """
+    Esquema para actualizar un secreto.
+    Si se envía `content`, se rota el contenido creando una nueva versión.
+    """
+    name: str = Field(..., min_length=1, max_length=100)
+    description: Optional[str] = None
+    content: Optional[str] = None
+
+
 class SecretPublic(SecretBase):
     """Esquema para devolver los metadatos de un secreto."""
     id: uuid.UUID
     owner_id: uuid.UUID
     created_at: datetime
+    kind: str = "text"  # "text" | "binary" (binarios: GET /{id}/content)
 
     class Config:
         from_attributes = True
@@ -40,14 +67,69 @@ class SecretDetailPublic(SecretPublic):
     Esquema para devolver un secreto con su contenido descifrado.
     """
     content: str # El contenido descifrado del secreto
+    version: Optional[int] = None # Número de la versión devuelta
     shared_with: List[UserPublic] = []
 
 
+class SecretVersionPublic(BaseModel):
+    """Metadatos de una versión (sin el contenido cifrado)."""
+    version_number: int
+    created_at: datetime
+    size_bytes: Optional[int] = None
+
+
 class SecretShare(BaseModel):
     """Esquema para la petición de compartir un secreto."""
     username_to_share_with: str
 
 
+class SecretBulkShare(BaseModel):
+    """Petición para compartir varios secretos con varios usuarios (producto cartesiano)."""
+    secret_ids: List[uuid.UUID] = Field(..., min_length=1, max_length=100)
+    usernames: List[str] = Field(..., min_length=1, max_length=500)
+
+
+class SecretShareGrant(BaseModel):
+    """
+    Resultado de una concesión (secreto, usuario) dentro de un reparto masivo.
+    `status`: "created" | "exists" | "secret_not_found" | "user_not_found" | "error".
+    """
+    secret_id: uuid.UUID
+    username: str
+    status: str
+    detail: Optional[str] = None
+
+
+class SecretBulkShareResult(BaseModel):
+    """Informe del reparto masivo, en el orden secreto × usuario de la petición."""
+    created: int
+    items: List[SecretShareGrant]
+
+
+# --- Esquemas para Lectura por Lotes ---
+
+class SecretBatchRead(BaseModel):
+    """Petición para descifrar varios secretos en una sola llamada."""
+    secret_ids: List[uuid.UUID] = Field(..., min_length=1, max_length=500)
+
+
+class SecretBatchItem(BaseModel):
+    """
+    Resultado individual de una lectura por lotes.
+    Si `status` no es "ok", `content` viene vacío y `detail` explica el motivo.
+    """
+    id: uuid.UUID
+    status: str  # "ok" | "not_found" | "error"
+    name: Optional[str] = None
+    content: Optional[str] = None
+    detail: Optional[str] = None
+
+
+class SecretBatchResult(BaseModel):
+    """Respuesta de la lectura por lotes, en el mismo orden que la petición."""
+    items: List[SecretBatchItem]
+
+
 # --- Esquemas para Tokens JWT ---
 
 class Token(BaseModel):
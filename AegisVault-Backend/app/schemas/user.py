@@ -36,6 +36,12 @@ class UserPublic(UserBase):
         from_attributes = True
 
 
+class UnlockResponse(BaseModel):
+    """Respuesta al desbloquear la llave privada del usuario."""
+    unlock_token: str
+    expires_in: int  # Segundos de validez del token de desbloqueo
+
+
 # --- Esquemas para la Base de Datos ---
 
 class UserInDBBase(UserBase):
@@ -0,0 +1,221 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from fastapi import Request
+from sqlalchemy import event as sa_event, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, SessionTransaction
+
+from app.core.config import settings
+from app.db import models
+from app.db.session import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# Clave en `Session.info` de los eventos en espera del commit (modo "buffered")
+_PENDING = "audit_pending"
+
+
+def client_ip(request: Request) -> Optional[str]:
+    """
+    IP de origen de la petición para la columna `audit_logs.ip_address`.
+    Solo se confía en X-Forwarded-For si AUDIT_TRUST_FORWARDED_FOR está activo
+    (es decir, si la API está detrás de un proxy propio).
+    """
+    if settings.AUDIT_TRUST_FORWARDED_FOR:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else None
+
+
+class AuditWriter:
+    """
+    Canal de escritura de la auditoría.
+
+    - Modo "sync" (fail-closed): el evento se inserta en la misma transacción
+      que la operación auditada; si la auditoría falla, falla la operación.
+    - Modo "buffered": el evento queda asociado a la sesión y solo entra en la
+      cola acotada en memoria cuando esa sesión confirma (una operación que
+      termina en rollback no deja auditoría). Un worker lo vuelca a `audit_logs`
+      en INSERTs multi-fila cuando se alcanza AUDIT_BATCH_SIZE o pasa
+      AUDIT_FLUSH_INTERVAL. Saca la auditoría del camino crítico a cambio de
+      poder perder los eventos encolados si el proceso cae.
+    """
+
+    def __init__(self, mode: str, max_queue: int, batch_size: int, flush_interval: float):
+        if mode not in ("sync", "buffered"):
+            raise ValueError(f"Modo de auditoría desconocido: {mode}")
+        self.mode = mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=max_queue)
+        self._task: Optional[asyncio.Task] = None
+        # Lote en formación y volcado en curso: stop() los termina en lugar de perderlos
+        self._batch: List[Dict[str, Any]] = []
+        self._inflight: Optional[asyncio.Future] = None
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+
+    @staticmethod
+    def event(
+        user_id: uuid.UUID,
+        action: str,
+        resource_id: Optional[uuid.UUID] = None,
+        ip_address: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        # El id y la marca de tiempo se fijan al crear el evento, no al volcarlo
+        return {
+            "id": uuid.uuid4(),
+            "user_id": user_id,
+            "action": action,
+            "resource_id": resource_id,
+            "ip_address": ip_address,
+            "timestamp": datetime.now(timezone.utc),
+        }
+
+    # --- Registro ---
+
+    async def record(
+        self,
+        db: AsyncSession,
+        request: Request,
+        user_id: uuid.UUID,
+        action: str,
+        resource_id: Optional[uuid.UUID] = None,
+        *,
+        commit: bool = False,
+    ) -> None:
+        """
+        Registra un evento en la transacción de `db`. Con `commit=True` se
+        confirma en el acto (para rutas de solo lectura), en ambos modos.
+        """
+        await self.record_many(db, [self.event(user_id, action, resource_id, client_ip(request))], commit=commit)
+
+    async def record_many(self, db: AsyncSession, events: Iterable[Dict[str, Any]], *, commit: bool = False) -> None:
+        events = list(events)
+        if not events:
+            return
+        if self.mode == "sync":
+            if len(events) == 1:
+                db.add(models.AuditLog(**events[0]))
+            else:
+                await db.execute(insert(models.AuditLog), events)
+            if commit:
+                await db.commit()
+            return
+        # Cola acotada: si está llena, la petición espera (back-pressure)
+        while self._queue.full():
+            await asyncio.sleep(0.01)
+        if not db.in_transaction():
+            # Nada que confirmar: el evento no depende de ninguna transacción
+            self._enqueue(events)
+            return
+        db.sync_session.info.setdefault(_PENDING, []).extend(events)
+        if commit:
+            await db.commit()
+
+    def _enqueue(self, events: List[Dict[str, Any]]) -> None:
+        for event in events:
+            try:
+                self._queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self.dropped += 1
+                logger.error("Cola de auditoría llena: evento %s descartado", event["action"])
+
+    def _after_commit(self, session: Session) -> None:
+        events = session.info.pop(_PENDING, None)
+        if events:
+            self._enqueue(events)
+
+    def _after_transaction_end(self, session: Session, transaction: SessionTransaction) -> None:
+        # Rollback o cierre sin commit de la transacción raíz: sus eventos no ocurrieron
+        if transaction.parent is None:
+            session.info.pop(_PENDING, None)
+
+    # --- Volcado en segundo plano ---
+
+    def start(self) -> None:
+        if self.mode == "buffered" and self._task is None:
+            self._task = asyncio.create_task(self._flush_loop(), name="audit-writer")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # El volcado en curso sigue (protegido con shield): esperamos a que termine
+        if self._inflight is not None:
+            await asyncio.gather(self._inflight, return_exceptions=True)
+            self._inflight = None
+        # Vaciamos lo pendiente (lote a medio formar y cola) antes de apagar
+        pending, self._batch = self._batch, []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        for i in range(0, len(pending), self.batch_size):
+            await self._flush(pending[i:i + self.batch_size])
+
+    async def _flush_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch.append(await self._queue.get())
+            deadline = loop.time() + self.flush_interval
+            while len(self._batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    self._batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            batch, self._batch = self._batch, []
+            # Cancelar el bucle no interrumpe un INSERT a medias (ni lo duplica al reintentar)
+            self._inflight = asyncio.ensure_future(self._flush(batch))
+            await asyncio.shield(self._inflight)
+            self._inflight = None
+
+    async def _flush(self, batch: List[Dict[str, Any]], attempts: int = 3) -> None:
+        for attempt in range(1, attempts + 1):
+            try:
+                async with SessionLocal() as session:
+                    await session.execute(insert(models.AuditLog), batch)
+                    await session.commit()
+                self.written += len(batch)
+                self.batches += 1
+                return
+            except Exception:
+                logger.exception("Error volcando %d eventos de auditoría (intento %d)", len(batch), attempt)
+                await asyncio.sleep(0.5 * attempt)
+        self.dropped += len(batch)
+        logger.error("Se descartaron %d eventos de auditoría tras %d intentos", len(batch), attempts)
+
+    # --- Observabilidad ---
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+        }
+
+
+# --- Instancia Singleton ---
+audit_writer = AuditWriter(
+    mode=settings.AUDIT_MODE,
+    max_queue=settings.AUDIT_QUEUE_SIZE,
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    flush_interval=settings.AUDIT_FLUSH_INTERVAL,
+)
+# Los eventos "buffered" se encolan al confirmar la sesión que los registró
+sa_event.listen(Session, "after_commit", audit_writer._after_commit)
+sa_event.listen(Session, "after_transaction_end", audit_writer._after_transaction_end)
@@ -0,0 +1,256 @@
+import abc
+import asyncio
+import hashlib
+import io
+import mmap
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.services.metrics import timed
+
+
+class BlobNotFound(KeyError):
+    """La referencia no existe en el almacén."""
+
+
+class BlobStore(abc.ABC):
+    """
+    Almacén de payloads cifrados direccionado por contenido.
+
+    Las referencias tienen la forma "<backend>:<sha256 del contenido>", así que
+    escribir dos veces el mismo ciphertext no duplica datos y la referencia
+    permite verificar la integridad de lo leído.
+    """
+    name = "base"
+
+    def __init__(self):
+        self.puts = 0
+        self.gets = 0
+        self.bytes_written = 0
+
+    def ref_for(self, data: bytes) -> str:
+        return f"{self.name}:{hashlib.sha256(data).hexdigest()}"
+
+    def _digest(self, ref: str) -> str:
+        backend, _, digest = ref.partition(":")
+        if backend != self.name or len(digest) != 64:
+            raise BlobNotFound(ref)
+        return digest
+
+    async def put(self, data: bytes) -> str:
+        ref = self.ref_for(data)
+        with timed("blob.put"):
+            await asyncio.to_thread(self._put, self._digest(ref), data)
+        self.puts += 1
+        self.bytes_written += len(data)
+        return ref
+
+    async def get(self, ref: str) -> bytes:
+        digest = self._digest(ref)
+        with timed("blob.get"):
+            data = await asyncio.to_thread(self._get, digest)
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Blob corrupto: {ref}")
+        self.gets += 1
+        return data
+
+    async def delete(self, ref: str) -> None:
+        await asyncio.to_thread(self._delete, self._digest(ref))
+
+    # Implementación de cada backend (síncrona; se ejecuta en un hilo)
+
+    @abc.abstractmethod
+    def _put(self, digest: str, data: bytes) -> None:
+        ...
+
+    @abc.abstractmethod
+    def _get(self, digest: str) -> bytes:
+        ...
+
+    @abc.abstractmethod
+    def _delete(self, digest: str) -> None:
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "puts": self.puts, "gets": self.gets, "bytes_written": self.bytes_written}
+
+
+class InlineBlobStore(BlobStore):
+    """Sin almacén externo: todos los payloads permanecen en `secret_versions.encrypted_data`."""
+    name = "inline"
+
+    def _put(self, digest: str, data: bytes) -> None:
+        raise RuntimeError("El backend inline no almacena blobs externos")
+
+    def _get(self, digest: str) -> bytes:
+        raise BlobNotFound(digest)
+
+    def _delete(self, digest: str) -> None:
+        pass
+
+
+class FileSystemBlobStore(BlobStore):
+    """
+    Blobs en disco local bajo `root/ab/cd/<sha256>`.
+    La escritura es atómica (fichero temporal + rename) y la lectura usa mmap.
+    """
+    name = "fs"
+
+    def __init__(self, root: str):
+        super().__init__()
+        self.root = root
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def _put(self, digest: str, data: bytes) -> None:
+        path = self._path(digest)
+        if os.path.exists(path):
+            return  # Mismo contenido, misma referencia
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _get(self, digest: str) -> bytes:
+        try:
+            with open(self._path(digest), "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return b""
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    return view[:]
+        except FileNotFoundError:
+            raise BlobNotFound(digest)
+
+    def _delete(self, digest: str) -> None:
+        try:
+            os.remove(self._path(digest))
+        except FileNotFoundError:
+            pass
+
+
+class InMemoryS3Client:
+    """
+    Sustituto local del cliente S3 (misma firma que boto3 para los métodos usados).
+    Permite probar el backend S3 sin red ni credenciales.
+    """
+
+    def __init__(self):
+        self._objects: Dict[tuple, bytes] = {}
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            self._objects[(Bucket, Key)] = bytes(Body)
+        return {}
+
+    def get_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            if (Bucket, Key) not in self._objects:
+                raise KeyError(Key)
+            return {"Body": io.BytesIO(self._objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            self._objects.pop((Bucket, Key), None)
+        return {}
+
+
+class S3BlobStore(BlobStore):
+    """Blobs en un bucket compatible con S3 (AWS, MinIO, Ceph...)."""
+    name = "s3"
+
+    def __init__(self, client: Any, bucket: str, prefix: str = ""):
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _key(self, digest: str) -> str:
+        return f"{self.prefix}{digest[:2]}/{digest}"
+
+    def _put(self, digest: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self._key(digest), Body=data)
+
+    def _get(self, digest: str) -> bytes:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self._key(digest))["Body"].read()
+        except Exception as e:
+            raise BlobNotFound(digest) from e
+
+    def _delete(self, digest: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(digest))
+
+
+def build_blob_store(backend: str) -> BlobStore:
+    """Crea el almacén configurado en BLOB_STORE ("inline", "fs" o "s3")."""
+    if backend == "inline":
+        return InlineBlobStore()
+    if backend == "fs":
+        return FileSystemBlobStore(settings.BLOB_FS_ROOT)
+    if backend == "s3":
+        if settings.BLOB_S3_ENDPOINT_URL == "memory":
+            client = InMemoryS3Client()
+        else:
+            # Dependencia opcional: solo se necesita con un S3 real
+            import boto3
+            client = boto3.client("s3", endpoint_url=settings.BLOB_S3_ENDPOINT_URL or None)
+        return S3BlobStore(client, settings.BLOB_S3_BUCKET, settings.BLOB_S3_PREFIX)
+    raise ValueError(f"Almacén de blobs desconocido: {backend}")
+
+
+# --- Instancia Singleton ---
+blob_store = build_blob_store(settings.BLOB_STORE)
+
+# Almacenes por nombre de backend: las referencias guardadas con otro BLOB_STORE
+# (antes de migrar de "fs" a "s3", por ejemplo) se siguen resolviendo con el suyo
+_stores_by_name: Dict[str, BlobStore] = {blob_store.name: blob_store}
+_stores_lock = threading.Lock()
+
+
+def store_for_ref(ref: str) -> BlobStore:
+    """Almacén indicado por el prefijo de `ref`, no necesariamente el configurado ahora."""
+    backend = ref.partition(":")[0]
+    with _stores_lock:
+        store = _stores_by_name.get(backend)
+        if store is None:
+            try:
+                store = build_blob_store(backend)
+            except ValueError:
+                raise BlobNotFound(ref)
+            _stores_by_name[backend] = store
+    return store
+
+
+async def offload_payload(version: Any, store: Optional[BlobStore] = None) -> None:
+    """
+    Mueve el ciphertext de una SecretVersion recién creada al almacén de blobs
+    si supera BLOB_INLINE_THRESHOLD; la fila conserva solo `blob_ref` y `size_bytes`.
+    """
+    store = store or blob_store
+    data = version.encrypted_data
+    version.size_bytes = len(data)
+    if store.name == "inline" or len(data) < settings.BLOB_INLINE_THRESHOLD:
+        return
+    version.blob_ref = await store.put(data)
+    version.encrypted_data = None
+
+
+async def load_payload(encrypted_data: Optional[bytes], blob_ref: Optional[str], store: Optional[BlobStore] = None) -> bytes:
+    """Devuelve el ciphertext de una versión, esté inline o en el almacén de blobs."""
+    if blob_ref is None:
+        return encrypted_data
+    return await (store or store_for_ref(blob_ref)).get(blob_ref)
+
+
+async def discard_payload(blob_ref: str) -> None:
+    """
+    Borra un blob que ya no referencia ninguna versión. Las referencias son por
+    contenido: el llamador debe comprobar antes que ninguna otra fila la use.
+    """
+    await store_for_ref(blob_ref).delete(blob_ref)
@@ -0,0 +1,283 @@
+import asyncio
+import logging
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db import models
+from app.db.session import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+CHANGE_CREATED = "created"
+CHANGE_UPDATED = "updated"
+CHANGE_VERSION = "version"
+CHANGE_SHARED = "shared"
+CHANGE_DELETED = "deleted"
+
+# Canal de LISTEN/NOTIFY; el payload son los ids de usuario afectados separados por comas
+CHANNEL = "aegisvault_changes"
+# Los payloads de NOTIFY están limitados a 8000 bytes: ~200 UUIDs por notificación
+_NOTIFY_IDS_PER_PAYLOAD = 200
+_PRUNE_INTERVAL_SECONDS = 3600
+
+
+def change(user_id: uuid.UUID, secret_id: uuid.UUID, kind: str, version_number: Optional[int] = None) -> Dict[str, Any]:
+    return {"user_id": user_id, "secret_id": secret_id, "kind": kind, "version_number": version_number}
+
+
+async def audience(db: AsyncSession, secret_ids: Iterable[uuid.UUID]) -> Dict[uuid.UUID, List[uuid.UUID]]:
+    """Usuarios con acceso (cualquier generación) a cada secreto: a quién afecta un cambio."""
+    secret_ids = list(secret_ids)
+    if not secret_ids:
+        return {}
+    result = await db.execute(
+        select(models.SecretKey.secret_id, models.SecretKey.user_id)
+        .where(models.SecretKey.secret_id.in_(secret_ids))
+        .distinct()
+    )
+    users: Dict[uuid.UUID, List[uuid.UUID]] = {secret_id: [] for secret_id in secret_ids}
+    for secret_id, user_id in result.all():
+        users[secret_id].append(user_id)
+    return users
+
+
+async def record_changes(db: AsyncSession, changes: List[Dict[str, Any]]) -> None:
+    """
+    Añade `changes` (ver `change`) al feed dentro de la transacción en curso.
+
+    Cada usuario tiene su propia secuencia: se reservan los números con un UPDATE
+    del contador, cuyo bloqueo se mantiene hasta el commit, así que los cambios de
+    un usuario se confirman en orden y sin huecos (un lector nunca ve el n+1 sin el n).
+    Conviene llamarlo justo antes del commit para retener ese bloqueo lo mínimo.
+    En Postgres se encola además un NOTIFY, que solo se entrega si la transacción confirma.
+    """
+    if not changes:
+        return
+    per_user = Counter(item["user_id"] for item in changes)
+    user_ids = sorted(per_user)
+    if len(user_ids) > 1:
+        # Bloqueo en orden de id: dos transacciones con varios usuarios no se interbloquean
+        await db.execute(
+            select(models.UserChangeSequence.user_id)
+            .where(models.UserChangeSequence.user_id.in_(user_ids))
+            .order_by(models.UserChangeSequence.user_id)
+            .with_for_update()
+        )
+    result = await db.execute(
+        update(models.UserChangeSequence)
+        .where(models.UserChangeSequence.user_id.in_(user_ids))
+        .values(last_seq=models.UserChangeSequence.last_seq + case(per_user, value=models.UserChangeSequence.user_id))
+        .returning(models.UserChangeSequence.user_id, models.UserChangeSequence.last_seq)
+        .execution_options(synchronize_session=False)
+    )
+    last_seq = dict(result.all())
+    missing = [user_id for user_id in user_ids if user_id not in last_seq]
+    if missing:
+        # Usuarios sin contador (creados fuera de /register): empiezan en 0
+        await db.execute(insert(models.UserChangeSequence), [
+            {"user_id": user_id, "last_seq": per_user[user_id]} for user_id in missing
+        ])
+        last_seq.update((user_id, per_user[user_id]) for user_id in missing)
+
+    # Numeración consecutiva terminando en el último número reservado
+    next_seq = {user_id: last_seq[user_id] - per_user[user_id] + 1 for user_id in user_ids}
+    now = datetime.now(timezone.utc)
+    rows = []
+    for item in changes:
+        seq = next_seq[item["user_id"]]
+        next_seq[item["user_id"]] = seq + 1
+        rows.append({**item, "seq": seq, "created_at": now})
+    await db.execute(insert(models.SecretChange), rows)
+
+    if db.bind.dialect.name == "postgresql":
+        for start in range(0, len(user_ids), _NOTIFY_IDS_PER_PAYLOAD):
+            payload = ",".join(str(user_id) for user_id in user_ids[start:start + _NOTIFY_IDS_PER_PAYLOAD])
+            await db.execute(select(func.pg_notify(CHANNEL, payload)))
+
+
+async def record_for_audience(db: AsyncSession, secret_id: uuid.UUID, kind: str, version_number: Optional[int] = None) -> None:
+    """Registra `kind` sobre `secret_id` para todos los usuarios con acceso al secreto."""
+    users = (await audience(db, [secret_id]))[secret_id]
+    await record_changes(db, [change(user_id, secret_id, kind, version_number) for user_id in users])
+
+
+class ChangeFeed:
+    """
+    Despierta a los clientes en espera (long-poll y SSE de /api/changes) cuando hay
+    cambios para su usuario.
+
+    - En Postgres mantiene una conexión dedicada con LISTEN sobre `CHANNEL`: los
+      NOTIFY llegan desde cualquier worker o réplica al confirmarse la transacción.
+      Si la conexión cae, reintenta y mientras tanto las esperas sondean.
+    - Sin Postgres (o sin LISTEN activo) las esperas se resuelven sondeando cada
+      `poll_interval` segundos: el cliente vuelve a consultar la base de datos.
+    - Purga cada hora los cambios más antiguos que `retention_days`.
+    - Otros servicios pueden escuchar sus propios canales en la misma conexión
+      (`subscribe`), p. ej. para invalidar cachés locales en todos los workers.
+    """
+
+    def __init__(self, poll_interval: float, retention_days: int):
+        self.poll_interval = poll_interval
+        self.retention_days = retention_days
+        self._waiters: Dict[uuid.UUID, Set[asyncio.Event]] = {}
+        self._listener: Optional[asyncio.Task] = None
+        self._pruner: Optional[asyncio.Task] = None
+        self._listening = False
+        # canal -> (manejador del payload, resincronización tras (re)conectar)
+        self._subscriptions: Dict[str, Tuple[Callable[[str], None], Optional[Callable[[], None]]]] = {}
+        # Métricas
+        self.notifications = 0
+        self.wakeups = 0
+        self.reconnects = 0
+        self.pruned = 0
+
+    @property
+    def listening(self) -> bool:
+        """True mientras hay un LISTEN activo: las notificaciones de otros workers llegan."""
+        return self._listening
+
+    def subscribe(self, channel: str, handler: Callable[[str], None], resync: Optional[Callable[[], None]] = None) -> None:
+        """
+        Escucha también `channel` en la conexión de LISTEN (llamar antes de `start`).
+        `resync` se invoca al (re)conectar: durante la caída pudo perderse algún aviso.
+        """
+        self._subscriptions[channel] = (handler, resync)
+
+    # --- Ciclo de vida ---
+
+    def start(self) -> None:
+        if self._listener is None and make_url(settings.DATABASE_URL).get_backend_name() == "postgresql":
+            self._listener = asyncio.create_task(self._listen(), name="change-feed-listen")
+        if self._pruner is None and self.retention_days > 0:
+            self._pruner = asyncio.create_task(self._prune_loop(), name="change-feed-prune")
+
+    async def stop(self) -> None:
+        tasks = [task for task in (self._listener, self._pruner) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._listener = self._pruner = None
+        self._listening = False
+        # Los clientes en espera responden ya con lo que haya
+        self._wake_all()
+
+    async def _listen(self) -> None:
+        import asyncpg
+
+        url = make_url(settings.DATABASE_URL).set(drivername="postgresql")
+        dsn = url.render_as_string(hide_password=False)
+        delay = 1.0
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                await connection.add_listener(CHANNEL, self._on_notify)
+                for channel, (handler, _) in self._subscriptions.items():
+                    await connection.add_listener(channel, self._dispatch(handler))
+                self._listening = True
+                delay = 1.0
+                # Durante la caída pudo perderse algún NOTIFY: despertar a todos para que relean
+                self._wake_all()
+                for _, resync in self._subscriptions.values():
+                    if resync is not None:
+                        resync()
+                while not connection.is_closed():
+                    await asyncio.sleep(self.poll_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.warning("LISTEN %s no disponible; reintento en %.0fs", CHANNEL, delay, exc_info=True)
+            finally:
+                self._listening = False
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    @staticmethod
+    def _dispatch(handler: Callable[[str], None]) -> Callable[[Any, int, str, str], None]:
+        def listener(connection: Any, pid: int, channel: str, payload: str) -> None:
+            try:
+                handler(payload)
+            except Exception:
+                logger.exception("Error procesando un aviso de %s", channel)
+        return listener
+
+    def _on_notify(self, connection: Any, pid: int, channel: str, payload: str) -> None:
+        self.notifications += 1
+        for raw in payload.split(","):
+            try:
+                user_id = uuid.UUID(raw)
+            except ValueError:
+                continue
+            for event in self._waiters.get(user_id, ()):
+                event.set()
+                self.wakeups += 1
+
+    def _wake_all(self) -> None:
+        for events in self._waiters.values():
+            for event in events:
+                event.set()
+
+    async def _prune_loop(self) -> None:
+        while True:
+            cutoff = datetime.now(timezone.utc) - timedelta(days=self.retention_days)
+            try:
+                async with SessionLocal() as session:
+                    result = await session.execute(delete(models.SecretChange).where(models.SecretChange.created_at < cutoff))
+                    await session.commit()
+                self.pruned += result.rowcount or 0
+            except Exception:
+                logger.exception("No se pudo purgar el feed de cambios")
+            await asyncio.sleep(_PRUNE_INTERVAL_SECONDS)
+
+    # --- Espera ---
+
+    async def wait(self, user_id: uuid.UUID, timeout: float) -> bool:
+        """
+        Espera hasta `timeout` segundos a un cambio de `user_id`. Devuelve False si
+        venció el plazo. Sin LISTEN activo vuelve tras `poll_interval` (True): el
+        llamador debe comprobar siempre la base de datos, nunca fiarse del aviso.
+        """
+        if timeout <= 0:
+            return False
+        event = asyncio.Event()
+        self._waiters.setdefault(user_id, set()).add(event)
+        try:
+            limit = timeout if self._listening else min(timeout, self.poll_interval)
+            try:
+                await asyncio.wait_for(event.wait(), limit)
+                return True
+            except asyncio.TimeoutError:
+                return limit < timeout
+        finally:
+            events = self._waiters.get(user_id)
+            if events is not None:
+                events.discard(event)
+                if not events:
+                    del self._waiters[user_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "listening": int(self._listening),
+            "waiters": sum(len(events) for events in self._waiters.values()),
+            "notifications": self.notifications,
+            "wakeups": self.wakeups,
+            "reconnects": self.reconnects,
+            "pruned": self.pruned,
+        }
+
+
+# --- Instancia Singleton ---
+change_feed = ChangeFeed(
+    poll_interval=settings.CHANGE_FEED_POLL_INTERVAL,
+    retention_days=settings.CHANGE_FEED_RETENTION_DAYS,
+)
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import tempfile
+import uuid
+from typing import AsyncIterator, List
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db import models
+from app.services.crypto_engine import crypto_engine
+
+logger = logging.getLogger(__name__)
+
+
+class PayloadTooLarge(ValueError):
+    """El contenido subido supera SECRET_BINARY_MAX_BYTES."""
+
+
+class SpooledChunks:
+    """
+    Bloques ya cifrados de una subida, a la espera de insertarse. Viven en un
+    fichero temporal que pasa de memoria a disco a partir de
+    SECRET_UPLOAD_SPOOL_MEMORY; en disco solo hay ciphertext.
+    """
+
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=settings.SECRET_UPLOAD_SPOOL_MEMORY)
+        self.chunk_count = 0
+        self.size = 0
+
+    def append(self, data: bytes) -> None:
+        self.file.write(len(data).to_bytes(4, "big"))
+        self.file.write(data)
+        self.chunk_count += 1
+
+    def rewind(self) -> None:
+        self.file.seek(0)
+
+    def read_batch(self, limit: int) -> List[bytes]:
+        batch = []
+        while len(batch) < limit:
+            header = self.file.read(4)
+            if not header:
+                break
+            batch.append(self.file.read(int.from_bytes(header, "big")))
+        return batch
+
+    def close(self) -> None:
+        self.file.close()
+
+
+async def spool_chunks(
+    version_id: uuid.UUID,
+    aes_key: bytes,
+    base_nonce: bytes,
+    stream: AsyncIterator[bytes],
+) -> SpooledChunks:
+    """
+    Cifra `stream` en bloques de SECRET_CHUNK_SIZE a medida que llega y los deja
+    en un SpooledChunks. No toca la base de datos: la transacción que los inserta
+    (`write_chunks`) se abre cuando el cuerpo ya se ha recibido entero.
+    """
+    chunk_size = settings.SECRET_CHUNK_SIZE
+    context = version_id.bytes
+    spool = SpooledChunks()
+    buffer = bytearray()
+
+    def emit(data: bytes, final: bool) -> None:
+        spool.append(crypto_engine.encrypt_chunk(aes_key, base_nonce, spool.chunk_count, data, final, context))
+
+    try:
+        async for piece in stream:
+            spool.size += len(piece)
+            if spool.size > settings.SECRET_BINARY_MAX_BYTES:
+                raise PayloadTooLarge(f"El contenido supera {settings.SECRET_BINARY_MAX_BYTES} bytes")
+            buffer += piece
+            # Solo se emite un bloque cuando sabemos que no es el último
+            while len(buffer) > chunk_size:
+                emit(bytes(buffer[:chunk_size]), final=False)
+                del buffer[:chunk_size]
+
+        # El último bloque (posiblemente vacío) lleva la marca final en el AAD
+        emit(bytes(buffer), final=True)
+    except BaseException:
+        spool.close()
+        raise
+    return spool
+
+
+async def write_chunks(db: AsyncSession, version_id: uuid.UUID, spool: SpooledChunks) -> None:
+    """
+    Inserta los bloques de `spool` en `secret_chunks` en lotes de
+    SECRET_CHUNK_INSERT_BATCH, dentro de la transacción de `db`.
+    La memoria usada es de un lote, independientemente del tamaño total.
+    """
+    spool.rewind()
+    index = 0
+    while True:
+        # Tras pasar a disco la lectura es E/S: se hace fuera del event loop
+        batch = await asyncio.to_thread(spool.read_batch, settings.SECRET_CHUNK_INSERT_BATCH)
+        if not batch:
+            break
+        await db.execute(insert(models.SecretChunk), [
+            {"version_id": version_id, "chunk_index": index + offset, "data": data}
+            for offset, data in enumerate(batch)
+        ])
+        index += len(batch)
+    if index != spool.chunk_count:
+        raise ValueError(f"Subida incompleta en la versión {version_id}: {index}/{spool.chunk_count} bloques")
+
+
+async def read_chunks(
+    session: AsyncSession,
+    version_id: uuid.UUID,
+    aes_key: bytes,
+    base_nonce: bytes,
+    chunk_count: int,
+) -> AsyncIterator[bytes]:
+    """
+    Lee los bloques de una versión con un cursor del servidor y los va descifrando.
+    Un bloque alterado, reordenado o ausente (incluido un truncado) lanza ValueError.
+    """
+    context = version_id.bytes
+    query = select(models.SecretChunk.chunk_index, models.SecretChunk.data).where(
+        models.SecretChunk.version_id == version_id
+    ).order_by(models.SecretChunk.chunk_index).execution_options(yield_per=settings.SECRET_CHUNK_INSERT_BATCH)
+
+    expected = 0
+    result = await session.stream(query)
+    async for row in result:
+        if row.chunk_index != expected or expected >= chunk_count:
+            raise ValueError(f"Bloque inesperado {row.chunk_index} en la versión {version_id}")
+        final = expected == chunk_count - 1
+        try:
+            yield crypto_engine.decrypt_chunk(aes_key, base_nonce, expected, row.data, final, context)
+        except Exception as e:
+            raise ValueError(f"Bloque {expected} corrupto en la versión {version_id}") from e
+        expected += 1
+    if expected != chunk_count:
+        raise ValueError(f"Versión {version_id} truncada: {expected}/{chunk_count} bloques")
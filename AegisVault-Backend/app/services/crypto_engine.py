@@ -1,33 +1,58 @@
 import os
 import base64
-from typing import Tuple, Dict
+import struct
+from typing import Tuple, Dict, Optional, Union
 
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey, RSAPublicKey
 from cryptography.hazmat.primitives import serialization, hashes
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
-from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
-from passlib.context import CryptContext
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.keywrap import aes_key_unwrap, aes_key_wrap
+from app.services import kdf
+from app.services.crypto_executor import crypto_executor
+from app.services.metrics import timed_methods
+from app.services.password_hasher import password_hasher
 
+# Algoritmos con los que puede estar envuelta la llave AES de un SecretKey
+WRAP_RSA_OAEP = "rsa-oaep"  # Llave pública del usuario (necesario para compartir entre usuarios)
+WRAP_AES_KW = "aes-kw"      # KEK simétrica del propio usuario (RFC 3394), sin operación RSA al leer
+
+# Sesiones de desbloqueo selladas: versión del formato y contexto de la derivación
+_UNLOCK_SEAL_VERSION = b"\x01"
+_UNLOCK_SEAL_INFO = b"aegisvault-unlock-session-v1"
+
+
+@timed_methods
 class CryptoEngine:
     """
     Clase que encapsula toda la lógica criptográfica de AegisVault.
     Provee una interfaz unificada para hashing, cifrado simétrico/asimétrico
-    y el esquema de cifrado híbrido.
+    y el esquema de cifrado híbrido. Cada método público síncrono se cronometra
+    (histograma por operación y desglose Server-Timing de la petición).
     """
 
     def __init__(self):
-        # 1. Contexto de Passlib para hashing de contraseñas de usuario.
-        self.pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        # 1. Servicio compartido de hashing de contraseñas (argon2id/bcrypt configurables).
+        self.password_hasher = password_hasher
 
     # --- Hashing de Contraseñas ---
 
     def verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        """Verifica una contraseña plana contra su hash bcrypt."""
-        return self.pwd_context.verify(plain_password, hashed_password)
+        """Verifica una contraseña plana contra su hash (cualquier esquema aceptado)."""
+        return self.password_hasher.verify(plain_password, hashed_password)
 
     def get_password_hash(self, password: str) -> str:
-        """Genera el hash bcrypt para una contraseña."""
-        return self.pwd_context.hash(password)
+        """Genera el hash de una contraseña con el esquema y parámetros actuales."""
+        return self.password_hasher.hash(password)
+
+    def verify_and_update_password(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """Verifica y, si el hash usa parámetros obsoletos, devuelve uno nuevo."""
+        return self.password_hasher.verify_and_update(plain_password, hashed_password)
+
+    def dummy_verify_password(self, plain_password: str) -> bool:
+        """Verificación de coste constante para usuarios inexistentes. Siempre False."""
+        return self.password_hasher.dummy_verify(plain_password)
 
     # --- Gestión de Claves RSA ---
 
@@ -59,53 +84,66 @@ class CryptoEngine:
     def encrypt_rsa_private_key(self, private_key_pem: bytes, user_password: str) -> str:
         """
         Cifra la clave privada del usuario usando una clave derivada de su contraseña.
-        Utiliza Scrypt como KDF y AES-GCM para el cifrado.
+        Utiliza el KDF configurado (scrypt o argon2id) y AES-GCM para el cifrado.
 
         Returns:
-            str: Una cadena codificada que contiene todos los componentes necesarios
-                 para el descifrado (salt, nonce, tag, ciphertext).
+            str: Bundle versionado "v2:kdf:params:salt:nonce:tag:ciphertext" con todo lo
+                 necesario para el descifrado, incluidos los parámetros del KDF.
         """
+        kdf_name, params = kdf.default_kdf()
         salt = os.urandom(16)
-        kdf = Scrypt(salt=salt, length=32, n=2**14, r=8, p=1)
-        key = kdf.derive(user_password.encode())
+        key = kdf.derive_key(kdf_name, params, user_password.encode(), salt)
         
         aesgcm = AESGCM(key)
         nonce = os.urandom(12)
-        ciphertext_with_tag = aesgcm.encrypt(nonce, private_key_pem, None)
+        # La cabecera (versión, KDF, parámetros) va autenticada como AAD
+        ciphertext_with_tag = aesgcm.encrypt(nonce, private_key_pem, kdf.bundle_header(kdf_name, params).encode())
         
         # Separar el tag del ciphertext (los últimos 16 bytes)
         ciphertext = ciphertext_with_tag[:-16]
         tag = ciphertext_with_tag[-16:]
 
-        # Codificar todo en base64 y unirlo para fácil almacenamiento
-        return (f"{base64.b64encode(salt).decode('utf-8')}:"
-                f"{base64.b64encode(nonce).decode('utf-8')}:"
-                f"{base64.b64encode(tag).decode('utf-8')}:"
-                f"{base64.b64encode(ciphertext).decode('utf-8')}")
+        return kdf.format_bundle(kdf_name, params, salt, nonce, tag, ciphertext)
 
     def decrypt_rsa_private_key(self, encrypted_bundle: str, user_password: str) -> bytes:
-        """Descifra la clave privada del usuario usando su contraseña."""
+        """Descifra la clave privada del usuario usando su contraseña (bundle v2 o heredado)."""
         try:
-            salt_b64, nonce_b64, tag_b64, ciphertext_b64 = encrypted_bundle.split(':')
-            
-            salt = base64.b64decode(salt_b64)
-            nonce = base64.b64decode(nonce_b64)
-            tag = base64.b64decode(tag_b64)
-            ciphertext = base64.b64decode(ciphertext_b64)
-            
-            kdf = Scrypt(salt=salt, length=32, n=2**14, r=8, p=1)
-            key = kdf.derive(user_password.encode())
+            bundle = kdf.parse_bundle(encrypted_bundle)
+            key = kdf.derive_key(bundle.kdf, bundle.params, user_password.encode(), bundle.salt)
             
             aesgcm = AESGCM(key)
             
             # Unir ciphertext y tag para el descifrado
-            ciphertext_with_tag = ciphertext + tag
+            ciphertext_with_tag = bundle.ciphertext + bundle.tag
 
-            return aesgcm.decrypt(nonce, ciphertext_with_tag, None)
+            return aesgcm.decrypt(bundle.nonce, ciphertext_with_tag, bundle.aad or None)
         except Exception as e:
-            # Captura errores de padding, autenticación (tag inválido), etc.
+            # Captura errores de formato, autenticación (tag inválido), etc.
             raise ValueError("No se pudo descifrar la clave privada. Contraseña incorrecta o datos corruptos.") from e
 
+    def decrypt_and_rewrap_rsa_private_key(self, encrypted_bundle: str, user_password: str) -> Tuple[bytes, Optional[str]]:
+        """
+        Descifra la clave privada y, si el bundle usa un KDF o parámetros distintos
+        a los configurados, la vuelve a envolver. Devuelve (pem, bundle nuevo o None).
+        """
+        private_key_pem = self.decrypt_rsa_private_key(encrypted_bundle, user_password)
+        if kdf.bundle_is_current(encrypted_bundle):
+            return private_key_pem, None
+        return private_key_pem, self.encrypt_rsa_private_key(private_key_pem, user_password)
+
+    def load_rsa_private_key(self, encrypted_bundle: str, user_password: str) -> RSAPrivateKey:
+        """
+        Descifra la clave privada del usuario y la devuelve ya cargada como objeto.
+        Pensado para cachearla en una sesión de desbloqueo y evitar repetir
+        Scrypt y el parseo PKCS8 en cada operación.
+        """
+        private_key_pem = self.decrypt_rsa_private_key(encrypted_bundle, user_password)
+        return self.load_private_key_pem(private_key_pem)
+
+    def load_private_key_pem(self, private_key_pem: bytes) -> RSAPrivateKey:
+        """Carga un PEM PKCS8 ya descifrado como objeto `RSAPrivateKey`."""
+        return serialization.load_pem_private_key(private_key_pem, password=None)
+
     # --- Cifrado de Datos (Secretos) ---
 
     def generate_aes_key(self) -> bytes:
@@ -130,14 +168,93 @@ class CryptoEngine:
         ciphertext_with_tag = encrypted_parts["ciphertext"] + encrypted_parts["tag"]
         return aesgcm.decrypt(encrypted_parts["nonce"], ciphertext_with_tag, None)
 
+    # --- Cifrado por Bloques (Secretos Binarios) ---
+
+    def generate_base_nonce(self) -> bytes:
+        """Nonce base (96 bits) de una versión binaria; cada bloque deriva el suyo de él."""
+        return os.urandom(12)
+
+    @staticmethod
+    def _chunk_nonce(base_nonce: bytes, index: int) -> bytes:
+        # nonce_i = nonce_base XOR i: único por bloque mientras la llave y la base no se repitan
+        return (int.from_bytes(base_nonce, "big") ^ index).to_bytes(12, "big")
+
+    @staticmethod
+    def _chunk_aad(context: bytes, index: int, final: bool) -> bytes:
+        # El AAD ata cada bloque a su versión, su posición y a si es el último:
+        # reordenar, mezclar versiones o truncar el flujo hace fallar la verificación.
+        return context + struct.pack(">QB", index, 1 if final else 0)
+
+    def encrypt_chunk(self, key: bytes, base_nonce: bytes, index: int, data: bytes, final: bool, context: bytes) -> bytes:
+        """Cifra un bloque con AES-256-GCM; devuelve ciphertext || tag."""
+        return AESGCM(key).encrypt(self._chunk_nonce(base_nonce, index), data, self._chunk_aad(context, index, final))
+
+    def decrypt_chunk(self, key: bytes, base_nonce: bytes, index: int, blob: bytes, final: bool, context: bytes) -> bytes:
+        """Descifra y autentica un bloque producido por `encrypt_chunk`."""
+        return AESGCM(key).decrypt(self._chunk_nonce(base_nonce, index), blob, self._chunk_aad(context, index, final))
+
+    # --- KEK Simétrica por Usuario ---
+
+    def generate_kek(self) -> bytes:
+        """Genera la llave de cifrado de llaves (KEK) AES-256 de un usuario."""
+        return AESGCM.generate_key(bit_length=256)
+
+    def wrap_key_kw(self, kek: bytes, aes_key: bytes) -> bytes:
+        """Envuelve una llave AES con la KEK del usuario (AES Key Wrap, con integridad)."""
+        return aes_key_wrap(kek, aes_key)
+
+    def unwrap_key_kw(self, kek: bytes, wrapped_key: bytes) -> bytes:
+        """Desenvuelve una llave producida por `wrap_key_kw`; lanza InvalidUnwrap si no cuadra."""
+        return aes_key_unwrap(kek, wrapped_key)
+
+    # --- Sesiones de Desbloqueo Selladas ---
+
+    def _unlock_seal_key(self, token: str) -> bytes:
+        # El token tiene 256 bits de entropía: basta HKDF (sin sal) para derivar la llave
+        return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=_UNLOCK_SEAL_INFO).derive(token.encode())
+
+    def seal_unlocked_keys(self, token: str, user_id: bytes, private_key: RSAPrivateKey, kek: Optional[bytes]) -> bytes:
+        """
+        Cifra la llave privada (DER PKCS#8) y la KEK con una llave derivada del token
+        de desbloqueo. Formato: versión (1) | nonce (12) | AES-GCM(len(kek) | kek | DER),
+        con la versión y el id del usuario como AAD.
+        """
+        kek = kek or b""
+        der = private_key.private_bytes(
+            encoding=serialization.Encoding.DER,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        )
+        nonce = os.urandom(12)
+        sealed = AESGCM(self._unlock_seal_key(token)).encrypt(
+            nonce, bytes([len(kek)]) + kek + der, _UNLOCK_SEAL_VERSION + user_id
+        )
+        return _UNLOCK_SEAL_VERSION + nonce + sealed
+
+    def unseal_unlocked_keys(self, token: str, user_id: bytes, blob: bytes) -> Tuple[RSAPrivateKey, Optional[bytes]]:
+        """Inverso de `seal_unlocked_keys`; lanza ValueError o InvalidTag si el token o el usuario no cuadran."""
+        if blob[:1] != _UNLOCK_SEAL_VERSION:
+            raise ValueError("Formato de sesión de desbloqueo desconocido")
+        plaintext = AESGCM(self._unlock_seal_key(token)).decrypt(blob[1:13], blob[13:], _UNLOCK_SEAL_VERSION + user_id)
+        kek_len = plaintext[0]
+        kek = plaintext[1:1 + kek_len] or None
+        private_key = serialization.load_der_private_key(plaintext[1 + kek_len:], password=None)
+        return private_key, kek
+
     # --- Cifrado Híbrido (Key Wrapping) ---
 
-    def wrap_aes_key(self, aes_key: bytes, public_key_pem: str) -> bytes:
+    def load_public_key_pem(self, public_key_pem: str) -> RSAPublicKey:
+        """Carga la llave pública PEM de un usuario como objeto `RSAPublicKey`."""
+        return serialization.load_pem_public_key(public_key_pem.encode())
+
+    def wrap_aes_key(self, aes_key: bytes, public_key: Union[str, RSAPublicKey]) -> bytes:
         """
         Envuelve (cifra) una clave AES con una clave pública RSA.
         Esto es para compartir el secreto de forma segura.
+        Acepta el PEM o una llave ya cargada (evita re-parsear en lotes).
         """
-        public_key = serialization.load_pem_public_key(public_key_pem.encode())
+        if isinstance(public_key, str):
+            public_key = self.load_public_key_pem(public_key)
         
         wrapped_key = public_key.encrypt(
             aes_key,
@@ -149,14 +266,16 @@ class CryptoEngine:
         )
         return wrapped_key
 
-    def unwrap_aes_key(self, wrapped_key: bytes, private_key_pem: bytes) -> bytes:
+    def unwrap_aes_key(self, wrapped_key: bytes, private_key: Union[bytes, RSAPrivateKey]) -> bytes:
         """
         Desenvuelve (descifra) una clave AES con una clave privada RSA.
+        Acepta el PEM descifrado o un objeto `RSAPrivateKey` ya cargado.
         """
-        private_key = serialization.load_pem_private_key(
-            private_key_pem,
-            password=None # La clave ya debe estar descifrada en este punto
-        )
+        if isinstance(private_key, bytes):
+            private_key = serialization.load_pem_private_key(
+                private_key,
+                password=None # La clave ya debe estar descifrada en este punto
+            )
         
         aes_key = private_key.decrypt(
             wrapped_key,
@@ -168,6 +287,70 @@ class CryptoEngine:
         )
         return aes_key
 
+    # --- API Asíncrona (ejecutada en el pool criptográfico) ---
+    # Las primitivas costosas se delegan al CryptoExecutor para no bloquear el
+    # event loop; si el pool está saturado se lanza CryptoPoolSaturated (503).
+
+    async def aget_password_hash(self, password: str) -> str:
+        return await crypto_executor.run("get_password_hash", password)
+
+    async def averify_password(self, plain_password: str, hashed_password: str) -> bool:
+        return await crypto_executor.run("verify_password", plain_password, hashed_password)
+
+    async def averify_and_update_password(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        return await crypto_executor.run("verify_and_update_password", plain_password, hashed_password)
+
+    async def adummy_verify_password(self, plain_password: str) -> bool:
+        if not self.password_hasher.dummy_ready:
+            # El arranque aún no lo tiene: se calcula en el pool, nunca en el event loop
+            await crypto_executor.run_callable("prepare_dummy_hash", self.password_hasher.prepare_dummy_hash)
+        # El hash señuelo viaja como argumento: los procesos del pool no calculan el suyo
+        await crypto_executor.run("verify_password", plain_password, self.password_hasher.dummy_hash)
+        return False
+
+    async def agenerate_rsa_key_pair(self) -> Tuple[bytes, bytes]:
+        return await crypto_executor.run("generate_rsa_key_pair")
+
+    async def aencrypt_rsa_private_key(self, private_key_pem: bytes, user_password: str) -> str:
+        return await crypto_executor.run("encrypt_rsa_private_key", private_key_pem, user_password)
+
+    async def adecrypt_rsa_private_key(self, encrypted_bundle: str, user_password: str) -> bytes:
+        return await crypto_executor.run("decrypt_rsa_private_key", encrypted_bundle, user_password)
+
+    async def aload_rsa_private_key(self, encrypted_bundle: str, user_password: str) -> RSAPrivateKey:
+        # El KDF en el pool CPU-bound; el objeto resultante no es serializable,
+        # así que el parseo del PEM se hace en el pool de hilos.
+        private_key_pem = await self.adecrypt_rsa_private_key(encrypted_bundle, user_password)
+        return await crypto_executor.run("load_private_key_pem", private_key_pem, cpu_bound=False)
+
+    async def aunlock_rsa_private_key(self, encrypted_bundle: str, user_password: str) -> Tuple[RSAPrivateKey, Optional[str]]:
+        """Como `aload_rsa_private_key`, pero devuelve también el bundle re-envuelto si estaba obsoleto."""
+        private_key_pem, new_bundle = await crypto_executor.run("decrypt_and_rewrap_rsa_private_key", encrypted_bundle, user_password)
+        private_key = await crypto_executor.run("load_private_key_pem", private_key_pem, cpu_bound=False)
+        return private_key, new_bundle
+
+    async def aunwrap_aes_key(self, wrapped_key: bytes, private_key: Union[bytes, RSAPrivateKey]) -> bytes:
+        return await crypto_executor.run(
+            "unwrap_aes_key", wrapped_key, private_key,
+            cpu_bound=isinstance(private_key, bytes)
+        )
+
+    async def awrap_aes_key(self, aes_key: bytes, public_key: Union[str, RSAPublicKey]) -> bytes:
+        # Con el PEM puede ir al pool de procesos; el objeto parseado (caché de llaves
+        # públicas) no es serializable y se queda en el pool de hilos.
+        return await crypto_executor.run(
+            "wrap_aes_key", aes_key, public_key,
+            cpu_bound=isinstance(public_key, str)
+        )
+
+    async def aencrypt_aes_gcm(self, data: bytes, key: bytes) -> Dict[str, bytes]:
+        # AES-GCM es rápido y libera el GIL: el pool de hilos evita copiar el payload a otro proceso
+        return await crypto_executor.run("encrypt_aes_gcm", data, key, cpu_bound=False)
+
+    async def adecrypt_aes_gcm(self, encrypted_parts: Dict[str, bytes], key: bytes) -> bytes:
+        return await crypto_executor.run("decrypt_aes_gcm", encrypted_parts, key, cpu_bound=False)
+
 # --- Instancia Singleton ---
 # Creamos una única instancia del motor para ser importada y usada en toda la app.
-crypto_engine = CryptoEngine()
\ No newline at end of file
+crypto_engine = CryptoEngine()
+
@@ -0,0 +1,188 @@
+import asyncio
+import functools
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.services.metrics import add_to_request, crypto_duration, crypto_pool_wait
+
+
+class CryptoPoolSaturated(Exception):
+    """
+    Se lanza cuando el pool criptográfico no admite más trabajo.
+    La API la traduce a un 503 con cabecera Retry-After.
+    """
+
+    def __init__(self, operation: str, retry_after: int):
+        super().__init__(f"Pool criptográfico saturado ({operation})")
+        self.operation = operation
+        self.retry_after = retry_after
+
+
+def _invoke(operation: str, args: Tuple[Any, ...]) -> Tuple[float, float, Any]:
+    """
+    Ejecuta un método del CryptoEngine por nombre dentro del worker.
+    Se usa el nombre (y no el método ligado) para que la llamada sea serializable
+    al enviarla a un ProcessPoolExecutor.
+    """
+    from app.services.crypto_engine import crypto_engine
+
+    started_at = time.time()
+    t0 = time.perf_counter()
+    result = getattr(crypto_engine, operation)(*args)
+    return started_at, time.perf_counter() - t0, result
+
+
+def _call(func: Callable[..., Any], args: Tuple[Any, ...]) -> Tuple[float, float, Any]:
+    """Igual que `_invoke` pero para callables arbitrarios (solo en hilos)."""
+    started_at = time.time()
+    t0 = time.perf_counter()
+    result = func(*args)
+    return started_at, time.perf_counter() - t0, result
+
+
+class OperationStats:
+    """Métricas acumuladas de una operación criptográfica."""
+    __slots__ = ("count", "rejected", "errors", "queue_wait_total", "queue_wait_max", "exec_total", "exec_max")
+
+    def __init__(self):
+        self.count = 0
+        self.rejected = 0
+        self.errors = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.exec_total = 0.0
+        self.exec_max = 0.0
+
+    def observe(self, queue_wait: float, exec_time: float) -> None:
+        self.count += 1
+        self.queue_wait_total += queue_wait
+        self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+        self.exec_total += exec_time
+        self.exec_max = max(self.exec_max, exec_time)
+
+    def as_dict(self) -> Dict[str, Any]:
+        count = self.count or 1
+        return {
+            "count": self.count,
+            "rejected": self.rejected,
+            "errors": self.errors,
+            "queue_wait_avg_ms": round(self.queue_wait_total / count * 1000, 3),
+            "queue_wait_max_ms": round(self.queue_wait_max * 1000, 3),
+            "exec_avg_ms": round(self.exec_total / count * 1000, 3),
+            "exec_max_ms": round(self.exec_max * 1000, 3),
+        }
+
+
+class CryptoExecutor:
+    """
+    Pool dedicado para las primitivas criptográficas costosas (RSA, Scrypt, bcrypt).
+
+    - `kind="process"` usa un ProcessPoolExecutor para las operaciones CPU-bound;
+      las que reciben objetos no serializables (p.ej. `RSAPrivateKey`) van a un
+      pool de hilos auxiliar.
+    - `kind="thread"` usa únicamente el pool de hilos.
+
+    La admisión está acotada a `max_workers + max_queue` tareas en vuelo; por
+    encima de ese límite se rechaza con `CryptoPoolSaturated` en lugar de dejar
+    crecer la latencia sin control.
+    """
+
+    def __init__(self, kind: str, max_workers: int, max_queue: int, retry_after: int):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Tipo de executor desconocido: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._in_flight = 0
+        self._stats: Dict[str, OperationStats] = {}
+
+    # --- Ciclo de vida ---
+
+    def _pools(self) -> Tuple[Executor, Executor]:
+        # Los pools se crean de forma perezosa, después del fork de los workers del servidor.
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="crypto")
+        if self.kind == "process" and self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._process_pool or self._thread_pool, self._thread_pool
+
+    def shutdown(self) -> None:
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False, cancel_futures=True)
+            self._thread_pool = None
+
+    # --- Ejecución ---
+
+    async def run(self, operation: str, *args: Any, cpu_bound: bool = True) -> Any:
+        """
+        Ejecuta `crypto_engine.<operation>(*args)` en el pool.
+        Con `cpu_bound=False` se fuerza el pool de hilos (argumentos no serializables).
+        """
+        cpu_pool, thread_pool = self._pools()
+        pool = cpu_pool if cpu_bound else thread_pool
+        return await self._submit(operation, pool, functools.partial(_invoke, operation, args))
+
+    async def run_callable(self, label: str, func: Callable[..., Any], *args: Any) -> Any:
+        """Ejecuta un callable arbitrario en el pool de hilos, con la misma admisión y métricas."""
+        _, thread_pool = self._pools()
+        return await self._submit(label, thread_pool, functools.partial(_call, func, args))
+
+    async def _submit(self, label: str, pool: Executor, call: Callable[[], Tuple[float, float, Any]]) -> Any:
+        stats = self._stats.setdefault(label, OperationStats())
+        if self._in_flight >= self.max_workers + self.max_queue:
+            stats.rejected += 1
+            raise CryptoPoolSaturated(label, self.retry_after)
+
+        self._in_flight += 1
+        submitted_at = time.time()
+        try:
+            loop = asyncio.get_running_loop()
+            started_at, exec_time, result = await loop.run_in_executor(pool, call)
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            self._in_flight -= 1
+
+        queue_wait = max(0.0, started_at - submitted_at)
+        stats.observe(queue_wait, exec_time)
+        crypto_pool_wait.observe(queue_wait, operation=label)
+        if pool is self._process_pool:
+            # En otro proceso el decorador de CryptoEngine mide en un registro que no vemos
+            crypto_duration.observe(exec_time, operation=label)
+        # Desglose de la petición en curso (los hilos del pool no heredan su contexto)
+        add_to_request("crypto.pool_wait", queue_wait)
+        add_to_request(f"crypto.{label}", exec_time)
+        return result
+
+    # --- Observabilidad ---
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "in_flight": self._in_flight,
+            "operations": {name: op.as_dict() for name, op in self._stats.items()},
+        }
+
+
+# --- Instancia Singleton ---
+crypto_executor = CryptoExecutor(
+    kind=settings.CRYPTO_EXECUTOR,
+    max_workers=settings.CRYPTO_WORKERS,
+    max_queue=settings.CRYPTO_MAX_QUEUE,
+    retry_after=settings.CRYPTO_RETRY_AFTER_SECONDS,
+)
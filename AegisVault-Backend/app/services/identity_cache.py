@@ -0,0 +1,107 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from app.core.config import settings
+
+
+class CachedUser:
+    """
+    Registro ligero del usuario autenticado.
+    Solo contiene los campos que usan las rutas; no es una entidad ORM.
+    """
+    __slots__ = ("id", "username", "public_key", "encrypted_private_key", "encrypted_kek")
+
+    def __init__(
+        self,
+        id: uuid.UUID,
+        username: str,
+        public_key: str,
+        encrypted_private_key: str,
+        encrypted_kek: Optional[bytes] = None,
+    ):
+        self.id = id
+        self.username = username
+        self.public_key = public_key
+        self.encrypted_private_key = encrypted_private_key
+        self.encrypted_kek = encrypted_kek
+
+
+class IdentityCache:
+    """
+    Caché LRU + TTL de identidades resueltas a partir del token JWT.
+    Evita una consulta a `users` por cada petición autenticada.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[CachedUser, float]]" = OrderedDict()
+        # user_id -> claves de caché que apuntan a ese usuario (para invalidar)
+        self._keys_by_user: Dict[uuid.UUID, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[CachedUser]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            user, expires_at = entry
+            if expires_at <= time.monotonic():
+                self._remove_locked(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return user
+
+    def put(self, key: str, user: CachedUser) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (user, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            self._keys_by_user.setdefault(user.id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove_locked(oldest)
+
+    def invalidate_user(self, user_id: uuid.UUID) -> None:
+        """Debe llamarse cuando cambian las llaves o la contraseña de un usuario."""
+        with self._lock:
+            for key in self._keys_by_user.pop(user_id, set()):
+                self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def _remove_locked(self, key: str) -> None:
+        user, _ = self._entries.pop(key)
+        keys = self._keys_by_user.get(user.id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user.id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# --- Instancia Singleton ---
+identity_cache = IdentityCache(
+    max_entries=settings.IDENTITY_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.IDENTITY_CACHE_TTL_SECONDS,
+)
@@ -0,0 +1,139 @@
+import argparse
+import base64
+import os
+import time
+from typing import Dict, List, NamedTuple, Tuple
+
+from argon2.low_level import Type, hash_secret_raw
+from cryptography.hazmat.primitives.kdf.scrypt import Scrypt
+
+from app.core.config import settings
+
+# Formato versionado del bundle de la llave privada:
+#   v2:<kdf>:<params>:<salt>:<nonce>:<tag>:<ciphertext>
+# El prefijo "v2:<kdf>:<params>" se autentica como AAD de AES-GCM, así que no se
+# pueden rebajar los parámetros del bundle sin invalidar el tag.
+# El formato heredado "salt:nonce:tag:ciphertext" implica scrypt n=2**14, r=8, p=1.
+BUNDLE_VERSION = "v2"
+KDF_SCRYPT = "scrypt"
+KDF_ARGON2ID = "argon2id"
+LEGACY_KDF: Tuple[str, Dict[str, int]] = (KDF_SCRYPT, {"n": 2**14, "r": 8, "p": 1})
+
+
+class PrivateKeyBundle(NamedTuple):
+    kdf: str
+    params: Dict[str, int]
+    salt: bytes
+    nonce: bytes
+    tag: bytes
+    ciphertext: bytes
+    aad: bytes  # b"" en el formato heredado
+
+
+def derive_key(kdf: str, params: Dict[str, int], password: bytes, salt: bytes) -> bytes:
+    """Deriva una llave AES-256 a partir de la contraseña con el KDF y parámetros dados."""
+    if kdf == KDF_SCRYPT:
+        return Scrypt(salt=salt, length=32, n=params["n"], r=params["r"], p=params["p"]).derive(password)
+    if kdf == KDF_ARGON2ID:
+        return hash_secret_raw(
+            secret=password, salt=salt, time_cost=params["t"], memory_cost=params["m"],
+            parallelism=params["p"], hash_len=32, type=Type.ID,
+        )
+    raise ValueError(f"KDF desconocido: {kdf}")
+
+
+def default_kdf() -> Tuple[str, Dict[str, int]]:
+    """KDF y parámetros con los que se envuelven las llaves nuevas (KDF_ALGORITHM y compañía)."""
+    if settings.KDF_ALGORITHM == KDF_SCRYPT:
+        return KDF_SCRYPT, {"n": settings.KDF_SCRYPT_N, "r": settings.KDF_SCRYPT_R, "p": settings.KDF_SCRYPT_P}
+    if settings.KDF_ALGORITHM == KDF_ARGON2ID:
+        return KDF_ARGON2ID, {
+            "t": settings.KDF_ARGON2_TIME_COST,
+            "m": settings.KDF_ARGON2_MEMORY_COST,
+            "p": settings.KDF_ARGON2_PARALLELISM,
+        }
+    raise ValueError(f"KDF desconocido: {settings.KDF_ALGORITHM}")
+
+
+def encode_params(params: Dict[str, int]) -> str:
+    return ",".join(f"{name}={value}" for name, value in sorted(params.items()))
+
+
+def decode_params(encoded: str) -> Dict[str, int]:
+    return {name: int(value) for name, value in (item.split("=", 1) for item in encoded.split(","))}
+
+
+def bundle_header(kdf: str, params: Dict[str, int]) -> str:
+    return f"{BUNDLE_VERSION}:{kdf}:{encode_params(params)}"
+
+
+def format_bundle(kdf: str, params: Dict[str, int], salt: bytes, nonce: bytes, tag: bytes, ciphertext: bytes) -> str:
+    parts = [base64.b64encode(part).decode("utf-8") for part in (salt, nonce, tag, ciphertext)]
+    return ":".join([bundle_header(kdf, params)] + parts)
+
+
+def parse_bundle(bundle: str) -> PrivateKeyBundle:
+    """Interpreta un bundle v2 o heredado; lanza ValueError si está mal formado."""
+    fields = bundle.split(":")
+    if len(fields) == 4:
+        kdf, params = LEGACY_KDF
+        aad = b""
+        encoded = fields
+    elif len(fields) == 7 and fields[0] == BUNDLE_VERSION:
+        kdf, params = fields[1], decode_params(fields[2])
+        aad = ":".join(fields[:3]).encode()
+        encoded = fields[3:]
+    else:
+        raise ValueError("Formato de bundle de llave privada desconocido")
+    salt, nonce, tag, ciphertext = (base64.b64decode(part) for part in encoded)
+    return PrivateKeyBundle(kdf, dict(params), salt, nonce, tag, ciphertext, aad)
+
+
+def bundle_is_current(bundle: str) -> bool:
+    """True si el bundle ya usa el KDF y los parámetros configurados (no requiere re-wrap)."""
+    try:
+        parsed = parse_bundle(bundle)
+    except ValueError:
+        return True  # Nada que migrar: el descifrado fallará por su cuenta
+    return parsed.aad != b"" and (parsed.kdf, parsed.params) == default_kdf()
+
+
+# --- Benchmark (CLI) ---
+
+BENCHMARK_SETS: List[Tuple[str, Dict[str, int]]] = [
+    LEGACY_KDF,
+    (KDF_SCRYPT, {"n": 2**15, "r": 8, "p": 1}),
+    (KDF_SCRYPT, {"n": 2**16, "r": 8, "p": 1}),
+    (KDF_SCRYPT, {"n": 2**17, "r": 8, "p": 1}),
+    (KDF_ARGON2ID, {"t": 2, "m": 19456, "p": 1}),
+    (KDF_ARGON2ID, {"t": 3, "m": 65536, "p": 1}),
+    (KDF_ARGON2ID, {"t": 3, "m": 65536, "p": 4}),
+    (KDF_ARGON2ID, {"t": 4, "m": 262144, "p": 4}),
+]
+
+
+def benchmark(sets: List[Tuple[str, Dict[str, int]]], samples: int) -> List[Tuple[str, str, float]]:
+    """Mediana del tiempo de derivación (ms) de cada conjunto de parámetros."""
+    results = []
+    salt = os.urandom(16)
+    for kdf, params in sets:
+        timings = []
+        for _ in range(samples):
+            t0 = time.perf_counter()
+            derive_key(kdf, params, b"benchmark-password", salt)
+            timings.append((time.perf_counter() - t0) * 1000)
+        results.append((kdf, encode_params(params), sorted(timings)[len(timings) // 2]))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mide el tiempo de derivación de cada conjunto de parámetros KDF.")
+    parser.add_argument("--samples", type=int, default=3)
+    args = parser.parse_args()
+
+    configured = default_kdf()
+    sets = BENCHMARK_SETS + ([configured] if configured not in BENCHMARK_SETS else [])
+    print(f"{'kdf':<10} {'parámetros':<22} {'derivación (ms)':>16}")
+    for kdf, params, elapsed in benchmark(sets, args.samples):
+        marker = "  <- configurado" if (kdf, decode_params(params)) == configured else ""
+        print(f"{kdf:<10} {params:<22} {elapsed:>16.1f}{marker}")
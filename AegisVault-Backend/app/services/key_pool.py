@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from app.core.config import settings
+from app.services.crypto_engine import crypto_engine
+from app.services.crypto_executor import CryptoPoolSaturated
+
+logger = logging.getLogger(__name__)
+
+
+class RSAKeyPool:
+    """
+    Reserva en memoria de pares RSA-2048 pre-generados.
+
+    Generar una llave RSA tarda entre 50 y 500 ms con mucha varianza; con la
+    reserva, `/register` solo paga ese coste cuando está vacía. Un worker en
+    segundo plano rellena la reserva hasta `size` cuando baja de `low_water`,
+    respetando `refill_interval` entre generaciones para no competir con el
+    tráfico en línea por el pool criptográfico.
+    """
+
+    def __init__(self, size: int, low_water: int, refill_interval: float):
+        self.size = size
+        self.low_water = low_water
+        self.refill_interval = refill_interval
+        self._keys: Deque[Tuple[bytes, bytes]] = deque()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        # Instantes de las últimas generaciones, para estimar la tasa de recarga
+        self._refill_times: Deque[float] = deque(maxlen=64)
+
+    # --- Ciclo de vida ---
+
+    def start(self) -> None:
+        if self.size <= 0 or self._task is not None:
+            return
+        self._wakeup.set()  # Llenado inicial
+        self._task = asyncio.create_task(self._refill_loop(), name="rsa-key-pool")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._keys.clear()
+
+    # --- Consumo ---
+
+    async def acquire(self) -> Tuple[bytes, bytes]:
+        """
+        Devuelve un par (private_key_pem, public_key_pem) sin usar.
+        Si la reserva está vacía, lo genera en línea a través del pool criptográfico.
+        """
+        if self._keys:
+            self.hits += 1
+            pair = self._keys.popleft()
+            if len(self._keys) < self.low_water:
+                self._wakeup.set()
+            return pair
+
+        self.misses += 1
+        self._wakeup.set()
+        return await crypto_engine.agenerate_rsa_key_pair()
+
+    # --- Recarga en segundo plano ---
+
+    async def _refill_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while len(self._keys) < self.size:
+                try:
+                    pair = await crypto_engine.agenerate_rsa_key_pair()
+                except CryptoPoolSaturated:
+                    # El tráfico en línea tiene prioridad: esperamos y reintentamos.
+                    await asyncio.sleep(max(self.refill_interval, 1.0))
+                    continue
+                except Exception:
+                    logger.exception("Error generando llaves para la reserva RSA")
+                    await asyncio.sleep(max(self.refill_interval, 1.0))
+                    continue
+                self._keys.append(pair)
+                self.generated += 1
+                self._refill_times.append(time.monotonic())
+                if self.refill_interval > 0:
+                    await asyncio.sleep(self.refill_interval)
+
+    # --- Observabilidad ---
+
+    def refill_rate(self) -> float:
+        """Llaves generadas por segundo en la ventana reciente."""
+        if len(self._refill_times) < 2:
+            return 0.0
+        window = self._refill_times[-1] - self._refill_times[0]
+        return (len(self._refill_times) - 1) / window if window > 0 else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": len(self._keys),
+            "size": self.size,
+            "low_water": self.low_water,
+            "hits": self.hits,
+            "misses": self.misses,
+            "generated": self.generated,
+            "refill_rate_per_s": round(self.refill_rate(), 3),
+            "running": self._task is not None and not self._task.done(),
+        }
+
+
+# --- Instancia Singleton ---
+rsa_key_pool = RSAKeyPool(
+    size=settings.RSA_KEY_POOL_SIZE,
+    low_water=settings.RSA_KEY_POOL_LOW_WATER,
+    refill_interval=settings.RSA_KEY_POOL_REFILL_INTERVAL,
+)
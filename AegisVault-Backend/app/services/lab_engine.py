@@ -0,0 +1,359 @@
+"""
+Motor del laboratorio de cifrados clásicos (Vigenère, César y afín) y de su criptoanálisis.
+
+Trabaja sobre bytes: el texto se pasa a mayúsculas y solo se transforman las
+letras ASCII A-Z; el resto (espacios, signos, bytes UTF-8 de letras acentuadas)
+se conserva tal cual. Ningún bucle Python recorre el texto carácter a carácter:
+
+- César y afín son una sola tabla de traducción (`bytes.translate`).
+- Vigenère extrae las letras, traduce cada columna `letras[i::m]` con la tabla
+  de César de su letra de la clave y las reinserta entre la puntuación. Si NumPy
+  está instalado (opcional), el texto con puntuación se desplaza vectorizado.
+- El análisis cuenta letras con `bytes.count` sobre todo el corpus y calcula la
+  longitud de clave (IoC por columnas y Kasiski) y la clave sobre una muestra
+  acotada de letras, así que su coste apenas crece con el tamaño del texto.
+"""
+import math
+import re
+from collections import Counter
+from functools import lru_cache
+from itertools import accumulate, chain
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    # Dependencia opcional: Vigenère vectorizado sin reinsertar las letras palabra a palabra
+    import numpy as np
+except ImportError:
+    np = None
+
+ALPHABET = b"ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+CIPHERS = ("vigenere", "caesar", "affine")
+
+_TO_UPPER = bytes.maketrans(ALPHABET.lower(), ALPHABET)
+_NON_LETTERS = bytes(c for c in range(256) if c not in ALPHABET)
+_NON_LETTER_RUNS = re.compile(rb"([^A-Z]+)")
+_SHIFT_TABLES = [bytes.maketrans(ALPHABET, ALPHABET[s:] + ALPHABET[:s]) for s in range(26)]
+
+# Frecuencias de referencia (%) de A..Z; en español, sin Ñ y con las vocales acentuadas como su base
+LANGUAGE_FREQUENCIES: Dict[str, Sequence[float]] = {
+    "en": (8.167, 1.492, 2.782, 4.253, 12.702, 2.228, 2.015, 6.094, 6.966, 0.153, 0.772, 4.025, 2.406,
+           6.749, 7.507, 1.929, 0.095, 5.987, 6.327, 9.056, 2.758, 0.978, 2.360, 0.150, 1.974, 0.074),
+    "es": (12.53, 1.42, 4.68, 5.86, 13.68, 0.69, 1.01, 0.70, 6.25, 0.44, 0.02, 4.97, 3.15,
+           6.71, 8.68, 2.51, 0.88, 6.87, 7.98, 4.63, 3.93, 0.90, 0.01, 0.22, 0.90, 0.52),
+}
+RANDOM_IOC = 1 / 26
+# Longitud de los n-gramas repetidos cuyas distancias examina Kasiski
+KASISKI_NGRAM = 3
+AFFINE_MULTIPLIERS = tuple(a for a in range(1, 26) if math.gcd(a, 26) == 1)
+
+
+class CipherError(ValueError):
+    """Parámetros de cifrado no válidos (clave vacía, `a` no invertible módulo 26...)."""
+
+
+# --- Primitivas sobre bytes ---
+
+def normalize(data: bytes) -> bytes:
+    """Mayúsculas ASCII; los bytes que no son a-z no cambian."""
+    return data.translate(_TO_UPPER)
+
+
+def letters_only(data: bytes) -> bytes:
+    """Solo las letras A-Z de un texto ya normalizado."""
+    return data.translate(None, _NON_LETTERS)
+
+
+def key_shifts(key: str) -> List[int]:
+    shifts = [c - 65 for c in letters_only(normalize(key.encode("ascii", "ignore")))]
+    if not shifts:
+        raise CipherError("La clave debe contener al menos una letra A-Z")
+    return shifts
+
+
+@lru_cache(maxsize=None)
+def _affine_table(a: int, b: int, decrypt: bool) -> bytes:
+    if math.gcd(a, 26) != 1:
+        raise CipherError(f"'a' debe ser coprimo con 26 (uno de {list(AFFINE_MULTIPLIERS)})")
+    if decrypt:
+        a_inv = pow(a, -1, 26)
+        target = bytes(65 + (a_inv * (x - b)) % 26 for x in range(26))
+    else:
+        target = bytes(65 + (a * x + b) % 26 for x in range(26))
+    return bytes.maketrans(ALPHABET, target)
+
+
+def _shift_columns(letters: bytes, shifts: Sequence[int], offset: int) -> bytes:
+    """La letra j se desplaza `shifts[(j + offset) % m]`: cada columna es una sola traducción."""
+    m = len(shifts)
+    if m == 1:
+        return letters.translate(_SHIFT_TABLES[shifts[0] % 26])
+    out = bytearray(len(letters))
+    for i in range(min(m, len(letters))):
+        out[i::m] = letters[i::m].translate(_SHIFT_TABLES[shifts[(i + offset) % m] % 26])
+    return bytes(out)
+
+
+def _reinsert(text: bytes, letters: bytes) -> bytes:
+    """
+    Sustituye, en orden, las letras de `text` por las de `letters` (misma cantidad).
+    split/map/join iteran en C: no hay llamada Python por palabra ni por carácter.
+    """
+    if len(letters) == len(text):
+        return letters
+    # Con grupo de captura, los tramos de letras quedan en las posiciones pares
+    parts = _NON_LETTER_RUNS.split(text)
+    ends = list(accumulate(map(len, parts[::2])))
+    parts[::2] = list(map(letters.__getitem__, map(slice, chain((0,), ends), ends)))
+    return b"".join(parts)
+
+
+def _vigenere_vectorized(text: bytes, shifts: Sequence[int], offset: int) -> bytes:
+    """Igual que columnas + reinserción, pero con el índice de letra de cada byte (cumsum)."""
+    data = np.frombuffer(text, dtype=np.uint8)
+    is_letter = (data >= 65) & (data <= 90)
+    letter_index = np.cumsum(is_letter, dtype=np.int64) - 1 + offset
+    key = np.asarray(shifts, dtype=np.int16) % 26
+    shifted = (data.astype(np.int16) - 65 + key[letter_index % len(shifts)]) % 26 + 65
+    return np.where(is_letter, shifted, data).astype(np.uint8).tobytes()
+
+
+def build_transform(
+    cipher: str,
+    decrypt: bool = False,
+    key: Optional[str] = None,
+    shift: Optional[int] = None,
+    a: Optional[int] = None,
+    b: Optional[int] = None,
+) -> Callable[[bytes], bytes]:
+    """
+    Transformación para aplicar al texto entero o por trozos consecutivos (subidas
+    en streaming): en Vigenère la posición en la clave continúa entre llamadas.
+    Valida los parámetros antes de devolverla.
+    """
+    if cipher == "caesar":
+        if shift is None:
+            raise CipherError("César requiere 'shift'")
+        table = _SHIFT_TABLES[(-shift if decrypt else shift) % 26]
+        return lambda data: normalize(data).translate(table)
+
+    if cipher == "affine":
+        if a is None or b is None:
+            raise CipherError("El cifrado afín requiere 'a' y 'b'")
+        table = _affine_table(a % 26, b % 26, decrypt)
+        return lambda data: normalize(data).translate(table)
+
+    if cipher == "vigenere":
+        if not key:
+            raise CipherError("Vigenère requiere 'key'")
+        shifts = [-s if decrypt else s for s in key_shifts(key)]
+        offset = 0
+
+        def vigenere(data: bytes) -> bytes:
+            nonlocal offset
+            text = normalize(data)
+            letters = letters_only(text)
+            if np is not None and len(letters) != len(text):
+                result = _vigenere_vectorized(text, shifts, offset)
+            else:
+                result = _reinsert(text, _shift_columns(letters, shifts, offset))
+            offset = (offset + len(letters)) % len(shifts)
+            return result
+
+        return vigenere
+
+    raise CipherError(f"Cifrado desconocido '{cipher}' (uno de {list(CIPHERS)})")
+
+
+def transform(data: bytes, cipher: str, decrypt: bool = False, **params: Any) -> bytes:
+    return build_transform(cipher, decrypt, **params)(data)
+
+
+# --- Estadística ---
+
+def letter_counts(letters: bytes) -> List[int]:
+    return [letters.count(c) for c in ALPHABET]
+
+
+def index_of_coincidence(counts: Sequence[int]) -> float:
+    total = sum(counts)
+    if total < 2:
+        return 0.0
+    return sum(n * (n - 1) for n in counts) / (total * (total - 1))
+
+
+def language_ioc(language: str) -> float:
+    return sum((p / 100) ** 2 for p in _frequencies(language))
+
+
+def _frequencies(language: str) -> Sequence[float]:
+    try:
+        return LANGUAGE_FREQUENCIES[language]
+    except KeyError:
+        raise CipherError(f"Idioma no soportado '{language}' (uno de {list(LANGUAGE_FREQUENCIES)})")
+
+
+def chi_squared(counts: Sequence[int], language: str, mapping: Optional[Sequence[int]] = None) -> float:
+    """
+    Chi-cuadrado del texto en claro frente al idioma. `mapping[x]` es la letra
+    cifrada que corresponde a la letra en claro x, así que no hace falta descifrar.
+    """
+    total = sum(counts)
+    if not total:
+        return math.inf
+    score = 0.0
+    for x, pct in enumerate(_frequencies(language)):
+        expected = total * pct / 100
+        observed = counts[mapping[x] if mapping is not None else x]
+        score += (observed - expected) ** 2 / expected
+    return score
+
+
+def key_length_scores(letters: bytes, max_key_length: int) -> Dict[int, float]:
+    """IoC medio de las columnas `letters[i::m]` para cada longitud de clave m."""
+    scores = {}
+    for m in range(1, max_key_length + 1):
+        if len(letters) < 2 * m:
+            break
+        scores[m] = sum(index_of_coincidence(letter_counts(letters[i::m])) for i in range(m)) / m
+    return scores
+
+
+def kasiski(letters: bytes, max_key_length: int) -> Dict[int, int]:
+    """Cuántas distancias entre trigramas repetidos son múltiplo de cada longitud 2..max."""
+    last_seen: Dict[bytes, int] = {}
+    distances: Counter = Counter()
+    for i in range(len(letters) - KASISKI_NGRAM + 1):
+        ngram = letters[i:i + KASISKI_NGRAM]
+        previous = last_seen.get(ngram)
+        if previous is not None:
+            distances[i - previous] += 1
+        last_seen[ngram] = i
+    factors = dict.fromkeys(range(2, max_key_length + 1), 0)
+    for distance, times in distances.items():
+        for m in factors:
+            if distance % m == 0:
+                factors[m] += times
+    return factors
+
+
+def estimate_key_length(scores: Dict[int, float]) -> int:
+    """
+    Los múltiplos de la longitud real puntúan casi igual que ella: se elige la
+    menor longitud que cubre el 85 % de la distancia entre texto aleatorio y la mejor.
+    """
+    if not scores:
+        return 1
+    best = max(scores.values())
+    threshold = RANDOM_IOC + 0.85 * (best - RANDOM_IOC)
+    return min(m for m, score in scores.items() if score >= threshold)
+
+
+def best_shift(counts: Sequence[int], language: str) -> Tuple[int, float]:
+    candidates = ((chi_squared(counts, language, [(x + s) % 26 for x in range(26)]), s) for s in range(26))
+    score, shift = min(candidates)
+    return shift, score
+
+
+def _minimal_period(key: str) -> str:
+    """"ABCABC" -> "ABC": si se estimó un múltiplo de la longitud real, la clave sale repetida."""
+    for m in range(1, len(key)):
+        if len(key) % m == 0 and key[:m] * (len(key) // m) == key:
+            return key[:m]
+    return key
+
+
+def recover_vigenere_key(letters: bytes, key_length: int, language: str) -> Tuple[str, float]:
+    """Clave más probable columna a columna (chi-cuadrado de cada desplazamiento)."""
+    key, total = [], 0.0
+    for i in range(key_length):
+        shift, score = best_shift(letter_counts(letters[i::key_length]), language)
+        key.append(chr(65 + shift))
+        total += score
+    return _minimal_period("".join(key)), total / key_length
+
+
+def recover_affine_key(counts: Sequence[int], language: str) -> Tuple[int, int, float]:
+    candidates = (
+        (chi_squared(counts, language, [(a * x + b) % 26 for x in range(26)]), a, b)
+        for a in AFFINE_MULTIPLIERS for b in range(26)
+    )
+    score, a, b = min(candidates)
+    return a, b, score
+
+
+# --- Corpus (acumulable por trozos) ---
+
+class CorpusAnalyzer:
+    """
+    Acumula un corpus por trozos: frecuencias sobre todo el texto y una muestra de
+    las primeras `sample_letters` letras para longitud de clave, Kasiski y
+    recuperación de la clave. La memoria es la de la muestra, no la del corpus.
+    """
+
+    def __init__(self, sample_letters: int, preview_chars: int = 500):
+        self.sample_letters = sample_letters
+        self.preview_chars = preview_chars
+        self.total_bytes = 0
+        self.counts = [0] * 26
+        self.sample = bytearray()
+        self.preview = bytearray()
+
+    def feed(self, data: bytes) -> None:
+        self.total_bytes += len(data)
+        text = normalize(data)
+        letters = letters_only(text)
+        for i, n in enumerate(letter_counts(letters)):
+            self.counts[i] += n
+        if len(self.sample) < self.sample_letters:
+            self.sample += letters[:self.sample_letters - len(self.sample)]
+        if len(self.preview) < self.preview_chars:
+            self.preview += text[:self.preview_chars - len(self.preview)]
+
+    @property
+    def total_letters(self) -> int:
+        return sum(self.counts)
+
+    def analyze(self, max_key_length: int, language: str) -> Dict[str, Any]:
+        sample = bytes(self.sample)
+        scores = key_length_scores(sample, max_key_length)
+        total = self.total_letters
+        return {
+            "total_bytes": self.total_bytes,
+            "total_letters": total,
+            "sample_letters": len(sample),
+            "frequencies": {
+                chr(65 + i): round(n / total * 100, 3) if total else 0.0 for i, n in enumerate(self.counts)
+            },
+            "index_of_coincidence": round(index_of_coincidence(self.counts), 5),
+            "language_ioc": round(language_ioc(language), 5),
+            "random_ioc": round(RANDOM_IOC, 5),
+            "key_length_ioc": {m: round(score, 5) for m, score in scores.items()},
+            "kasiski_factors": kasiski(sample, max_key_length),
+            "estimated_key_length": estimate_key_length(scores),
+        }
+
+    def crack(self, cipher: str, language: str, max_key_length: int, key_length: Optional[int] = None) -> Dict[str, Any]:
+        """Parámetros más probables y vista previa descifrada del inicio del corpus."""
+        sample = bytes(self.sample)
+        if cipher == "vigenere":
+            length = key_length or estimate_key_length(key_length_scores(sample, max_key_length))
+            key, score = recover_vigenere_key(sample, length, language)
+            params: Dict[str, Any] = {"key": key}
+            result: Dict[str, Any] = {"key": key, "key_length": len(key)}
+        elif cipher == "caesar":
+            shift, score = best_shift(self.counts, language)
+            params = {"shift": shift}
+            result = {"shift": shift}
+        elif cipher == "affine":
+            a, b, score = recover_affine_key(self.counts, language)
+            params = {"a": a, "b": b}
+            result = {"a": a, "b": b}
+        else:
+            raise CipherError(f"Cifrado desconocido '{cipher}' (uno de {list(CIPHERS)})")
+        preview = transform(bytes(self.preview), cipher, decrypt=True, **params)
+        result.update(
+            cipher=cipher,
+            chi_squared=round(score, 2),
+            preview=preview.decode("utf-8", "replace"),
+        )
+        return result
@@ -0,0 +1,248 @@
+import contextvars
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.core.config import settings
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1.0, **labels: Any) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # etiquetas -> [conteo por bucket..., suma, total]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0.0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, ('le', f'{bound:g}'))} {cumulative:g}")
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, ('le', '+Inf'))} {series[-1]:g}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {series[-1]:g}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Registro mínimo con formato de exposición de Prometheus (texto 0.0.4).
+    Además de contadores e histogramas, expone como gauges los valores numéricos
+    de los `stats()` de los servicios (cachés, pools, auditoría...).
+    """
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self._metrics: List[Any] = []
+        self._stats: List[Tuple[str, Callable[[], Dict[str, Any]]]] = []
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        metric = Counter(f"{self.namespace}_{name}", documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DURATION_BUCKETS) -> Histogram:
+        metric = Histogram(f"{self.namespace}_{name}", documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_stats(self, prefix: str, collect: Callable[[], Dict[str, Any]]) -> None:
+        self._stats.append((prefix, collect))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, collect in self._stats:
+            for key, value in collect().items():
+                # Solo valores escalares; los desgloses anidados ya tienen sus histogramas
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                name = f"{self.namespace}_{prefix}_{key}"
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+# --- Instancia Singleton ---
+registry = MetricsRegistry("aegisvault")
+
+http_requests = registry.counter("http_requests_total", "Peticiones HTTP atendidas.", ("method", "route", "status"))
+http_duration = registry.histogram("http_request_duration_seconds", "Latencia de las peticiones HTTP.", ("method", "route"))
+http_db_queries = registry.histogram("http_request_db_queries", "Consultas SQL por petición.", ("route",), COUNT_BUCKETS)
+db_query_duration = registry.histogram("db_query_duration_seconds", "Duración de cada sentencia SQL.")
+crypto_duration = registry.histogram("crypto_operation_duration_seconds", "Duración de cada operación del CryptoEngine.", ("operation",))
+crypto_pool_wait = registry.histogram("crypto_pool_wait_seconds", "Espera en cola del pool criptográfico.", ("operation",))
+stage_duration = registry.histogram("request_stage_duration_seconds", "Duración de etapas instrumentadas con timed().", ("stage",))
+
+
+class RequestTimings:
+    """Tiempo acumulado por etapa dentro de una petición (para la cabecera Server-Timing)."""
+    __slots__ = ("stages", "db_queries", "_lock")
+
+    def __init__(self):
+        self.stages: Dict[str, List[float]] = {}
+        self.db_queries = 0
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                self.stages[stage] = [seconds, 1]
+            else:
+                entry[0] += seconds
+                entry[1] += 1
+
+    def server_timing(self, total: float) -> str:
+        with self._lock:
+            parts = [f"{stage};dur={seconds * 1000:.2f};desc=\"x{int(count)}\"" for stage, (seconds, count) in self.stages.items()]
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+
+current_timings: "contextvars.ContextVar[Optional[RequestTimings]]" = contextvars.ContextVar("request_timings", default=None)
+
+
+def add_to_request(stage: str, seconds: float) -> None:
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Mide un bloque (síncrono o con awaits) como etapa de la petición en curso."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        stage_duration.observe(elapsed, stage=stage)
+        add_to_request(stage, elapsed)
+
+
+def timed_methods(cls: type) -> type:
+    """
+    Decorador de clase: mide cada método público síncrono (las corrutinas no,
+    porque solo delegan en el pool). Con METRICS_ENABLED=False deja la clase intacta.
+    """
+    if not settings.METRICS_ENABLED:
+        return cls
+    for name, member in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.isfunction(member) or inspect.iscoroutinefunction(member):
+            continue
+        setattr(cls, name, _timed_method(name, member))
+    return cls
+
+
+def _timed_method(name: str, func: Callable[..., Any]) -> Callable[..., Any]:
+    stage = f"crypto.{name}"
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - t0
+            crypto_duration.observe(elapsed, operation=name)
+            # En los hilos del pool no hay petición en el contexto: el executor lo suma al volver
+            add_to_request(stage, elapsed)
+
+    return wrapper
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Cuenta y cronometra cada sentencia SQL del motor (global y por petición)."""
+    if not settings.METRICS_ENABLED:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        _finish(conn)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        if exception_context.connection is not None:
+            _finish(exception_context.connection)
+
+
+def _finish(conn: Any) -> None:
+    starts = conn.info.get("metrics_query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    db_query_duration.observe(elapsed)
+    timings = current_timings.get()
+    if timings is not None:
+        timings.db_queries += 1
+        timings.add("db", elapsed)
@@ -0,0 +1,154 @@
+import argparse
+import secrets
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from passlib.context import CryptContext
+
+from app.core.config import settings
+
+
+class PasswordHasher:
+    """
+    Servicio único de hashing de contraseñas de la aplicación.
+
+    - El primer esquema de `schemes` es el que se usa para los hashes nuevos;
+      el resto solo se aceptan al verificar y se marcan como obsoletos.
+    - `verify_and_update` devuelve un hash nuevo cuando el almacenado usa un
+      esquema obsoleto o parámetros distintos a los configurados (rehash en login).
+    - `dummy_verify` cuesta lo mismo que una verificación real, para que un
+      usuario inexistente no se distinga por el tiempo de respuesta. Su hash se
+      calcula una vez y bajo demanda (`dummy_hash`); la app lo prepara en segundo
+      plano al arrancar. Limitación aceptada: usa el esquema por defecto, así que
+      un usuario aún en bcrypt sigue distinguiéndose por tiempo hasta que su hash
+      se migra en el siguiente login correcto.
+    """
+
+    def __init__(
+        self,
+        schemes: List[str],
+        argon2_time_cost: int,
+        argon2_memory_cost: int,
+        argon2_parallelism: int,
+        bcrypt_rounds: int,
+    ):
+        self.schemes = schemes
+        self.context = CryptContext(
+            schemes=schemes,
+            default=schemes[0],
+            deprecated="auto",
+            argon2__type="ID",
+            argon2__time_cost=argon2_time_cost,
+            argon2__memory_cost=argon2_memory_cost,
+            argon2__parallelism=argon2_parallelism,
+            bcrypt__rounds=bcrypt_rounds,
+        )
+        self._dummy_hash: Optional[str] = None
+
+    def hash(self, password: str) -> str:
+        return self.context.hash(password)
+
+    def verify(self, password: str, hashed: str) -> bool:
+        return self.context.verify(password, hashed)
+
+    def needs_update(self, hashed: str) -> bool:
+        return self.context.needs_update(hashed)
+
+    def verify_and_update(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """Devuelve (válida, hash nuevo o None si el almacenado sigue vigente)."""
+        return self.context.verify_and_update(password, hashed)
+
+    @property
+    def dummy_hash(self) -> str:
+        """Hash de una contraseña aleatoria con los parámetros actuales (se calcula la primera vez)."""
+        if self._dummy_hash is None:
+            self._dummy_hash = self.hash(secrets.token_urlsafe(16))
+        return self._dummy_hash
+
+    @property
+    def dummy_ready(self) -> bool:
+        return self._dummy_hash is not None
+
+    def prepare_dummy_hash(self) -> None:
+        """Calcula `dummy_hash` por adelantado (arranque), fuera del primer login."""
+        self.dummy_hash
+
+    def dummy_verify(self, password: str) -> bool:
+        """Verificación de coste constante contra un hash con los parámetros actuales. Siempre False."""
+        self.context.verify(password, self.dummy_hash)
+        return False
+
+
+def build_password_hasher(**overrides: Any) -> PasswordHasher:
+    params: Dict[str, Any] = dict(
+        schemes=[s.strip() for s in settings.PASSWORD_SCHEMES.split(",") if s.strip()],
+        argon2_time_cost=settings.PASSWORD_ARGON2_TIME_COST,
+        argon2_memory_cost=settings.PASSWORD_ARGON2_MEMORY_COST,
+        argon2_parallelism=settings.PASSWORD_ARGON2_PARALLELISM,
+        bcrypt_rounds=settings.PASSWORD_BCRYPT_ROUNDS,
+    )
+    params.update(overrides)
+    return PasswordHasher(**params)
+
+
+# --- Instancia Singleton ---
+password_hasher = build_password_hasher()
+
+
+# --- Calibración (CLI) ---
+
+def _measure(hasher: PasswordHasher, samples: int) -> float:
+    """Mediana en ms de verificar un hash con los parámetros de `hasher`."""
+    hashed = hasher.hash("calibration-password")
+    timings = []
+    for _ in range(samples):
+        t0 = time.perf_counter()
+        hasher.verify("calibration-password", hashed)
+        timings.append((time.perf_counter() - t0) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+
+def calibrate_argon2(target_ms: float, memory_cost: int, parallelism: int, samples: int = 3) -> Tuple[int, float]:
+    """Mayor time_cost cuyo coste no supera `target_ms` con la memoria dada."""
+    best = (1, 0.0)
+    for time_cost in range(1, 21):
+        hasher = build_password_hasher(
+            schemes=["argon2"], argon2_time_cost=time_cost,
+            argon2_memory_cost=memory_cost, argon2_parallelism=parallelism,
+        )
+        elapsed = _measure(hasher, samples)
+        if elapsed > target_ms and time_cost > 1:
+            break
+        best = (time_cost, elapsed)
+    return best
+
+
+def calibrate_bcrypt(target_ms: float, samples: int = 3) -> Tuple[int, float]:
+    """Mayor número de rondas bcrypt cuyo coste no supera `target_ms`."""
+    best = (4, 0.0)
+    for rounds in range(4, 19):
+        elapsed = _measure(build_password_hasher(schemes=["bcrypt"], bcrypt_rounds=rounds), samples)
+        if elapsed > target_ms and rounds > 4:
+            break
+        best = (rounds, elapsed)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Calibra los parámetros de hashing para una latencia objetivo en este hardware."
+    )
+    parser.add_argument("--target-ms", type=float, default=250.0, help="Latencia objetivo por verificación")
+    parser.add_argument("--memory-kib", type=int, default=settings.PASSWORD_ARGON2_MEMORY_COST, help="Memoria de argon2id")
+    parser.add_argument("--parallelism", type=int, default=settings.PASSWORD_ARGON2_PARALLELISM)
+    parser.add_argument("--samples", type=int, default=3)
+    args = parser.parse_args()
+
+    time_cost, argon2_ms = calibrate_argon2(args.target_ms, args.memory_kib, args.parallelism, args.samples)
+    rounds, bcrypt_ms = calibrate_bcrypt(args.target_ms, args.samples)
+    print(f"# argon2id: {argon2_ms:.1f} ms por verificación")
+    print(f"PASSWORD_ARGON2_TIME_COST={time_cost}")
+    print(f"PASSWORD_ARGON2_MEMORY_COST={args.memory_kib}")
+    print(f"PASSWORD_ARGON2_PARALLELISM={args.parallelism}")
+    print(f"# bcrypt: {bcrypt_ms:.1f} ms por verificación")
+    print(f"PASSWORD_BCRYPT_ROUNDS={rounds}")
@@ -0,0 +1,77 @@
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+
+from app.core.config import settings
+from app.services.crypto_engine import crypto_engine
+
+
+class PublicKeyCache:
+    """
+    Caché LRU de llaves públicas RSA ya parseadas.
+
+    Decodificar el PEM/DER cuesta más que el propio cifrado OAEP, así que las
+    rutas de creación y compartición reutilizan el objeto `RSAPublicKey`.
+    La clave es (user_id, huella SHA-256 del PEM): si el usuario rota su llave,
+    el PEM nuevo produce otra entrada y nunca se usa la llave antigua.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[uuid.UUID, str], RSAPublicKey]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def fingerprint(public_key_pem: str) -> str:
+        return hashlib.sha256(public_key_pem.encode()).hexdigest()
+
+    def get(self, user_id: uuid.UUID, public_key_pem: str) -> RSAPublicKey:
+        """Devuelve la llave pública del usuario, parseándola solo si no está en caché."""
+        key = (user_id, self.fingerprint(public_key_pem))
+        with self._lock:
+            public_key = self._entries.get(key)
+            if public_key is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return public_key
+            self.misses += 1
+
+        # El parseo se hace fuera del lock
+        public_key = crypto_engine.load_public_key_pem(public_key_pem)
+        if self.max_entries > 0:
+            with self._lock:
+                self._entries[key] = public_key
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return public_key
+
+    def invalidate_user(self, user_id: uuid.UUID) -> None:
+        """Debe llamarse cuando un usuario rota su par de llaves."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == user_id]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+
+# --- Instancia Singleton ---
+public_key_cache = PublicKeyCache(max_entries=settings.PUBLIC_KEY_CACHE_MAX_ENTRIES)
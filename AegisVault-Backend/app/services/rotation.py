@@ -0,0 +1,451 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db import models
+from app.db.session import SessionLocal
+from app.services.blob_store import discard_payload, load_payload, offload_payload
+from app.services.crypto_engine import WRAP_RSA_OAEP, crypto_engine
+from app.services.crypto_executor import CryptoPoolSaturated, crypto_executor
+from app.services.identity_cache import identity_cache
+from app.services.public_key_cache import public_key_cache
+from app.services.session_keys import UnlockedKeys, unlocked_key_cache
+
+logger = logging.getLogger(__name__)
+
+KIND_SECRET_KEY = "secret_key"
+KIND_USER_KEYPAIR = "user_keypair"
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_WAITING_CREDENTIALS = "waiting_credentials"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+ACTIVE_STATUSES = (STATUS_PENDING, STATUS_RUNNING, STATUS_WAITING_CREDENTIALS)
+
+STAGE_GRANTS = "grants"
+STAGE_VERSIONS = "versions"
+STAGE_FINALIZE = "finalize"
+
+
+class SecretKeyMaterial:
+    """Llaves AES anterior y nueva de un secreto en rotación (solo en memoria)."""
+    __slots__ = ("old_key", "new_key")
+
+    def __init__(self, old_key: bytes, new_key: bytes):
+        self.old_key = old_key
+        self.new_key = new_key
+
+
+class KeypairMaterial:
+    """Material del usuario en rotación de su par RSA: llaves actuales y la privada nueva."""
+    __slots__ = ("old_keys", "new_private_key")
+
+    def __init__(self, old_keys: UnlockedKeys, new_private_key: RSAPrivateKey):
+        self.old_keys = old_keys
+        self.new_private_key = new_private_key
+
+
+async def active_rotation_targets(db: AsyncSession, target_ids: Iterable[uuid.UUID]) -> Set[uuid.UUID]:
+    """Ids (secretos o usuarios) de `target_ids` con un trabajo de rotación sin terminar."""
+    target_ids = list(target_ids)
+    if not target_ids:
+        return set()
+    result = await db.execute(select(models.RotationJob.target_id).where(
+        models.RotationJob.target_id.in_(target_ids),
+        models.RotationJob.status.in_(ACTIVE_STATUSES)
+    ))
+    return set(result.scalars().all())
+
+
+class RotationRunner:
+    """
+    Ejecuta en segundo plano los trabajos de rotación de llaves.
+
+    - Recorre las filas afectadas en lotes de `batch_size` por keyset (id > cursor)
+      y confirma cada lote junto con el progreso del trabajo: un reinicio retoma
+      desde el último lote confirmado.
+    - Entre lotes cede `batch_pause` segundos y, si el pool criptográfico está
+      saturado, espera y repite el lote: la rotación nunca compite con las
+      peticiones interactivas.
+    - Las llaves en claro solo viven en memoria. Tras un reinicio los trabajos
+      quedan en "waiting_credentials" hasta que su dueño los reanuda. Con varios
+      workers cada uno solo libera los suyos al parar; al arrancar solo se
+      recuperan los trabajos sin progreso reciente.
+    """
+
+    def __init__(self, batch_size: int, batch_pause: float, max_active_jobs: int, stale_after: float):
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.max_active_jobs = max_active_jobs
+        self.stale_after = stale_after
+        self._semaphore = asyncio.Semaphore(max_active_jobs)
+        self._tasks: Dict[uuid.UUID, asyncio.Task] = {}
+        self._recovery: Optional[asyncio.Task] = None
+        # Métricas
+        self.rows_processed = 0
+        self.batches = 0
+        self.throttled = 0
+        self.completed = 0
+        self.failed = 0
+        self._busy_seconds = 0.0
+
+    # --- Ciclo de vida ---
+
+    def start(self) -> None:
+        """
+        Recupera en segundo plano los trabajos abandonados: el arranque no espera a
+        la base de datos (que se conecta en la primera consulta).
+        """
+        if self._recovery is None or self._recovery.done():
+            self._recovery = asyncio.create_task(self._recover_stale(), name="rotation-recovery")
+
+    async def _recover_stale(self) -> None:
+        """
+        Los trabajos a medias sin progreso en `stale_after` segundos perdieron su
+        material (su proceso murió): pasan a esperar credenciales. Los recientes
+        pueden pertenecer a otro worker vivo y no se tocan.
+        """
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.stale_after)
+        try:
+            async with SessionLocal() as session:
+                result = await session.execute(update(models.RotationJob).where(
+                    models.RotationJob.status.in_((STATUS_PENDING, STATUS_RUNNING)),
+                    func.coalesce(models.RotationJob.updated_at, models.RotationJob.created_at) < cutoff,
+                ).values(status=STATUS_WAITING_CREDENTIALS, updated_at=func.now()))
+                await session.commit()
+            if result.rowcount:
+                logger.info("%d trabajos de rotación abandonados pasan a esperar credenciales", result.rowcount)
+        except Exception:
+            logger.exception("No se pudieron recuperar los trabajos de rotación abandonados")
+
+    async def stop(self) -> None:
+        """Cancela los trabajos de este proceso y los deja esperando credenciales."""
+        if self._recovery is not None:
+            self._recovery.cancel()
+        own_jobs = list(self._tasks)
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        if not own_jobs:
+            return
+        async with SessionLocal() as session:
+            await session.execute(update(models.RotationJob).where(
+                models.RotationJob.id.in_(own_jobs),
+                models.RotationJob.status.in_((STATUS_PENDING, STATUS_RUNNING)),
+            ).values(status=STATUS_WAITING_CREDENTIALS, updated_at=func.now()))
+            await session.commit()
+
+    def is_running(self, job_id: uuid.UUID) -> bool:
+        return job_id in self._tasks
+
+    def submit(self, job_id: uuid.UUID, material: Any) -> None:
+        """Lanza (o reanuda) un trabajo ya persistido en estado "pending"."""
+        if job_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(job_id, material), name=f"rotation-{job_id}")
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    # --- Ejecución ---
+
+    async def _run(self, job_id: uuid.UUID, material: Any) -> None:
+        async with self._semaphore:
+            try:
+                async with SessionLocal() as session:
+                    await session.execute(update(models.RotationJob).where(models.RotationJob.id == job_id).values(
+                        status=STATUS_RUNNING, error=None,
+                        started_at=func.coalesce(models.RotationJob.started_at, func.now()), updated_at=func.now()
+                    ))
+                    await session.commit()
+                    job = await session.get(models.RotationJob, job_id)
+                if job.kind == KIND_SECRET_KEY:
+                    await self._rotate_secret_key(job, material)
+                else:
+                    await self._rotate_keypair(job, material)
+                self.completed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += 1
+                logger.exception("Falló el trabajo de rotación %s", job_id)
+                async with SessionLocal() as session:
+                    await session.execute(update(models.RotationJob).where(models.RotationJob.id == job_id).values(
+                        status=STATUS_FAILED, error=str(e)[:500], updated_at=func.now()
+                    ))
+                    await session.commit()
+
+    async def _crypto(self, label: str, fn) -> Any:
+        """CPU en el pool criptográfico; si está saturado, se espera en lugar de fallar."""
+        while True:
+            try:
+                return await crypto_executor.run_callable(label, fn)
+            except CryptoPoolSaturated as e:
+                self.throttled += 1
+                await asyncio.sleep(e.retry_after)
+
+    async def _batch_done(self, rows: int, started: float) -> None:
+        self.rows_processed += rows
+        self.batches += 1
+        self._busy_seconds += time.perf_counter() - started
+        await asyncio.sleep(self.batch_pause)
+
+    @staticmethod
+    def _progress(job: models.RotationJob, **values: Any):
+        return update(models.RotationJob).where(models.RotationJob.id == job.id).values(updated_at=func.now(), **values)
+
+    # --- Rotación de la llave AES de un secreto ---
+
+    async def _rotate_secret_key(self, job: models.RotationJob, material: SecretKeyMaterial) -> None:
+        if job.stage == STAGE_GRANTS:
+            await self._secret_grants(job, material)
+            job.stage, job.cursor = STAGE_VERSIONS, None
+        if job.stage == STAGE_VERSIONS:
+            await self._secret_versions(job, material)
+            job.stage = STAGE_FINALIZE
+        async with SessionLocal() as session:
+            # Un único commit activa la generación nueva y retira los accesos anteriores
+            await session.execute(update(models.Secret).where(models.Secret.id == job.target_id).values(key_generation=job.to_generation))
+            await session.execute(delete(models.SecretKey).where(
+                models.SecretKey.secret_id == job.target_id,
+                models.SecretKey.key_generation < job.to_generation
+            ))
+            await session.execute(self._progress(job, stage=STAGE_FINALIZE, status=STATUS_COMPLETED, cursor=None, finished_at=func.now()))
+            await session.commit()
+
+    async def _secret_grants(self, job: models.RotationJob, material: SecretKeyMaterial) -> None:
+        """Envuelve la llave nueva para cada receptor (el acceso del dueño se crea al iniciar el trabajo)."""
+        cursor = uuid.UUID(job.cursor) if job.cursor else None
+        while True:
+            started = time.perf_counter()
+            async with SessionLocal() as session:
+                query = select(models.SecretKey.id, models.SecretKey.user_id, models.User.public_key).join(
+                    models.User, models.User.id == models.SecretKey.user_id
+                ).where(
+                    models.SecretKey.secret_id == job.target_id,
+                    models.SecretKey.key_generation == job.from_generation,
+                    models.SecretKey.user_id != job.user_id
+                )
+                if cursor:
+                    query = query.where(models.SecretKey.id > cursor)
+                # FOR SHARE sobre los receptores: una rotación de su par RSA no cambia la llave pública a mitad del lote
+                query = query.order_by(models.SecretKey.id).limit(self.batch_size).with_for_update(read=True, of=models.User)
+                rows = (await session.execute(query)).all()
+                if not rows:
+                    return
+
+                def wrap_batch():
+                    return [{
+                        "id": uuid.uuid4(), "secret_id": job.target_id, "user_id": row.user_id,
+                        "key_generation": job.to_generation,
+                        "encrypted_aes_key": crypto_engine.wrap_aes_key(material.new_key, public_key_cache.get(row.user_id, row.public_key)),
+                    } for row in rows]
+
+                await session.execute(insert(models.SecretKey), await self._crypto("rotation_wrap", wrap_batch))
+                cursor = rows[-1].id
+                job.processed += len(rows)
+                await session.execute(self._progress(job, cursor=str(cursor), processed=job.processed))
+                await session.commit()
+            await self._batch_done(len(rows), started)
+
+    async def _secret_versions(self, job: models.RotationJob, material: SecretKeyMaterial) -> None:
+        """Re-cifra cada versión con la llave nueva. El lote se vacía solo: se eligen las que siguen en la generación anterior."""
+        while True:
+            started = time.perf_counter()
+            async with SessionLocal() as session:
+                result = await session.execute(select(models.SecretVersion).where(
+                    models.SecretVersion.secret_id == job.target_id,
+                    models.SecretVersion.key_generation == job.from_generation
+                ).order_by(models.SecretVersion.id).limit(self.batch_size))
+                versions = result.scalars().all()
+                if not versions:
+                    return
+
+                text_versions = [v for v in versions if v.chunk_count is None]
+                replaced_refs = {v.blob_ref for v in text_versions if v.blob_ref is not None}
+                payloads = await asyncio.gather(*(load_payload(v.encrypted_data, v.blob_ref) for v in text_versions))
+
+                def reencrypt_batch():
+                    out = []
+                    for version, ciphertext in zip(text_versions, payloads):
+                        plaintext = crypto_engine.decrypt_aes_gcm(
+                            {"ciphertext": ciphertext, "nonce": version.nonce_iv, "tag": version.auth_tag}, material.old_key
+                        )
+                        out.append(crypto_engine.encrypt_aes_gcm(plaintext, material.new_key))
+                    return out
+
+                for version, enc in zip(text_versions, await self._crypto("rotation_reencrypt", reencrypt_batch)):
+                    version.encrypted_data, version.nonce_iv, version.auth_tag = enc["ciphertext"], enc["nonce"], enc["tag"]
+                    version.blob_ref = None
+                    await offload_payload(version)
+                    version.key_generation = job.to_generation
+                for version in versions:
+                    if version.chunk_count is not None:
+                        await self._reencrypt_chunks(session, version, material, job.to_generation)
+
+                job.processed += len(versions)
+                await session.execute(self._progress(job, processed=job.processed))
+                # Un commit por lote: cada versión queda entera en una generación u otra
+                await session.commit()
+                await self._discard_blobs(session, replaced_refs)
+            await self._batch_done(len(versions), started)
+
+    async def _discard_blobs(self, session: AsyncSession, refs: Set[str]) -> None:
+        """Borra los blobs del ciphertext anterior que ya no referencia ninguna versión (tras el commit)."""
+        if not refs:
+            return
+        result = await session.execute(
+            select(models.SecretVersion.blob_ref).where(models.SecretVersion.blob_ref.in_(refs)).distinct()
+        )
+        for ref in refs - set(result.scalars().all()):
+            try:
+                await discard_payload(ref)
+            except Exception:
+                # Un blob huérfano solo ocupa espacio: no debe detener la rotación
+                logger.warning("No se pudo borrar el blob %s", ref, exc_info=True)
+
+    async def _reencrypt_chunks(
+        self, session: AsyncSession, version: models.SecretVersion, material: SecretKeyMaterial, to_generation: int
+    ) -> None:
+        """Re-cifra los bloques de una versión binaria con una base de nonce nueva (UPDATE por clave primaria)."""
+        old_nonce, new_nonce = version.nonce_iv, crypto_engine.generate_base_nonce()
+        context = version.id.bytes
+        batch = settings.SECRET_CHUNK_INSERT_BATCH
+        for start in range(0, version.chunk_count, batch):
+            result = await session.execute(select(models.SecretChunk.chunk_index, models.SecretChunk.data).where(
+                models.SecretChunk.version_id == version.id,
+                models.SecretChunk.chunk_index >= start,
+                models.SecretChunk.chunk_index < start + batch
+            ).order_by(models.SecretChunk.chunk_index))
+            chunks = result.all()
+
+            def reencrypt_chunks():
+                rows = []
+                for index, data in chunks:
+                    final = index == version.chunk_count - 1
+                    plaintext = crypto_engine.decrypt_chunk(material.old_key, old_nonce, index, data, final, context)
+                    rows.append({
+                        "version_id": version.id, "chunk_index": index,
+                        "data": crypto_engine.encrypt_chunk(material.new_key, new_nonce, index, plaintext, final, context),
+                    })
+                return rows
+
+            rows = await self._crypto("rotation_reencrypt", reencrypt_chunks)
+            if rows:
+                await session.execute(update(models.SecretChunk), rows)
+        version.nonce_iv, version.key_generation = new_nonce, to_generation
+
+    # --- Rotación del par RSA de un usuario ---
+
+    async def _rotate_keypair(self, job: models.RotationJob, material: KeypairMaterial) -> None:
+        new_public_key = crypto_engine.load_public_key_pem(job.new_public_key)
+        if job.stage == STAGE_GRANTS:
+            cursor = uuid.UUID(job.cursor) if job.cursor else None
+            while True:
+                started = time.perf_counter()
+                async with SessionLocal() as session:
+                    rewrapped = await self._rewrap_grants(session, job, material, new_public_key, cursor)
+                    if not rewrapped:
+                        break
+                    cursor = rewrapped[-1]["id"]
+                    job.processed += len(rewrapped)
+                    await session.execute(self._progress(job, cursor=str(cursor), processed=job.processed))
+                    await session.commit()
+                await self._batch_done(len(rewrapped), started)
+            job.stage = STAGE_FINALIZE
+
+        async with SessionLocal() as session:
+            user = (await session.execute(
+                select(models.User).where(models.User.id == job.target_id).with_for_update()
+            )).scalars().one()
+            # Accesos concedidos con la llave pública anterior después de pasar el cursor
+            while True:
+                rewrapped = await self._rewrap_grants(session, job, material, new_public_key, None, only_pending=True)
+                if not rewrapped:
+                    break
+            if user.encrypted_kek is not None:
+                kek = await crypto_engine.aunwrap_aes_key(user.encrypted_kek, material.old_keys.private_key)
+                user.encrypted_kek = await crypto_engine.awrap_aes_key(kek, new_public_key)
+            user.public_key = job.new_public_key
+            user.encrypted_private_key = job.new_encrypted_private_key
+            await session.execute(update(models.SecretKey).where(
+                models.SecretKey.user_id == job.target_id,
+                models.SecretKey.rewrapped_aes_key.is_not(None)
+            ).values(encrypted_aes_key=models.SecretKey.rewrapped_aes_key, rewrapped_aes_key=None, wrap_alg=WRAP_RSA_OAEP))
+            await session.execute(self._progress(
+                job, stage=STAGE_FINALIZE, status=STATUS_COMPLETED, cursor=None,
+                new_encrypted_private_key=None, finished_at=func.now()
+            ))
+            await session.commit()
+
+        identity_cache.invalidate_user(job.target_id)
+        public_key_cache.invalidate_user(job.target_id)
+        await unlocked_key_cache.rekey_user(job.target_id, material.new_private_key)
+
+    async def _rewrap_grants(
+        self,
+        session: AsyncSession,
+        job: models.RotationJob,
+        material: KeypairMaterial,
+        new_public_key: Any,
+        cursor: Optional[uuid.UUID],
+        only_pending: bool = False,
+    ) -> List[Dict[str, Any]]:
+        """Deja en `rewrapped_aes_key` la llave AES de cada acceso RSA envuelta con la llave pública nueva."""
+        query = select(models.SecretKey.id, models.SecretKey.encrypted_aes_key).where(
+            models.SecretKey.user_id == job.target_id,
+            models.SecretKey.wrap_alg == WRAP_RSA_OAEP
+        )
+        if cursor:
+            query = query.where(models.SecretKey.id > cursor)
+        if only_pending:
+            query = query.where(models.SecretKey.rewrapped_aes_key.is_(None))
+        rows = (await session.execute(query.order_by(models.SecretKey.id).limit(self.batch_size))).all()
+        if not rows:
+            return []
+
+        def rewrap_batch():
+            return [{
+                "id": row.id,
+                "rewrapped_aes_key": crypto_engine.wrap_aes_key(
+                    crypto_engine.unwrap_aes_key(row.encrypted_aes_key, material.old_keys.private_key), new_public_key
+                ),
+            } for row in rows]
+
+        rewrapped = await self._crypto("rotation_rewrap", rewrap_batch)
+        await session.execute(update(models.SecretKey), rewrapped)
+        return rewrapped
+
+    # --- Observabilidad ---
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active_jobs": len(self._tasks),
+            "max_active_jobs": self.max_active_jobs,
+            "batch_size": self.batch_size,
+            "rows_processed": self.rows_processed,
+            "batches": self.batches,
+            "throttled": self.throttled,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rows_per_second": round(self.rows_processed / self._busy_seconds, 1) if self._busy_seconds else 0.0,
+        }
+
+
+# --- Instancia Singleton ---
+rotation_runner = RotationRunner(
+    batch_size=settings.ROTATION_BATCH_SIZE,
+    batch_pause=settings.ROTATION_BATCH_PAUSE_SECONDS,
+    max_active_jobs=settings.ROTATION_MAX_ACTIVE_JOBS,
+    stale_after=settings.ROTATION_STALE_SECONDS,
+)
@@ -0,0 +1,284 @@
+import hashlib
+import logging
+import secrets
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db import models
+from app.db.session import SessionLocal
+from app.services.change_feed import change_feed
+from app.services.crypto_engine import WRAP_AES_KW, WRAP_RSA_OAEP, crypto_engine
+from app.services.crypto_executor import crypto_executor
+
+logger = logging.getLogger(__name__)
+
+# Canal de LISTEN/NOTIFY para revocar sesiones en todos los workers:
+# "t:<hash del token>" (una sesión) o "u:<id de usuario>" (todas las del usuario)
+UNLOCK_CHANNEL = "aegisvault_unlock"
+
+
+class UnlockedKeys:
+    """
+    Material desbloqueado de un usuario: su llave privada RSA y, si la tiene, su KEK.
+    Sabe desenvolver un SecretKey según su `wrap_alg` y envolver llaves para el
+    propio usuario con AES-KW (sin operación RSA en las lecturas siguientes).
+    """
+    __slots__ = ("private_key", "kek")
+
+    def __init__(self, private_key: RSAPrivateKey, kek: Optional[bytes] = None):
+        self.private_key = private_key
+        self.kek = kek
+
+    def unwrap(self, wrapped_key: bytes, wrap_alg: str) -> bytes:
+        """Versión síncrona (para lotes que ya corren en el pool criptográfico)."""
+        if wrap_alg == WRAP_AES_KW:
+            if self.kek is None:
+                raise ValueError("Acceso envuelto con la KEK pero la KEK no está desbloqueada")
+            return crypto_engine.unwrap_key_kw(self.kek, wrapped_key)
+        return crypto_engine.unwrap_aes_key(wrapped_key, self.private_key)
+
+    async def aunwrap(self, wrapped_key: bytes, wrap_alg: str) -> bytes:
+        # AES-KW cuesta microsegundos: solo RSA-OAEP va al pool criptográfico
+        if wrap_alg == WRAP_AES_KW:
+            return self.unwrap(wrapped_key, wrap_alg)
+        return await crypto_engine.aunwrap_aes_key(wrapped_key, self.private_key)
+
+    def rewrap_for_self(self, aes_key: bytes, wrap_alg: str) -> Optional[bytes]:
+        """
+        Conversión perezosa: si el acceso propio sigue en RSA-OAEP y hay KEK,
+        devuelve la llave envuelta con AES-KW para guardarla; si no, None.
+        """
+        if wrap_alg != WRAP_RSA_OAEP or self.kek is None or not settings.USER_KEK_ENABLED:
+            return None
+        return crypto_engine.wrap_key_kw(self.kek, aes_key)
+
+
+class UnlockedKeyCache:
+    """
+    Sesiones de desbloqueo (/api/auth/unlock) compartidas entre workers y réplicas.
+
+    - La fila `unlock_sessions` guarda el hash del token y la llave privada y la
+      KEK selladas con una llave derivada del propio token: cualquier worker que
+      reciba el token puede abrirla, y la base de datos sola no descifra nada.
+    - Cada worker mantiene además una caché LRU local del material ya abierto
+      (`RSAPrivateKey` cargada y KEK), así que solo la primera petición de un token
+      en cada worker consulta la base de datos.
+    - Revocar (/lock, /logout) o rotar el par borra o re-sella las filas y avisa
+      por NOTIFY en `UNLOCK_CHANNEL` para que el resto de workers descarte su copia.
+      Sin LISTEN activo sobre Postgres, cada acierto local se comprueba contra la fila.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # hash del token -> (token, user_id, material desbloqueado, instante de expiración)
+        self._entries: "OrderedDict[str, Tuple[str, uuid.UUID, UnlockedKeys, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._postgres = make_url(settings.DATABASE_URL).get_backend_name() == "postgresql"
+        # Métricas
+        self.hits = 0
+        self.loads = 0
+        self.revoked_remote = 0
+        change_feed.subscribe(UNLOCK_CHANNEL, self._on_notify, self.clear_local)
+
+    @staticmethod
+    def token_hash(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    # --- Caché local ---
+
+    def _remember(self, token: str, user_id: uuid.UUID, keys: UnlockedKeys, expires_at: float) -> None:
+        with self._lock:
+            self._entries[self.token_hash(token)] = (token, user_id, keys, expires_at)
+            self._purge_expired_locked()
+            # Si superamos el límite descartamos las entradas menos usadas (siguen en la base de datos)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _forget(self, token_hash: Optional[str] = None, user_id: Optional[uuid.UUID] = None) -> int:
+        with self._lock:
+            doomed = [h for h, entry in self._entries.items() if h == token_hash or entry[1] == user_id]
+            for h in doomed:
+                del self._entries[h]
+            return len(doomed)
+
+    def clear_local(self) -> None:
+        """Vacía la caché local (tras reconectar el LISTEN: pudo perderse una revocación)."""
+        with self._lock:
+            self._entries.clear()
+
+    def _on_notify(self, payload: str) -> None:
+        kind, _, value = payload.partition(":")
+        if kind == "t":
+            self.revoked_remote += self._forget(token_hash=value)
+        elif kind == "u":
+            self.revoked_remote += self._forget(user_id=uuid.UUID(value))
+
+    async def _notify(self, session: AsyncSession, payload: str) -> None:
+        # Se entrega al confirmar la transacción (también a este mismo worker)
+        if self._postgres:
+            await session.execute(select(func.pg_notify(UNLOCK_CHANNEL, payload)))
+
+    # --- API ---
+
+    async def put(self, user_id: uuid.UUID, keys: UnlockedKeys) -> str:
+        """Guarda una llave desbloqueada y devuelve el token que la identifica."""
+        token = secrets.token_urlsafe(32)
+        sealed = await crypto_executor.run_callable(
+            "seal_unlocked_keys", crypto_engine.seal_unlocked_keys, token, user_id.bytes, keys.private_key, keys.kek
+        )
+        now = datetime.now(timezone.utc)
+        async with SessionLocal() as session:
+            # Limpieza oportunista de sesiones caducadas (índice por expires_at)
+            await session.execute(delete(models.UnlockSession).where(models.UnlockSession.expires_at <= now))
+            await session.execute(insert(models.UnlockSession).values(
+                token_hash=self.token_hash(token), user_id=user_id, sealed_keys=sealed,
+                expires_at=now + timedelta(seconds=self.ttl_seconds)
+            ))
+            await session.commit()
+        self._remember(token, user_id, keys, time.monotonic() + self.ttl_seconds)
+        return token
+
+    async def get(self, token: str, user_id: uuid.UUID) -> Optional[UnlockedKeys]:
+        """
+        Devuelve la llave asociada al token si sigue vigente y pertenece al usuario.
+        Un token de otro usuario se trata igual que uno inexistente.
+        """
+        token_hash = self.token_hash(token)
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry is not None and entry[3] <= time.monotonic():
+                del self._entries[token_hash]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(token_hash)
+        if entry is not None:
+            if entry[1] != user_id:
+                return None
+            if self._postgres and not change_feed.listening and not await self._exists(token_hash):
+                # Sin LISTEN no llegan las revocaciones de otros workers: manda la fila
+                self._forget(token_hash=token_hash)
+                return None
+            self.hits += 1
+            return entry[2]
+
+        now = datetime.now(timezone.utc)
+        async with SessionLocal() as session:
+            row = (await session.execute(select(models.UnlockSession.sealed_keys, models.UnlockSession.expires_at).where(
+                models.UnlockSession.token_hash == token_hash,
+                models.UnlockSession.user_id == user_id,
+                models.UnlockSession.expires_at > now
+            ))).first()
+        if row is None:
+            return None
+        try:
+            private_key, kek = await crypto_executor.run_callable(
+                "unseal_unlocked_keys", crypto_engine.unseal_unlocked_keys, token, user_id.bytes, row.sealed_keys
+            )
+        except Exception:
+            logger.warning("Sesión de desbloqueo ilegible", exc_info=True)
+            return None
+        keys = UnlockedKeys(private_key, kek)
+        expires_at = row.expires_at if row.expires_at.tzinfo else row.expires_at.replace(tzinfo=timezone.utc)
+        self._remember(token, user_id, keys, time.monotonic() + (expires_at - now).total_seconds())
+        self.loads += 1
+        return keys
+
+    async def _exists(self, token_hash: str) -> bool:
+        async with SessionLocal() as session:
+            result = await session.execute(
+                select(models.UnlockSession.token_hash).where(models.UnlockSession.token_hash == token_hash)
+            )
+            return result.first() is not None
+
+    async def revoke(self, token: str, user_id: uuid.UUID) -> bool:
+        """Elimina una sesión concreta del usuario (bloqueo explícito) en todos los workers."""
+        token_hash = self.token_hash(token)
+        async with SessionLocal() as session:
+            result = await session.execute(delete(models.UnlockSession).where(
+                models.UnlockSession.token_hash == token_hash, models.UnlockSession.user_id == user_id
+            ))
+            if not result.rowcount:
+                return False
+            await self._notify(session, f"t:{token_hash}")
+            await session.commit()
+        self._forget(token_hash=token_hash)
+        return True
+
+    async def revoke_user(self, user_id: uuid.UUID) -> int:
+        """Elimina todas las llaves desbloqueadas de un usuario (logout) en todos los workers."""
+        async with SessionLocal() as session:
+            result = await session.execute(delete(models.UnlockSession).where(models.UnlockSession.user_id == user_id))
+            await self._notify(session, f"u:{user_id}")
+            await session.commit()
+        self._forget(user_id=user_id)
+        return result.rowcount or 0
+
+    async def rekey_user(self, user_id: uuid.UUID, private_key: RSAPrivateKey) -> int:
+        """
+        Tras rotar el par RSA: las sesiones del usuario que conoce este worker se
+        re-sellan con la llave privada nueva; el resto no puede re-sellarse sin su
+        token y se revocan (el cliente vuelve a /unlock). Devuelve las re-selladas.
+        """
+        with self._lock:
+            known: List[Tuple[str, str, UnlockedKeys]] = [
+                (h, entry[0], entry[2]) for h, entry in self._entries.items() if entry[1] == user_id
+            ]
+
+        def reseal() -> List[Dict[str, Any]]:
+            return [{
+                "token_hash": h,
+                "sealed_keys": crypto_engine.seal_unlocked_keys(token, user_id.bytes, private_key, keys.kek),
+            } for h, token, keys in known]
+
+        rows = await crypto_executor.run_callable("seal_unlocked_keys", reseal) if known else []
+        async with SessionLocal() as session:
+            stale = delete(models.UnlockSession).where(models.UnlockSession.user_id == user_id)
+            if rows:
+                await session.execute(update(models.UnlockSession), rows)
+                stale = stale.where(models.UnlockSession.token_hash.not_in([row["token_hash"] for row in rows]))
+            await session.execute(stale)
+            await self._notify(session, f"u:{user_id}")
+            await session.commit()
+        for _, _, keys in known:
+            keys.private_key = private_key
+        return len(rows)
+
+    def purge_expired(self) -> None:
+        with self._lock:
+            self._purge_expired_locked()
+
+    def _purge_expired_locked(self) -> None:
+        now = time.monotonic()
+        expired = [h for h, entry in self._entries.items() if entry[3] <= now]
+        for h in expired:
+            del self._entries[h]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "local_entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "loads": self.loads,
+            "revoked_remote": self.revoked_remote,
+        }
+
+
+# --- Instancia Singleton ---
+unlocked_key_cache = UnlockedKeyCache(
+    max_entries=settings.UNLOCK_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.UNLOCK_TTL_SECONDS,
+)
@@ -0,0 +1,409 @@
+import abc
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Acciones limitadas: cada una tiene sus propios buckets y contadores de fallos
+ACTION_LOGIN = "login"
+ACTION_KDF = "kdf"
+
+
+class Throttled(Exception):
+    """
+    Se lanza cuando un usuario o una IP superan su cuota o están en backoff.
+    La API la traduce a un 429 con cabecera Retry-After.
+    """
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f"Demasiados intentos ({scope})")
+        self.scope = scope
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+def backoff_seconds(failures: int, free: int, base: float, cap: float) -> float:
+    """Bloqueo tras el fallo número `failures`: 0 los primeros `free`, luego base * 2^n hasta `cap`."""
+    if failures <= free:
+        return 0.0
+    return min(cap, base * 2 ** (failures - free - 1))
+
+
+class _Entry:
+    """Estado de una clave: token bucket y fallos recientes."""
+    __slots__ = ("tokens", "stamp", "failures", "last_failure", "blocked_until")
+
+    def __init__(self, stamp: float):
+        # Bucket lleno (se recorta a la ráfaga de la acción al consumir)
+        self.tokens = math.inf
+        self.stamp = stamp
+        self.failures = 0
+        self.last_failure = 0.0
+        self.blocked_until = 0.0
+
+
+class ThrottleStore(abc.ABC):
+    """
+    Estado de los limitadores. Las operaciones son atómicas por clave:
+    `acquire` consume un token (o devuelve la espera), `fail` suma un fallo y
+    devuelve el bloqueo resultante, `clear` olvida los fallos.
+    """
+    name = "base"
+
+    @abc.abstractmethod
+    async def acquire(self, key: str, rate: float, burst: int) -> float:
+        ...
+
+    @abc.abstractmethod
+    async def fail(self, key: str, free: int, base: float, cap: float, window: float) -> float:
+        ...
+
+    @abc.abstractmethod
+    async def clear(self, key: str) -> None:
+        ...
+
+    def sweep(self) -> int:
+        return 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class MemoryThrottleStore(ThrottleStore):
+    """
+    Estado en un dict del proceso (una entrada con __slots__ por clave). Sin
+    locks: solo se usa desde el event loop. Al llegar a `max_entries` se barren
+    las claves inactivas; si no hay ninguna se descarta la más antigua que no
+    esté bloqueada (antes las que no tienen fallos). Las bloqueadas nunca se
+    descartan: si todas lo están, `acquire` rechaza la clave nueva (Throttled)
+    y `fail` no registra el fallo, para no cambiar la respuesta del intento.
+    """
+    name = "memory"
+
+    def __init__(self, max_entries: int, idle_seconds: float):
+        self.max_entries = max_entries
+        self.idle_seconds = idle_seconds
+        self._entries: Dict[str, _Entry] = {}
+        self.evicted = 0
+        self.rejected = 0
+        self.dropped_failures = 0
+
+    def _entry(self, key: str, now: float) -> _Entry:
+        entry = self._entries.get(key)
+        if entry is None:
+            if len(self._entries) >= self.max_entries and not self.sweep():
+                self._evict(now)
+            entry = self._entries[key] = _Entry(now)
+        return entry
+
+    def _evict(self, now: float) -> None:
+        """
+        Inundación de claves nuevas: hace sitio descartando la entrada más antigua
+        sin bloqueo, preferentemente sin fallos (descartar una con fallos reinicia
+        su cuenta hacia el backoff). Si todas están bloqueadas, falla cerrado.
+        """
+        candidate = None
+        for key, entry in self._entries.items():
+            if entry.blocked_until > now:
+                continue
+            if entry.failures == 0:
+                candidate = key
+                break
+            if candidate is None:
+                candidate = key
+        if candidate is None:
+            raise Throttled("capacity", min(entry.blocked_until for entry in self._entries.values()) - now)
+        del self._entries[candidate]
+        self.evicted += 1
+
+    async def acquire(self, key: str, rate: float, burst: int) -> float:
+        now = time.monotonic()
+        try:
+            entry = self._entry(key, now)
+        except Throttled:
+            self.rejected += 1
+            raise
+        if entry.blocked_until > now:
+            return entry.blocked_until - now
+        entry.tokens = min(float(burst), entry.tokens + (now - entry.stamp) * rate)
+        entry.stamp = now
+        if entry.tokens >= 1:
+            entry.tokens -= 1
+            return 0.0
+        return (1 - entry.tokens) / rate
+
+    async def fail(self, key: str, free: int, base: float, cap: float, window: float) -> float:
+        now = time.monotonic()
+        try:
+            entry = self._entry(key, now)
+        except Throttled:
+            # Sin sitio: el intento ya se ha resuelto (401), no se convierte en 429
+            self.dropped_failures += 1
+            if self.dropped_failures % 100 == 1:
+                logger.warning("Limitador lleno de claves bloqueadas; fallo de %s sin registrar", key)
+            return 0.0
+        if now - entry.last_failure > window:
+            entry.failures = 0
+        entry.failures += 1
+        entry.last_failure = now
+        blocked = backoff_seconds(entry.failures, free, base, cap)
+        if blocked:
+            entry.blocked_until = now + blocked
+        return blocked
+
+    async def clear(self, key: str) -> None:
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.failures = 0
+            entry.blocked_until = 0.0
+
+    def sweep(self) -> int:
+        """Elimina las claves sin actividad en `idle_seconds` (bucket lleno y fallos caducados)."""
+        now = time.monotonic()
+        idle = [
+            key for key, entry in self._entries.items()
+            if now - max(entry.stamp, entry.last_failure) > self.idle_seconds and entry.blocked_until <= now
+        ]
+        for key in idle:
+            del self._entries[key]
+        return len(idle)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.name, "entries": len(self._entries), "evicted": self.evicted,
+            "rejected": self.rejected, "dropped_failures": self.dropped_failures,
+        }
+
+
+# Token bucket en un hash de Redis (t: tokens, s: marca, b: bloqueado hasta); los
+# números vuelven como texto porque Redis trunca los de Lua a enteros.
+_ACQUIRE_LUA = """
+local now = tonumber(ARGV[3])
+local v = redis.call('HMGET', KEYS[1], 't', 's', 'b')
+local blocked = tonumber(v[3]) or 0
+if blocked > now then return tostring(blocked - now) end
+local rate, burst = tonumber(ARGV[1]), tonumber(ARGV[2])
+local t = tonumber(v[1]) or burst
+local s = tonumber(v[2]) or now
+t = math.min(burst, t + (now - s) * rate)
+local wait = 0
+if t >= 1 then t = t - 1 else wait = (1 - t) / rate end
+redis.call('HSET', KEYS[1], 't', tostring(t), 's', tostring(now))
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+return tostring(wait)
+"""
+
+# Fallos (f: número, l: último) y bloqueo exponencial, como backoff_seconds
+_FAIL_LUA = """
+local free, base, cap = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local window, now = tonumber(ARGV[4]), tonumber(ARGV[5])
+local v = redis.call('HMGET', KEYS[1], 'f', 'l')
+local f = tonumber(v[1]) or 0
+if now - (tonumber(v[2]) or 0) > window then f = 0 end
+f = f + 1
+local blocked = 0
+if f > free then
+  blocked = math.min(cap, base * 2 ^ (f - free - 1))
+  redis.call('HSET', KEYS[1], 'b', tostring(now + blocked))
+end
+redis.call('HSET', KEYS[1], 'f', f, 'l', tostring(now))
+redis.call('PEXPIRE', KEYS[1], ARGV[6])
+return tostring(blocked)
+"""
+
+
+class RedisThrottleStore(ThrottleStore):
+    """
+    Estado compartido entre workers y réplicas en Redis: un hash por clave
+    actualizado con scripts Lua (atómicos) y caducado con PEXPIRE, sin barrido.
+    Si Redis no responde se usa el almacén local: la limitación sigue activa,
+    aunque solo por proceso, en lugar de dejar pasar todo o rechazarlo todo.
+    """
+    name = "redis"
+
+    def __init__(self, client: Any, fallback: MemoryThrottleStore, idle_seconds: float, prefix: str = "throttle:"):
+        self.client = client
+        self.fallback = fallback
+        self.prefix = prefix
+        self.ttl_ms = int(idle_seconds * 1000)
+        self._acquire = client.register_script(_ACQUIRE_LUA)
+        self._fail = client.register_script(_FAIL_LUA)
+        self.errors = 0
+
+    async def acquire(self, key: str, rate: float, burst: int) -> float:
+        try:
+            return float(await self._acquire(keys=[self.prefix + key], args=[rate, burst, time.time(), self.ttl_ms]))
+        except Exception:
+            self._failed()
+            return await self.fallback.acquire(key, rate, burst)
+
+    async def fail(self, key: str, free: int, base: float, cap: float, window: float) -> float:
+        try:
+            return float(await self._fail(keys=[self.prefix + key], args=[free, base, cap, window, time.time(), self.ttl_ms]))
+        except Exception:
+            self._failed()
+            return await self.fallback.fail(key, free, base, cap, window)
+
+    async def clear(self, key: str) -> None:
+        try:
+            await self.client.hdel(self.prefix + key, "f", "l", "b")
+        except Exception:
+            self._failed()
+        await self.fallback.clear(key)
+
+    def _failed(self) -> None:
+        if self.errors % 100 == 0:
+            logger.warning("Redis de limitación no disponible; se usa el estado local", exc_info=True)
+        self.errors += 1
+
+    def sweep(self) -> int:
+        return self.fallback.sweep()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "errors": self.errors, "fallback_entries": self.fallback.stats()["entries"]}
+
+
+class Throttle:
+    """
+    Limitador delante de las operaciones que cuestan un KDF (login y desbloqueo
+    de la llave privada con contraseña).
+
+    - Token bucket por IP y por usuario para cada acción: una IP no puede repartir
+      intentos entre muchas cuentas ni una cuenta recibirlos desde muchas IPs.
+    - Backoff exponencial por usuario y por IP tras THROTTLE_FREE_FAILURES fallos:
+      mientras dura el bloqueo se rechaza antes de gastar CPU en el KDF.
+    - Un acierto olvida los fallos del usuario (no los de la IP).
+    """
+
+    def __init__(
+        self,
+        store: ThrottleStore,
+        enabled: bool,
+        user_rate: float,
+        user_burst: int,
+        ip_rate: float,
+        ip_burst: int,
+        free_failures: int,
+        backoff_base: float,
+        backoff_max: float,
+        failure_window: float,
+        sweep_interval: float,
+    ):
+        self.store = store
+        self.enabled = enabled
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.free_failures = free_failures
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_window = failure_window
+        self.sweep_interval = sweep_interval
+        self._sweeper: Optional[asyncio.Task] = None
+        # Métricas
+        self.allowed = 0
+        self.throttled = 0
+        self.failures = 0
+        self.swept = 0
+
+    # --- Ciclo de vida ---
+
+    def start(self) -> None:
+        if self.enabled and self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop(), name="throttle-sweep")
+
+    async def stop(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.swept += self.store.sweep()
+
+    # --- Limitación ---
+
+    async def check(self, action: str, user: str, ip_address: Optional[str]) -> None:
+        """Consume un intento de `user` y de su IP; lanza Throttled si no quedan o hay backoff."""
+        if not self.enabled:
+            return
+        # Primero la IP: una inundación desde una IP no toca los buckets de las cuentas
+        if ip_address:
+            wait = await self.store.acquire(f"{action}:ip:{ip_address}", self.ip_rate, self.ip_burst)
+            if wait > 0:
+                self.throttled += 1
+                raise Throttled("ip", wait)
+        wait = await self.store.acquire(f"{action}:user:{user}", self.user_rate, self.user_burst)
+        if wait > 0:
+            self.throttled += 1
+            raise Throttled("user", wait)
+        self.allowed += 1
+
+    async def failure(self, action: str, user: str, ip_address: Optional[str]) -> None:
+        """Registra un intento fallido (contraseña incorrecta) para el usuario y su IP."""
+        if not self.enabled:
+            return
+        self.failures += 1
+        params = (self.free_failures, self.backoff_base, self.backoff_max, self.failure_window)
+        await self.store.fail(f"{action}:user:{user}", *params)
+        if ip_address:
+            await self.store.fail(f"{action}:ip:{ip_address}", *params)
+
+    async def success(self, action: str, user: str) -> None:
+        if self.enabled:
+            await self.store.clear(f"{action}:user:{user}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.store.stats(),
+            "enabled": int(self.enabled),
+            "allowed": self.allowed,
+            "throttled": self.throttled,
+            "failures": self.failures,
+            "swept": self.swept,
+        }
+
+
+def build_throttle_store(backend: str) -> ThrottleStore:
+    """Crea el almacén configurado en THROTTLE_BACKEND ("memory" o "redis")."""
+    # Tras este tiempo sin actividad el bucket vuelve a estar lleno y los fallos
+    # han caducado: la entrada ya no aporta nada
+    idle_seconds = max(
+        settings.THROTTLE_USER_BURST / settings.THROTTLE_USER_RATE,
+        settings.THROTTLE_IP_BURST / settings.THROTTLE_IP_RATE,
+        settings.THROTTLE_BACKOFF_MAX_SECONDS,
+        settings.THROTTLE_FAILURE_WINDOW_SECONDS,
+    )
+    local = MemoryThrottleStore(settings.THROTTLE_MAX_ENTRIES, idle_seconds)
+    if backend == "memory":
+        return local
+    if backend == "redis":
+        # Dependencia opcional: solo se necesita con el estado compartido
+        import redis.asyncio
+
+        client = redis.asyncio.from_url(settings.THROTTLE_REDIS_URL, socket_timeout=0.5)
+        return RedisThrottleStore(client, local, idle_seconds)
+    raise ValueError(f"Backend de limitación desconocido: {backend}")
+
+
+# --- Instancia Singleton ---
+throttle = Throttle(
+    store=build_throttle_store(settings.THROTTLE_BACKEND),
+    enabled=settings.THROTTLE_ENABLED,
+    user_rate=settings.THROTTLE_USER_RATE,
+    user_burst=settings.THROTTLE_USER_BURST,
+    ip_rate=settings.THROTTLE_IP_RATE,
+    ip_burst=settings.THROTTLE_IP_BURST,
+    free_failures=settings.THROTTLE_FREE_FAILURES,
+    backoff_base=settings.THROTTLE_BACKOFF_BASE_SECONDS,
+    backoff_max=settings.THROTTLE_BACKOFF_MAX_SECONDS,
+    failure_window=settings.THROTTLE_FAILURE_WINDOW_SECONDS,
+    sweep_interval=settings.THROTTLE_SWEEP_INTERVAL,
+)
@@ -0,0 +1,18 @@
+"""
+Benchmarks reproducibles de AegisVault.
+
+    # Micro-benchmarks del CryptoEngine
+    python -m benchmarks.micro --output micro.json
+    python -m benchmarks.micro --baseline micro.json      # marca regresiones
+
+    # Carga sobre la API (en proceso contra DATABASE_URL, o contra un servidor)
+    python -m benchmarks.load --users 20 --output load.json
+    python -m benchmarks.load --base-url http://localhost:8000 --baseline load.json
+
+    # Arranque: import, create_app y lifespan en procesos nuevos
+    python -m benchmarks.startup --runs 5 --output startup.json
+
+Los resultados se guardan en JSON con el entorno de ejecución; con `--baseline`
+se comparan y el proceso sale con código 1 si alguna métrica empeora más de
+`--tolerance` (por defecto 20 %).
+"""
@@ -0,0 +1,211 @@
+"""
+Generador de carga con guion: register -> login -> create -> unlock -> read -> share.
+
+Por defecto levanta la app en el mismo proceso (httpx.ASGITransport) contra la
+base de datos de DATABASE_URL; con --base-url ataca un servidor ya arrancado.
+Las consultas SQL por endpoint se obtienen de la diferencia de /metrics antes y
+después de cada fase (requiere METRICS_ENABLED en el servidor y su OPS_TOKEN en el entorno).
+Todas las peticiones salen de una misma IP: en proceso se desactiva la limitación
+de login/unlock; contra un servidor externo, arrancarlo con THROTTLE_ENABLED=false.
+"""
+import argparse
+import asyncio
+import os
+import re
+import sys
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from benchmarks import report
+
+PASSWORD = "benchmark-password"
+
+# Paso -> (método, plantilla de la ruta tal como aparece en /metrics)
+STEPS: Dict[str, Tuple[str, str]] = {
+    "register": ("POST", "/api/auth/register"),
+    "login": ("POST", "/api/auth/login"),
+    "create": ("POST", "/api/secrets/"),
+    "unlock": ("POST", "/api/auth/unlock"),
+    "read": ("GET", "/api/secrets/{secret_id}"),
+    "share": ("POST", "/api/secrets/{secret_id}/share"),
+}
+
+_DB_QUERIES_LINE = re.compile(r'^aegisvault_http_request_db_queries_(sum|count)\{route="([^"]*)"\} ([0-9.e+-]+)$')
+
+
+async def scrape_db_queries(client: httpx.AsyncClient) -> Dict[str, Tuple[float, float]]:
+    """route -> (suma de consultas, peticiones) según /metrics; vacío si no está disponible."""
+    try:
+        response = await client.get("/metrics", headers={"X-Ops-Token": os.environ.get("OPS_TOKEN", "")})
+    except httpx.HTTPError:
+        return {}
+    if response.status_code != 200:
+        return {}
+    totals: Dict[str, List[float]] = defaultdict(lambda: [0.0, 0.0])
+    for line in response.text.splitlines():
+        match = _DB_QUERIES_LINE.match(line)
+        if match:
+            kind, route, value = match.groups()
+            totals[route][0 if kind == "sum" else 1] = float(value)
+    return {route: (values[0], values[1]) for route, values in totals.items()}
+
+
+class LoadRun:
+    def __init__(self, client: httpx.AsyncClient, concurrency: int):
+        self.client = client
+        self.concurrency = concurrency
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.elapsed: Dict[str, float] = {}
+        self.db_queries: Dict[str, Optional[float]] = {}
+
+    async def call(self, step: str, url: str, expected: int, **kwargs: Any) -> Optional[httpx.Response]:
+        method = STEPS[step][0]
+        t0 = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[step] += 1
+            return None
+        elapsed = time.perf_counter() - t0
+        if response.status_code != expected:
+            self.errors[step] += 1
+            return None
+        self.durations[step].append(elapsed)
+        return response
+
+    async def phase(self, step: str, jobs: Sequence[Callable[[], Awaitable[None]]]) -> None:
+        """Ejecuta los trabajos de una fase con `concurrency` peticiones en vuelo."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        before = await scrape_db_queries(self.client)
+
+        async def bounded(job: Callable[[], Awaitable[None]]) -> None:
+            async with semaphore:
+                await job()
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(bounded(job) for job in jobs))
+        self.elapsed[step] = time.perf_counter() - t0
+
+        after = await scrape_db_queries(self.client)
+        route = STEPS[step][1]
+        if route in after:
+            total_before, count_before = before.get(route, (0.0, 0.0))
+            total_after, count_after = after[route]
+            requests = count_after - count_before
+            self.db_queries[step] = round((total_after - total_before) / requests, 2) if requests else None
+
+    def results(self) -> Dict[str, Dict[str, Any]]:
+        results = {}
+        for step, (method, route) in STEPS.items():
+            if step not in self.elapsed:
+                continue
+            summary = report.summarize(self.durations[step], self.elapsed[step], self.errors[step])
+            summary.update(route=f"{method} {route}", db_queries=self.db_queries.get(step))
+            results[step] = summary
+        return results
+
+
+async def scenario(run: LoadRun, users: int, secrets_per_user: int, reads_per_secret: int, payload_bytes: int) -> None:
+    prefix = f"bench_{uuid.uuid4().hex[:8]}"
+    usernames = [f"{prefix}_{i}" for i in range(users)]
+    auth: Dict[int, Dict[str, str]] = {}
+    unlock: Dict[int, Dict[str, str]] = {}
+    secret_ids: Dict[int, List[str]] = defaultdict(list)
+
+    async def register(i: int) -> None:
+        await run.call("register", "/api/auth/register", 200, json={"username": usernames[i], "password": PASSWORD})
+
+    async def login(i: int) -> None:
+        response = await run.call("login", "/api/auth/login", 200, data={"username": usernames[i], "password": PASSWORD})
+        if response is not None:
+            auth[i] = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def create(i: int, k: int) -> None:
+        body = {"name": f"secret-{k}", "content": os.urandom(payload_bytes // 2).hex()}
+        response = await run.call("create", "/api/secrets/", 200, json=body, headers=auth[i])
+        if response is not None:
+            secret_ids[i].append(response.json()["id"])
+
+    async def do_unlock(i: int) -> None:
+        response = await run.call("unlock", "/api/auth/unlock", 200, headers={**auth[i], "X-User-Password": PASSWORD})
+        if response is not None:
+            unlock[i] = {**auth[i], "X-Unlock-Token": response.json()["unlock_token"]}
+
+    async def read(i: int, secret_id: str) -> None:
+        await run.call("read", f"/api/secrets/{secret_id}", 200, headers=unlock[i])
+
+    async def share(i: int, secret_id: str) -> None:
+        body = {"username_to_share_with": usernames[(i + 1) % users]}
+        await run.call("share", f"/api/secrets/{secret_id}/share", 201, json=body, headers=unlock[i])
+
+    await run.phase("register", [lambda i=i: register(i) for i in range(users)])
+    await run.phase("login", [lambda i=i: login(i) for i in range(users)])
+    await run.phase("create", [lambda i=i, k=k: create(i, k) for i in auth for k in range(secrets_per_user)])
+    await run.phase("unlock", [lambda i=i: do_unlock(i) for i in auth])
+    await run.phase("read", [
+        lambda i=i, s=s: read(i, s) for i in unlock for s in secret_ids[i] for _ in range(reads_per_secret)
+    ])
+    if users > 1:
+        await run.phase("share", [lambda i=i, s=s: share(i, s) for i in unlock for s in secret_ids[i]])
+
+
+@asynccontextmanager
+async def open_client(base_url: Optional[str]) -> AsyncIterator[httpx.AsyncClient]:
+    if base_url:
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+            yield client
+        return
+    # En proceso: misma app y mismos hooks de arranque/parada que con uvicorn.
+    # Todos los usuarios virtuales comparten IP: la limitación por IP los frenaría
+    os.environ.setdefault("THROTTLE_ENABLED", "false")
+    os.environ.setdefault("OPS_TOKEN", uuid.uuid4().hex)
+    from app.main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=60) as client:
+            yield client
+
+
+async def run_load(args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    async with open_client(args.base_url) as client:
+        run = LoadRun(client, args.concurrency)
+        await scenario(run, args.users, args.secrets, args.reads, args.payload_bytes)
+        return run.results()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API de AegisVault.")
+    parser.add_argument("--base-url", help="Servidor a atacar (por defecto, la app en proceso contra DATABASE_URL)")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--secrets", type=int, default=5, help="Secretos por usuario")
+    parser.add_argument("--reads", type=int, default=5, help="Lecturas por secreto")
+    parser.add_argument("--payload-bytes", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=10, help="Peticiones en vuelo por fase")
+    parser.add_argument("--output", help="Fichero JSON donde guardar los resultados")
+    parser.add_argument("--baseline", help="Resultados JSON previos con los que comparar")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Empeoramiento tolerado antes de marcar regresión")
+    args = parser.parse_args()
+
+    results = asyncio.run(run_load(args))
+    report.print_table(results, extra_columns=["db_queries"])
+
+    env = report.environment({
+        "target": args.base_url or "in-process",
+        "users": args.users,
+        "secrets_per_user": args.secrets,
+        "reads_per_secret": args.reads,
+        "payload_bytes": args.payload_bytes,
+        "concurrency": args.concurrency,
+    })
+    return report.finish("load", results, env, args.output, args.baseline, args.tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,99 @@
+import json
+import math
+import os
+import platform
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+# Métricas comparadas con la línea base: (campo, True si "más alto es peor")
+COMPARED_FIELDS = (("p50_ms", True), ("p95_ms", True), ("p99_ms", True), ("throughput", False))
+
+
+def percentile(sorted_values: Sequence[float], pct: float) -> float:
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(durations: Sequence[float], elapsed: Optional[float] = None, errors: int = 0) -> Dict[str, Any]:
+    """Resumen de una serie de duraciones en segundos: percentiles en ms y operaciones por segundo."""
+    values = sorted(durations)
+    total = elapsed if elapsed is not None else sum(values)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(values[-1] * 1000, 3) if values else 0.0,
+        "throughput": round(len(values) / total, 2) if total > 0 else 0.0,
+    }
+
+
+def environment(extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    env = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    env.update(extra or {})
+    return env
+
+
+def save(path: str, kind: str, results: Dict[str, Dict[str, Any]], env: Dict[str, Any]) -> None:
+    with open(path, "w") as f:
+        json.dump({"kind": kind, "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "environment": env, "results": results}, f, indent=2, sort_keys=True)
+
+
+def load(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    """Regresiones respecto a la línea base: percentiles que suben o throughput que baja más de `tolerance`."""
+    regressions = []
+    for name, current in sorted(results.items()):
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for field, higher_is_worse in COMPARED_FIELDS:
+            old, new = previous.get(field), current.get(field)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (higher_is_worse and change > tolerance) or (not higher_is_worse and -change > tolerance):
+                regressions.append(f"{name}: {field} {old:g} -> {new:g} ({change:+.0%})")
+    return regressions
+
+
+def print_table(results: Dict[str, Dict[str, Any]], extra_columns: Sequence[str] = ()) -> None:
+    columns = ["count", "errors", "p50_ms", "p95_ms", "p99_ms", "throughput"] + list(extra_columns)
+    width = max([len(name) for name in results] + [10])
+    print(f"{'':<{width}} " + " ".join(f"{c:>12}" for c in columns))
+    for name, summary in results.items():
+        print(f"{name:<{width}} " + " ".join(f"{str(summary.get(c, '')):>12}" for c in columns))
+
+
+def finish(kind: str, results: Dict[str, Dict[str, Any]], env: Dict[str, Any], output: Optional[str], baseline_path: Optional[str], tolerance: float) -> int:
+    """Guarda, compara y devuelve el código de salida (1 si hay regresiones)."""
+    if output:
+        save(output, kind, results, env)
+        print(f"\nResultados guardados en {output}")
+    if not baseline_path:
+        return 0
+    baseline = load(baseline_path)
+    if baseline.get("kind") != kind:
+        print(f"\nLa línea base {baseline_path} es de tipo '{baseline.get('kind')}', no '{kind}'")
+        return 2
+    regressions = compare(results, baseline["results"], tolerance)
+    if not regressions:
+        print(f"\nSin regresiones respecto a {baseline_path} (tolerancia {tolerance:.0%})")
+        return 0
+    print(f"\nREGRESIONES respecto a {baseline_path} (tolerancia {tolerance:.0%}):")
+    for line in regressions:
+        print(f"  - {line}")
+    return 1
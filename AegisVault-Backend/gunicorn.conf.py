@@ -0,0 +1,26 @@
+"""
+Configuración de gunicorn con workers de uvicorn:
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+preload_app importa la aplicación una sola vez en el proceso maestro y los
+workers se crean por fork después: comparten (copy-on-write) la memoria de los
+módulos ya cargados y arrancan sin repetir los imports. Importar la app no abre
+conexiones ni lanza tareas; cada worker crea su pool y sus tareas en el lifespan.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# Margen para que el lifespan cierre trabajos de rotación y vacíe la auditoría en cola
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.getenv("TIMEOUT", "60"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
@@ -0,0 +1,80 @@
+"""Esquema original (el que creaba create_all antes de las migraciones)
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+Las bases de datos creadas con create_all por versiones anteriores se marcan
+con `alembic stamp 0001` y después se actualizan con `alembic upgrade head`.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "users",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("username", sa.String(50), nullable=False),
+        sa.Column("password_hash", sa.String(255), nullable=False),
+        sa.Column("public_key", sa.Text(), nullable=False, comment="Clave pública RSA en formato PEM"),
+        sa.Column("encrypted_private_key", sa.Text(), nullable=False, comment="Clave privada RSA cifrada con la contraseña del usuario"),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_users_username", "users", ["username"], unique=True)
+
+    op.create_table(
+        "secrets",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("name", sa.String(100), nullable=False),
+        sa.Column("description", sa.Text(), nullable=True),
+        sa.Column("is_deleted", sa.Boolean(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("owner_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("users.id"), nullable=False),
+    )
+    op.create_index("ix_secrets_name", "secrets", ["name"])
+
+    op.create_table(
+        "secret_versions",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("version_number", sa.Integer(), nullable=False),
+        sa.Column("encrypted_data", sa.LargeBinary(), nullable=False, comment="El contenido del secreto, cifrado"),
+        sa.Column("nonce_iv", sa.LargeBinary(), nullable=False, comment="Vector de inicialización para el cifrado AES-GCM"),
+        sa.Column("auth_tag", sa.LargeBinary(), nullable=False, comment="Tag de autenticación para el cifrado AES-GCM"),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("secret_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("secrets.id"), nullable=False),
+    )
+
+    op.create_table(
+        "secret_keys",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("encrypted_aes_key", sa.LargeBinary(), nullable=False, comment="Llave AES envuelta con la llave pública RSA del usuario"),
+        sa.Column("granted_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("secret_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("secrets.id"), nullable=False),
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("users.id"), nullable=False),
+    )
+
+    op.create_table(
+        "audit_logs",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("action", sa.String(50), nullable=False, comment="Ej: 'USER_LOGIN', 'SECRET_CREATE', 'SECRET_READ'"),
+        sa.Column("resource_id", postgresql.UUID(as_uuid=True), nullable=True, comment="ID del recurso afectado (ej: secret_id)"),
+        sa.Column("ip_address", postgresql.INET(), nullable=True),
+        sa.Column("timestamp", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("users.id"), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("audit_logs")
+    op.drop_table("secret_keys")
+    op.drop_table("secret_versions")
+    op.drop_table("secrets")
+    op.drop_index("ix_users_username", table_name="users")
+    op.drop_table("users")
@@ -0,0 +1,147 @@
+"""Columnas, índices y tablas añadidos sobre el esquema original
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+- users: KEK simétrica envuelta (encrypted_kek).
+- secrets: kind, media_type, current_version y key_generation; índices de
+  paginación por (created_at, id) y de búsqueda por prefijo de nombre.
+- secret_versions: payloads externos (blob_ref), binarios por bloques
+  (chunk_count, tabla secret_chunks) y generación de llave; número de versión único.
+- secret_keys: wrap_alg, key_generation y rewrapped_aes_key; acceso único por
+  (usuario, secreto, generación).
+- audit_logs: índice (user_id, timestamp).
+- rotation_jobs: progreso de las rotaciones de llaves.
+
+Los índices sobre tablas que ya pueden tener muchas filas se crean con
+CONCURRENTLY (fuera de la transacción) para no bloquear escrituras.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # --- users ---
+    op.add_column("users", sa.Column("encrypted_kek", sa.LargeBinary(), nullable=True, comment="KEK AES-256 envuelta con la llave pública RSA del usuario"))
+
+    # --- secrets ---
+    op.add_column("secrets", sa.Column("kind", sa.String(10), nullable=False, server_default="text"))
+    op.add_column("secrets", sa.Column("media_type", sa.String(100), nullable=True, comment="Content-Type de los secretos binarios"))
+    op.add_column("secrets", sa.Column("current_version", sa.Integer(), nullable=False, server_default="1"))
+    op.add_column("secrets", sa.Column("key_generation", sa.Integer(), nullable=False, server_default="1"))
+    # Antes se leía siempre la última versión: current_version parte de ella
+    op.execute(
+        "UPDATE secrets SET current_version = v.latest "
+        "FROM (SELECT secret_id, max(version_number) AS latest FROM secret_versions GROUP BY secret_id) AS v "
+        "WHERE v.secret_id = secrets.id"
+    )
+
+    # --- secret_versions ---
+    op.alter_column("secret_versions", "encrypted_data", existing_type=sa.LargeBinary(), nullable=True)
+    op.alter_column("secret_versions", "auth_tag", existing_type=sa.LargeBinary(), nullable=True)
+    op.alter_column(
+        "secret_versions", "nonce_iv", existing_type=sa.LargeBinary(), existing_nullable=False,
+        comment="Vector de inicialización (nonce base en las versiones binarias)",
+        existing_comment="Vector de inicialización para el cifrado AES-GCM",
+    )
+    op.add_column("secret_versions", sa.Column("blob_ref", sa.String(100), nullable=True, comment="Referencia '<backend>:<sha256>' en el almacén de blobs"))
+    op.add_column("secret_versions", sa.Column("size_bytes", sa.BigInteger(), nullable=True, comment="Tamaño del payload (en claro para binarios, cifrado para texto)"))
+    op.add_column("secret_versions", sa.Column("chunk_count", sa.Integer(), nullable=True))
+    op.add_column("secret_versions", sa.Column("key_generation", sa.Integer(), nullable=False, server_default="1"))
+    op.create_index("uq_secret_versions_secret_id_version_number", "secret_versions", ["secret_id", "version_number"], unique=True)
+
+    op.create_table(
+        "secret_chunks",
+        sa.Column("version_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("secret_versions.id", ondelete="CASCADE"), primary_key=True),
+        sa.Column("chunk_index", sa.Integer(), primary_key=True),
+        sa.Column("data", sa.LargeBinary(), nullable=False),
+    )
+
+    # --- secret_keys ---
+    op.alter_column(
+        "secret_keys", "encrypted_aes_key", existing_type=sa.LargeBinary(), existing_nullable=False,
+        comment="Llave AES envuelta para el usuario (ver wrap_alg)",
+        existing_comment="Llave AES envuelta con la llave pública RSA del usuario",
+    )
+    op.add_column("secret_keys", sa.Column("wrap_alg", sa.String(16), nullable=False, server_default="rsa-oaep"))
+    op.add_column("secret_keys", sa.Column("key_generation", sa.Integer(), nullable=False, server_default="1"))
+    op.add_column("secret_keys", sa.Column("rewrapped_aes_key", sa.LargeBinary(), nullable=True))
+    # El esquema original no impedía accesos duplicados: se conserva el más antiguo
+    op.execute(
+        "DELETE FROM secret_keys AS a USING secret_keys AS b "
+        "WHERE a.user_id = b.user_id AND a.secret_id = b.secret_id "
+        "AND (a.granted_at, a.id) > (b.granted_at, b.id)"
+    )
+    op.create_index("ix_secret_keys_user_id_secret_id_generation", "secret_keys", ["user_id", "secret_id", "key_generation"], unique=True)
+
+    # --- rotation_jobs ---
+    op.create_table(
+        "rotation_jobs",
+        sa.Column("id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("kind", sa.String(20), nullable=False, comment="'secret_key' o 'user_keypair'"),
+        sa.Column("target_id", postgresql.UUID(as_uuid=True), nullable=False, comment="Secreto o usuario rotado"),
+        sa.Column("status", sa.String(20), nullable=False),
+        sa.Column("stage", sa.String(20), nullable=False),
+        sa.Column("cursor", sa.String(64), nullable=True, comment="Último id procesado de la etapa en curso"),
+        sa.Column("processed", sa.Integer(), nullable=False),
+        sa.Column("total", sa.Integer(), nullable=False),
+        sa.Column("from_generation", sa.Integer(), nullable=True),
+        sa.Column("to_generation", sa.Integer(), nullable=True),
+        sa.Column("new_public_key", sa.Text(), nullable=True),
+        sa.Column("new_encrypted_private_key", sa.Text(), nullable=True),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("started_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("updated_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("finished_at", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("users.id"), nullable=False),
+    )
+    op.create_index("ix_rotation_jobs_target_status", "rotation_jobs", ["target_id", "status"])
+    op.create_index("ix_rotation_jobs_user_id_created_at", "rotation_jobs", ["user_id", "created_at"])
+
+    # --- Índices de lectura sobre tablas grandes, sin bloquear escrituras ---
+    with op.get_context().autocommit_block():
+        op.create_index("ix_secrets_created_at_id", "secrets", ["created_at", "id"], postgresql_concurrently=True)
+        op.create_index("ix_secrets_owner_created_at_id", "secrets", ["owner_id", "created_at", "id"], postgresql_concurrently=True)
+        op.create_index("ix_secrets_name_prefix", "secrets", ["name"], postgresql_ops={"name": "text_pattern_ops"}, postgresql_concurrently=True)
+        op.create_index("ix_audit_logs_user_id_timestamp", "audit_logs", ["user_id", "timestamp"], postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_audit_logs_user_id_timestamp", table_name="audit_logs")
+    op.drop_index("ix_secrets_name_prefix", table_name="secrets")
+    op.drop_index("ix_secrets_owner_created_at_id", table_name="secrets")
+    op.drop_index("ix_secrets_created_at_id", table_name="secrets")
+
+    op.drop_index("ix_rotation_jobs_user_id_created_at", table_name="rotation_jobs")
+    op.drop_index("ix_rotation_jobs_target_status", table_name="rotation_jobs")
+    op.drop_table("rotation_jobs")
+
+    op.drop_index("ix_secret_keys_user_id_secret_id_generation", table_name="secret_keys")
+    op.drop_column("secret_keys", "rewrapped_aes_key")
+    op.drop_column("secret_keys", "key_generation")
+    op.drop_column("secret_keys", "wrap_alg")
+
+    # Las versiones binarias o externas no caben en el esquema original
+    op.drop_table("secret_chunks")
+    op.drop_index("uq_secret_versions_secret_id_version_number", table_name="secret_versions")
+    op.drop_column("secret_versions", "key_generation")
+    op.drop_column("secret_versions", "chunk_count")
+    op.drop_column("secret_versions", "size_bytes")
+    op.drop_column("secret_versions", "blob_ref")
+    op.alter_column("secret_versions", "auth_tag", existing_type=sa.LargeBinary(), nullable=False)
+    op.alter_column("secret_versions", "encrypted_data", existing_type=sa.LargeBinary(), nullable=False)
+
+    op.drop_column("secrets", "key_generation")
+    op.drop_column("secrets", "current_version")
+    op.drop_column("secrets", "media_type")
+    op.drop_column("secrets", "kind")
+
+    op.drop_column("users", "encrypted_kek")
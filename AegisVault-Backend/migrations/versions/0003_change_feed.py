@@ -0,0 +1,44 @@
+"""Feed de cambios de secretos y accesos
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+- user_change_sequences: último seq asignado a cada usuario (una fila por
+  usuario, creada al registrarse; aquí se rellena para los existentes).
+- secret_changes: cambios por usuario en orden de seq, leídos por /api/changes.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user_change_sequences",
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("users.id"), primary_key=True),
+        sa.Column("last_seq", sa.BigInteger(), nullable=False, server_default="0"),
+    )
+    op.execute("INSERT INTO user_change_sequences (user_id, last_seq) SELECT id, 0 FROM users")
+
+    op.create_table(
+        "secret_changes",
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), primary_key=True),
+        sa.Column("seq", sa.BigInteger(), primary_key=True, autoincrement=False),
+        sa.Column("secret_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("kind", sa.String(16), nullable=False, comment="'created', 'updated', 'version', 'shared' o 'deleted'"),
+        sa.Column("version_number", sa.Integer(), nullable=True),
+        sa.Column("created_at", sa.DateTime(timezone=True), nullable=False),
+    )
+    op.create_index("ix_secret_changes_created_at", "secret_changes", ["created_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_secret_changes_created_at", table_name="secret_changes")
+    op.drop_table("secret_changes")
+    op.drop_table("user_change_sequences")
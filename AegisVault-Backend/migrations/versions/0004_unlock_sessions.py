@@ -0,0 +1,37 @@
+"""Sesiones de desbloqueo compartidas entre workers
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+
+- unlock_sessions: una fila por token de /api/auth/unlock (hash del token y
+  llave privada + KEK selladas con él). Sustituye a la caché en memoria de cada
+  worker como fuente de verdad; las sesiones vivas antes de migrar se pierden
+  y los clientes vuelven a desbloquear.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "unlock_sessions",
+        sa.Column("token_hash", sa.String(64), primary_key=True, comment="SHA-256 del token de desbloqueo"),
+        sa.Column("user_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("users.id"), nullable=False),
+        sa.Column("sealed_keys", sa.LargeBinary(), nullable=False, comment="Llave privada y KEK selladas con el token (AES-GCM)"),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+    )
+    op.create_index("ix_unlock_sessions_user_id", "unlock_sessions", ["user_id"])
+    op.create_index("ix_unlock_sessions_expires_at", "unlock_sessions", ["expires_at"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_unlock_sessions_expires_at", table_name="unlock_sessions")
+    op.drop_index("ix_unlock_sessions_user_id", table_name="unlock_sessions")
+    op.drop_table("unlock_sessions")
@@ -0,0 +1,90 @@
+"""
+Configuración común de las pruebas.
+
+Las pruebas de la API levantan la app sobre SQLite (aiosqlite) en un directorio
+temporal, sin Postgres: los tipos INET y UUID de Postgres se compilan como texto
+y el motor ignora los parámetros del pool que solo entiende asyncpg. Las
+variables de entorno se fijan antes de importar `app` porque `settings` se lee
+al importar.
+"""
+import os
+import shutil
+import tempfile
+
+_TMP_DIR = tempfile.mkdtemp(prefix="aegisvault-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_TMP_DIR}/tests.sqlite")
+os.environ.setdefault("SECRET_KEY", "tests")
+os.environ.setdefault("DB_CREATE_ALL_ON_STARTUP", "1")
+os.environ.setdefault("OPS_TOKEN", "ops")
+# Costes mínimos: las pruebas comprueban formatos y flujos, no la resistencia del KDF
+os.environ.setdefault("KDF_SCRYPT_N", str(2**10))
+os.environ.setdefault("PASSWORD_ARGON2_TIME_COST", "1")
+os.environ.setdefault("PASSWORD_ARGON2_MEMORY_COST", "8192")
+os.environ.setdefault("RSA_KEY_POOL_SIZE", "4")
+
+import httpx
+import pytest
+import sqlalchemy.ext.asyncio as sa_async
+from sqlalchemy.dialects.postgresql import INET
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.ext.compiler import compiles
+
+
+@compiles(INET, "sqlite")
+def _inet_sqlite(type_, compiler, **kw):
+    return "VARCHAR(64)"
+
+
+@compiles(PG_UUID, "sqlite")
+def _uuid_sqlite(type_, compiler, **kw):
+    return "CHAR(32)"
+
+
+_create_async_engine = sa_async.create_async_engine
+
+
+def _create_sqlite_engine(url, **kwargs):
+    for option in ("pool_size", "max_overflow", "pool_timeout", "connect_args", "insertmanyvalues_page_size"):
+        kwargs.pop(option, None)
+    return _create_async_engine(url, **kwargs)
+
+
+sa_async.create_async_engine = _create_sqlite_engine
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_TMP_DIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def app(anyio_backend):
+    """La app con su lifespan completo (pools, auditoría, rotaciones, feed de cambios)."""
+    from app.main import app as fastapi_app
+
+    async with fastapi_app.router.lifespan_context(fastapi_app):
+        yield fastapi_app
+
+
+@pytest.fixture
+async def client(app):
+    transport = httpx.ASGITransport(app=app, client=("127.0.0.1", 5555))
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        yield c
+
+
+@pytest.fixture
+def register(client):
+    """Registra un usuario y devuelve sus cabeceras de autenticación (con y sin contraseña)."""
+    async def _register(username: str, password: str = "password123"):
+        r = await client.post("/api/auth/register", json={"username": username, "password": password})
+        assert r.status_code == 200, r.text
+        r = await client.post("/api/auth/login", data={"username": username, "password": password})
+        assert r.status_code == 200, r.text
+        auth = {"Authorization": f"Bearer {r.json()['access_token']}"}
+        return auth, {**auth, "x-user-password": password}
+    return _register
@@ -0,0 +1,58 @@
+import asyncio
+import uuid
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def _changes(client, headers, since=0, **params):
+    r = await client.get("/api/changes/", params={"since": since, **params}, headers=headers)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+async def test_sequences_are_gap_free_per_user(client, register):
+    owner, owner_pw = await register(f"owner{uuid.uuid4().hex[:8]}")
+    reader, _ = await register(bob := f"bob{uuid.uuid4().hex[:8]}")
+
+    r = await client.post("/api/secrets/", json={"name": "s", "content": "v1"}, headers=owner)
+    secret_id = r.json()["id"]
+    r = await client.post("/api/secrets/import", json={"secrets": [{"name": "a", "content": "x"}, {"name": "b", "content": "y"}]}, headers=owner)
+    assert r.status_code == 201, r.text
+    await client.post(f"/api/secrets/{secret_id}/share", json={"username_to_share_with": bob}, headers=owner_pw)
+    await client.put(f"/api/secrets/{secret_id}", json={"name": "s", "content": "v2"}, headers=owner_pw)
+
+    page = await _changes(client, owner)
+    assert [c["seq"] for c in page["changes"]] == [1, 2, 3, 4]
+    assert [c["kind"] for c in page["changes"]] == ["created", "created", "created", "version"]
+    assert page["cursor"] == 4 and not page["has_more"]
+
+    page = await _changes(client, reader)
+    assert [(c["seq"], c["kind"]) for c in page["changes"]] == [(1, "shared"), (2, "version")]
+
+
+async def test_paging_and_cursor_ahead_of_head(client, register):
+    owner, _ = await register(f"owner{uuid.uuid4().hex[:8]}")
+    for name in ("a", "b", "c"):
+        await client.post("/api/secrets/", json={"name": name, "content": "x"}, headers=owner)
+
+    page = await _changes(client, owner, since=1, limit=1)
+    assert [c["seq"] for c in page["changes"]] == [2] and page["has_more"] and page["cursor"] == 2
+    # Un cursor que no corresponde a esta secuencia obliga a resincronizar
+    r = await client.get("/api/changes/", params={"since": 9}, headers=owner)
+    assert r.status_code == 410
+
+
+async def test_long_poll_returns_the_next_change(client, register):
+    owner, _ = await register(f"owner{uuid.uuid4().hex[:8]}")
+    head = (await client.get("/api/changes/", headers=owner)).json()["cursor"]
+
+    async def create_later():
+        await asyncio.sleep(0.3)
+        await client.post("/api/secrets/", json={"name": "n", "content": "x"}, headers=owner)
+
+    task = asyncio.create_task(create_later())
+    page = await _changes(client, owner, since=head, wait=5)
+    await task
+    assert [c["seq"] for c in page["changes"]] == [head + 1]
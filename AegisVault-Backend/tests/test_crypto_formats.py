@@ -0,0 +1,143 @@
+import base64
+import os
+import uuid
+
+import pytest
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.keywrap import InvalidUnwrap
+
+from app.services import kdf
+from app.services.crypto_engine import WRAP_AES_KW, WRAP_RSA_OAEP, crypto_engine
+from app.services.session_keys import UnlockedKeys
+
+PASSWORD = "correct horse battery staple"
+
+
+@pytest.fixture(scope="module")
+def key_pair():
+    return crypto_engine.generate_rsa_key_pair()
+
+
+# --- Bundle v2 de la llave privada ---
+
+def test_private_key_bundle_round_trip(key_pair):
+    private_pem, _ = key_pair
+    bundle = crypto_engine.encrypt_rsa_private_key(private_pem, PASSWORD)
+
+    assert bundle.startswith(kdf.bundle_header(*kdf.default_kdf()) + ":")
+    assert crypto_engine.decrypt_rsa_private_key(bundle, PASSWORD) == private_pem
+    assert kdf.bundle_is_current(bundle)
+
+
+def test_private_key_bundle_wrong_password(key_pair):
+    bundle = crypto_engine.encrypt_rsa_private_key(key_pair[0], PASSWORD)
+    with pytest.raises(ValueError):
+        crypto_engine.decrypt_rsa_private_key(bundle, "otra contraseña")
+
+
+def test_private_key_bundle_header_is_authenticated(key_pair):
+    bundle = crypto_engine.encrypt_rsa_private_key(key_pair[0], PASSWORD)
+    version, kdf_name, params, *rest = bundle.split(":")
+    # Mismos parámetros en otro orden: la llave derivada es idéntica, solo cambia el AAD
+    reordered = ",".join(reversed(params.split(",")))
+    assert kdf.decode_params(reordered) == kdf.decode_params(params)
+    tampered = ":".join([version, kdf_name, reordered, *rest])
+
+    with pytest.raises(ValueError):
+        crypto_engine.decrypt_rsa_private_key(tampered, PASSWORD)
+
+
+def test_legacy_bundle_is_decrypted_and_rewrapped(key_pair):
+    private_pem, _ = key_pair
+    kdf_name, params = kdf.LEGACY_KDF
+    salt, nonce = os.urandom(16), os.urandom(12)
+    sealed = AESGCM(kdf.derive_key(kdf_name, params, PASSWORD.encode(), salt)).encrypt(nonce, private_pem, None)
+    legacy = ":".join(base64.b64encode(part).decode() for part in (salt, nonce, sealed[-16:], sealed[:-16]))
+
+    assert not kdf.bundle_is_current(legacy)
+    pem, rewrapped = crypto_engine.decrypt_and_rewrap_rsa_private_key(legacy, PASSWORD)
+    assert pem == private_pem
+    assert rewrapped is not None and kdf.bundle_is_current(rewrapped)
+    assert crypto_engine.decrypt_rsa_private_key(rewrapped, PASSWORD) == private_pem
+
+
+# --- Bloques de los secretos binarios ---
+
+def test_chunk_nonce_is_base_xor_index():
+    base = bytes(range(12))
+    assert crypto_engine._chunk_nonce(base, 0) == base
+    assert crypto_engine._chunk_nonce(base, 1) == bytes(range(11)) + bytes([11 ^ 1])
+    nonces = {crypto_engine._chunk_nonce(base, index) for index in range(1000)}
+    assert len(nonces) == 1000
+
+
+def test_chunk_aad_binds_context_index_and_final():
+    context = uuid.uuid4().bytes
+    aad = crypto_engine._chunk_aad(context, 3, False)
+    assert aad != crypto_engine._chunk_aad(context, 3, True)
+    assert aad != crypto_engine._chunk_aad(context, 4, False)
+    assert aad != crypto_engine._chunk_aad(uuid.uuid4().bytes, 3, False)
+
+
+def test_chunks_detect_reorder_truncation_and_mixing():
+    key, base = crypto_engine.generate_aes_key(), crypto_engine.generate_base_nonce()
+    context = uuid.uuid4().bytes
+    first = crypto_engine.encrypt_chunk(key, base, 0, b"primero", False, context)
+    last = crypto_engine.encrypt_chunk(key, base, 1, b"ultimo", True, context)
+
+    assert crypto_engine.decrypt_chunk(key, base, 0, first, False, context) == b"primero"
+    assert crypto_engine.decrypt_chunk(key, base, 1, last, True, context) == b"ultimo"
+    with pytest.raises(Exception):
+        crypto_engine.decrypt_chunk(key, base, 0, last, False, context)  # Reordenado
+    with pytest.raises(Exception):
+        crypto_engine.decrypt_chunk(key, base, 0, first, True, context)  # Truncado tras el primero
+    with pytest.raises(Exception):
+        crypto_engine.decrypt_chunk(key, base, 0, first, False, uuid.uuid4().bytes)  # Otra versión
+
+
+# --- Accesos con la KEK (AES-KW) ---
+
+def test_aes_kw_round_trip_and_wrong_kek():
+    kek, aes_key = crypto_engine.generate_kek(), crypto_engine.generate_aes_key()
+    wrapped = crypto_engine.wrap_key_kw(kek, aes_key)
+
+    assert len(wrapped) == len(aes_key) + 8
+    assert crypto_engine.unwrap_key_kw(kek, wrapped) == aes_key
+    with pytest.raises(InvalidUnwrap):
+        crypto_engine.unwrap_key_kw(crypto_engine.generate_kek(), wrapped)
+
+
+def test_rsa_grant_converts_to_aes_kw(key_pair):
+    private_pem, public_pem = key_pair
+    keys = UnlockedKeys(crypto_engine.load_private_key_pem(private_pem), crypto_engine.generate_kek())
+    aes_key = crypto_engine.generate_aes_key()
+    rsa_grant = crypto_engine.wrap_aes_key(aes_key, public_pem.decode())
+
+    assert keys.unwrap(rsa_grant, WRAP_RSA_OAEP) == aes_key
+    kw_grant = keys.rewrap_for_self(aes_key, WRAP_RSA_OAEP)
+    assert kw_grant is not None
+    assert keys.unwrap(kw_grant, WRAP_AES_KW) == aes_key
+    # Ya convertido, o sin KEK desbloqueada: no hay nada que reescribir
+    assert keys.rewrap_for_self(aes_key, WRAP_AES_KW) is None
+    assert UnlockedKeys(keys.private_key).rewrap_for_self(aes_key, WRAP_RSA_OAEP) is None
+    with pytest.raises(ValueError):
+        UnlockedKeys(keys.private_key).unwrap(kw_grant, WRAP_AES_KW)
+
+
+# --- Sesiones de desbloqueo selladas ---
+
+def test_unlock_seal_round_trip_and_binding(key_pair):
+    private_key = crypto_engine.load_private_key_pem(key_pair[0])
+    kek, user_id, token = crypto_engine.generate_kek(), uuid.uuid4().bytes, "token-de-prueba"
+    blob = crypto_engine.seal_unlocked_keys(token, user_id, private_key, kek)
+
+    unsealed, unsealed_kek = crypto_engine.unseal_unlocked_keys(token, user_id, blob)
+    assert unsealed_kek == kek
+    assert unsealed.private_numbers() == private_key.private_numbers()
+    with pytest.raises(Exception):
+        crypto_engine.unseal_unlocked_keys("otro-token", user_id, blob)
+    with pytest.raises(Exception):
+        crypto_engine.unseal_unlocked_keys(token, uuid.uuid4().bytes, blob)
+
+    _, no_kek = crypto_engine.unseal_unlocked_keys(token, user_id, crypto_engine.seal_unlocked_keys(token, user_id, private_key, None))
+    assert no_kek is None
@@ -0,0 +1,20 @@
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+from app.core.pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    timestamp, row_id = datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc), uuid.uuid4()
+    cursor = encode_cursor(timestamp, row_id)
+
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == (timestamp, row_id)
+
+
+@pytest.mark.parametrize("cursor", ["", "no-es-base64!", encode_cursor(datetime.now(), uuid.uuid4())[:-4]])
+def test_malformed_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
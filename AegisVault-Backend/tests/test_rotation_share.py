@@ -0,0 +1,111 @@
+import asyncio
+import uuid
+
+import pytest
+from sqlalchemy import func, select
+
+from app.db import models
+from app.db.session import SessionLocal
+from app.services.rotation import rotation_runner
+
+pytestmark = pytest.mark.anyio
+
+
+def _name(prefix: str) -> str:
+    return f"{prefix}{uuid.uuid4().hex[:8]}"
+
+
+async def _wait_for_job(client, headers, job_id) -> dict:
+    for _ in range(200):
+        job = (await client.get(f"/api/rotations/{job_id}", headers=headers)).json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        await asyncio.sleep(0.05)
+    raise AssertionError(f"La rotación {job_id} no terminó: {job}")
+
+
+async def test_share_waits_for_rotation_and_recipients_keep_access(client, register, monkeypatch):
+    owner, owner_pw = await register(_name("owner"))
+    reader, reader_pw = await register(bob := _name("bob"))
+    _, late_pw = await register(carol := _name("carol"))
+
+    r = await client.post("/api/secrets/", json={"name": "db", "content": "v1"}, headers=owner)
+    secret_id = r.json()["id"]
+    r = await client.post(f"/api/secrets/{secret_id}/share", json={"username_to_share_with": bob}, headers=owner_pw)
+    assert r.status_code == 201, r.text
+
+    # Trabajo creado pero sin arrancar: la rotación queda "en curso"
+    submitted = []
+    monkeypatch.setattr(rotation_runner, "submit", lambda *args: submitted.append(args))
+    r = await client.post(f"/api/rotations/secrets/{secret_id}", headers=owner_pw)
+    assert r.status_code == 202, r.text
+    job = r.json()
+
+    r = await client.post(f"/api/secrets/{secret_id}/share", json={"username_to_share_with": carol}, headers=owner_pw)
+    assert r.status_code == 409, r.text
+    r = await client.post("/api/secrets/share-bulk", json={"secret_ids": [secret_id], "usernames": [carol]}, headers=owner_pw)
+    assert r.json()["created"] == 0 and r.json()["items"][0]["status"] == "rotating", r.text
+    r = await client.put(f"/api/secrets/{secret_id}", json={"name": "db", "content": "v2"}, headers=owner_pw)
+    assert r.status_code == 409, r.text
+
+    monkeypatch.undo()
+    rotation_runner.submit(*submitted[0])
+    job = await _wait_for_job(client, owner, job["id"])
+    assert job["status"] == "completed" and job["to_generation"] == 2, job
+
+    # Tras la rotación el acceso compartido sigue vigente y se puede compartir de nuevo
+    for headers in (owner_pw, reader_pw):
+        r = await client.get(f"/api/secrets/{secret_id}", headers=headers)
+        assert r.status_code == 200 and r.json()["content"] == "v1", r.text
+    r = await client.post(f"/api/secrets/{secret_id}/share", json={"username_to_share_with": carol}, headers=owner_pw)
+    assert r.status_code == 201, r.text
+    r = await client.get(f"/api/secrets/{secret_id}", headers=late_pw)
+    assert r.status_code == 200 and r.json()["content"] == "v1", r.text
+
+    async with SessionLocal() as session:
+        generations = (await session.execute(
+            select(models.SecretKey.key_generation, func.count())
+            .where(models.SecretKey.secret_id == uuid.UUID(secret_id))
+            .group_by(models.SecretKey.key_generation)
+        )).all()
+    assert dict(generations) == {2: 3}
+
+
+async def test_shared_reader_follows_new_versions(client, register):
+    owner, owner_pw = await register(_name("owner"))
+    _, reader_pw = await register(bob := _name("bob"))
+
+    r = await client.post("/api/secrets/", json={"name": "api", "content": "v1"}, headers=owner)
+    secret_id = r.json()["id"]
+    await client.post(f"/api/secrets/{secret_id}/share", json={"username_to_share_with": bob}, headers=owner_pw)
+    r = await client.put(f"/api/secrets/{secret_id}", json={"name": "api", "content": "v2"}, headers=owner_pw)
+    assert r.status_code == 200, r.text
+
+    r = await client.get(f"/api/secrets/{secret_id}", headers=reader_pw)
+    assert r.json()["content"] == "v2"
+    r = await client.get(f"/api/secrets/{secret_id}", params={"version": 1}, headers=reader_pw)
+    assert r.json()["content"] == "v1"
+
+
+async def test_recipient_keypair_rotation_keeps_old_and_new_shares(client, register):
+    owner, owner_pw = await register(_name("owner"))
+    reader, reader_pw = await register(bob := _name("bob"))
+
+    r = await client.post("/api/secrets/", json={"name": "old", "content": "antes"}, headers=owner)
+    old_id = r.json()["id"]
+    await client.post(f"/api/secrets/{old_id}/share", json={"username_to_share_with": bob}, headers=owner_pw)
+
+    r = await client.post("/api/rotations/me/keypair", headers=reader_pw)
+    assert r.status_code == 202, r.text
+    job = await _wait_for_job(client, reader, r.json()["id"])
+    assert job["status"] == "completed", job
+
+    # El nuevo acceso se envuelve con la llave pública nueva de bob
+    r = await client.post("/api/secrets/", json={"name": "new", "content": "despues"}, headers=owner)
+    new_id = r.json()["id"]
+    r = await client.post(f"/api/secrets/{new_id}/share", json={"username_to_share_with": bob}, headers=owner_pw)
+    assert r.status_code == 201, r.text
+
+    for secret_id, content in ((old_id, "antes"), (new_id, "despues")):
+        r = await client.get(f"/api/secrets/{secret_id}", headers=reader_pw)
+        assert r.status_code == 200 and r.json()["content"] == content, r.text
@@ -0,0 +1,71 @@
+import pytest
+
+from app.services.throttle import MemoryThrottleStore, Throttle, Throttled, backoff_seconds
+
+pytestmark = pytest.mark.anyio
+
+# free, base, cap, window
+PARAMS = (3, 1.0, 300.0, 900.0)
+
+
+def test_backoff_is_free_then_exponential_then_capped():
+    assert [backoff_seconds(n, 3, 1.0, 300.0) for n in range(1, 8)] == [0.0, 0.0, 0.0, 1.0, 2.0, 4.0, 8.0]
+    assert backoff_seconds(100, 3, 1.0, 300.0) == 300.0
+
+
+async def test_token_bucket_allows_burst_then_waits():
+    store = MemoryThrottleStore(max_entries=10, idle_seconds=60)
+    assert [await store.acquire("k", rate=1.0, burst=3) for _ in range(3)] == [0.0, 0.0, 0.0]
+    wait = await store.acquire("k", rate=1.0, burst=3)
+    assert 0 < wait <= 1.0
+
+
+async def test_failures_block_until_cleared():
+    store = MemoryThrottleStore(max_entries=10, idle_seconds=60)
+    assert [await store.fail("k", *PARAMS) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert await store.fail("k", *PARAMS) == 1.0
+    assert await store.acquire("k", rate=1.0, burst=3) > 0
+
+    await store.clear("k")
+    assert await store.acquire("k", rate=1.0, burst=3) == 0.0
+
+
+async def test_eviction_prefers_entries_without_failures():
+    store = MemoryThrottleStore(max_entries=2, idle_seconds=60)
+    await store.fail("con-fallos", *PARAMS)
+    await store.acquire("sin-fallos", rate=1.0, burst=3)
+
+    await store.acquire("nueva", rate=1.0, burst=3)
+    assert set(store._entries) == {"con-fallos", "nueva"}
+    assert store.evicted == 1
+
+
+async def test_full_of_blocked_keys_rejects_acquire_but_not_failure():
+    store = MemoryThrottleStore(max_entries=1, idle_seconds=60)
+    for _ in range(4):
+        await store.fail("bloqueada", *PARAMS)
+
+    with pytest.raises(Throttled) as exc:
+        await store.acquire("nueva", rate=1.0, burst=3)
+    assert exc.value.scope == "capacity"
+    # El fallo de un intento ya resuelto no se convierte en 429
+    assert await store.fail("otra", *PARAMS) == 0.0
+    assert store.stats()["rejected"] == 1
+    assert store.stats()["dropped_failures"] == 1
+
+
+async def test_throttle_backs_off_user_after_free_failures():
+    throttle = Throttle(
+        MemoryThrottleStore(max_entries=100, idle_seconds=60), enabled=True,
+        user_rate=100.0, user_burst=100, ip_rate=100.0, ip_burst=100,
+        free_failures=2, backoff_base=1.0, backoff_max=60.0, failure_window=900.0, sweep_interval=60.0,
+    )
+    for _ in range(3):
+        await throttle.check("login", "alice", "10.0.0.1")
+        await throttle.failure("login", "alice", "10.0.0.1")
+
+    with pytest.raises(Throttled) as exc:
+        await throttle.check("login", "alice", "10.0.0.2")
+    assert exc.value.scope == "user" and exc.value.retry_after == 1
+    # Otra cuenta desde otra IP no hereda el bloqueo
+    await throttle.check("login", "bob", "10.0.0.3")
@@ -4,10 +4,17 @@ import { Secret, SecretDetail, CreateSecretParams } from '@/types/secret';
 export const SecretService = {
   /**
    * Obtiene la lista de secretos (Propios y Compartidos)
+   * El backend pagina por cursor: seguimos la cabecera 'x-next-cursor' hasta el final.
    */
   async getAll(): Promise<Secret[]> {
-    const { data } = await api.get<Secret[]>('/api/secrets/');
-    return data;
+    const secrets: Secret[] = [];
+    let cursor: string | undefined;
+    do {
+      const response = await api.get<Secret[]>('/api/secrets/', { params: { cursor } });
+      secrets.push(...response.data);
+      cursor = response.headers['x-next-cursor'];
+    } while (cursor);
+    return secrets;
   },
 
   /**